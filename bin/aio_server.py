@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Serve the mhapi app with the asyncio server, for use behind a reverse
+proxy. Stops gracefully on SIGTERM or SIGINT.
+"""
+
+import argparse
+import logging
+import sys
+
+import _pathfix
+
+from mhapi.web.aioserver import serve
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=
+        "Serve the mhapi app with an asyncio HTTP server")
+    parser.add_argument("-H", "--host", default="",
+                        help="Address to listen on, default all")
+    parser.add_argument("-p", "--port", type=int, default=8080,
+                        help="Port to listen on, default 8080")
+    parser.add_argument("-w", "--workers", type=int,
+                        help="Threads for requests that aren't cached,"
+                            +" default is the number of CPUs")
+    parser.add_argument("-q", "--queue-size", type=int, default=64,
+                        help="Requests waiting for a worker before new"
+                            +" ones get 503, default 64")
+    parser.add_argument("-c", "--max-connections", type=int, default=10000,
+                        help="Default 10000, may need a higher open file"
+                            +" limit (ulimit -n)")
+    parser.add_argument("-k", "--keepalive-timeout", type=float, default=75,
+                        help="Seconds to keep idle connections, default 75")
+    parser.add_argument("-s", "--shutdown-timeout", type=float, default=30,
+                        help="Seconds to wait for requests in progress on"
+                            +" shutdown, default 30")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    logging.getLogger("mhapi.aioserver").addHandler(logging.StreamHandler())
+
+    # import after parsing args, loading the app takes a few seconds
+    from mhapi.web.wsgi import application
+
+    serve(application, host=args.host, port=args.port,
+          workers=args.workers, queue_size=args.queue_size,
+          max_connections=args.max_connections,
+          keepalive_timeout=args.keepalive_timeout,
+          shutdown_timeout=args.shutdown_timeout)
+
+
+if __name__ == '__main__':
+    main()
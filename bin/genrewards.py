@@ -1,36 +1,113 @@
 #!/usr/bin/env python3
 """
 Script to generate static rewards files for all items.
+
+The files are generated in a new directory next to the output dir using a
+process pool, and the output dir is then switched to the new directory
+with a symlink swap, so the web server never serves a partially updated
+set of files.
 """
 
-import codecs
-import urllib.request, urllib.parse, urllib.error
+import io
+import os
 import os.path
+import sys
+import time
+import shutil
+import argparse
+import multiprocessing
 
 import _pathfix
 
+from mhapi import db as mhdb
 from mhapi.db import MHDB
 from mhapi import rewards
+from mhapi import model
+from mhapi.util import atomic_open
+from mhapi.build import (BuildManifest, fingerprint, file_fingerprint,
+                         code_fingerprint, stage_dir, publish_dir)
 
 
-def get_utf8_writer(writer):
-    return codecs.getwriter("utf8")(writer)
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=
+        "Generate static rewards files for all items")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="Only write files for items with changed"
+                            +" inputs since the last build")
+    parser.add_argument("-j", "--processes", type=int,
+                        help="Number of processes, default is the number of"
+                            +" CPUs")
+    parser.add_argument("--in-place", action="store_true",
+                        help="Write files directly to outdir instead of"
+                            +" publishing a new directory with a symlink"
+                            +" swap")
+    parser.add_argument("outdir", nargs="?",
+                        default=os.path.join(_pathfix.web_path, "rewards"))
+    return parser.parse_args(argv)
 
 
-if __name__ == '__main__':
-    import sys
-    import os
-    import os.path
-
-    if len(sys.argv) == 1:
-        outdir = os.path.join(_pathfix.web_path, "rewards")
-    elif len(sys.argv) == 2:
-        outdir = sys.argv[1]
+# per process BulkRewardsDB, loaded by the pool initializer
+_rewards_db = None
+
+
+def _init_worker(game):
+    global _rewards_db
+    _rewards_db = rewards.BulkRewardsDB(MHDB(game=game))
+
+
+def write_item_file(job):
+    """
+    Write rewards file for an item, @job is (item_id, path, fingerprint).
+    Returns (path, fingerprint, built) for BuildManifest.update.
+    """
+    item_id, item_file, item_fp = job
+    out = io.StringIO()
+    ir = rewards.ItemRewards(_rewards_db, _rewards_db.get_item(item_id))
+    ir.print_all(out)
+    with atomic_open(item_file, "w", encoding="utf8") as f:
+        f.write(out.getvalue())
+    return item_file, item_fp, True
+
+
+def write_item_files(game, jobs, processes):
+    """
+    Write rewards files for (item_id, path, fingerprint) @jobs, returns
+    list of (path, fingerprint, built).
+    """
+    if not jobs:
+        return []
+    processes = max(1, min(processes, len(jobs)))
+    if processes == 1:
+        _init_worker(game)
+        results = map(write_item_file, jobs)
+        pool = None
     else:
-        print(("Usage: %s [outdir]" % sys.argv[0]))
-        sys.exit(os.EX_USAGE)
+        pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                    initargs=(game,))
+        results = pool.imap_unordered(write_item_file, jobs, chunksize=8)
+
+    n = len(jobs)
+    done = []
+    start_time = time.time()
+    try:
+        for i, result in enumerate(results, 1):
+            elapsed = time.time() - start_time
+            rate = i / elapsed if elapsed > 0 else 0.0
+            print("[%d/%d] Writing %s (%0.1f items/s)"
+                  % (i, n, result[0], rate))
+            done.append(result)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    elapsed = time.time() - start_time
+    print("n = %d, %d processes, %0.1fs (%0.1f items/s)"
+          % (n, processes, elapsed, n / elapsed if elapsed else 0.0))
+    return done
+
 
-    err_out = get_utf8_writer(sys.stderr)
+def main():
+    args = parse_args(sys.argv[1:])
 
     # TODO: doesn't work if script is symlinked
     #db_path = os.path.dirname(sys.argv[0])
@@ -38,17 +115,22 @@ if __name__ == '__main__':
     # Determinen game from MHAPI_GAME and path based on game.
     db = MHDB()
 
-    if db.game == "gu":
-        items = db.get_items(exclude_types=[
-            "Palico Armor", "Palico Weapon", "Weapon", "Armor", "Decoration"])
+    items = rewards.get_reward_items(db)
+
+    if args.in_place:
+        builddir = args.outdir
+        if not os.path.isdir(builddir):
+            os.makedirs(builddir)
     else:
-        items = db.get_items(rewards.ITEM_TYPES)
+        builddir = stage_dir(args.outdir, link_previous=args.incremental)
+
+    try:
+        manifest = BuildManifest(builddir, enabled=args.incremental,
+                                 published=args.outdir)
 
-    # write all names json to /items.json
-    items_file = os.path.join(outdir, "items.json")
-    print("Writing", items_file)
-    with open(items_file, "w") as f:
-        out = get_utf8_writer(f)
+        # write all names json to /items.json
+        items_file = os.path.join(builddir, "items.json")
+        out = io.StringIO()
         out.write("[")
         first = True
         for item in items:
@@ -60,17 +142,36 @@ if __name__ == '__main__':
             out.write(item.name)
             out.write('"')
         out.write("]")
+        if manifest.write(items_file, out.getvalue()):
+            print("Writing", items_file)
+
+        # Rewards for an item come from quests, monsters and gathering rows
+        # all over the DB, so use the whole DB file as input rather than
+        # trying to track the rows.
+        common_fp = fingerprint(file_fingerprint(mhdb._db_path(db.game)),
+                                code_fingerprint(rewards, mhdb, model))
+
+        jobs = []
+        for item in items:
+            item_file = os.path.join(builddir, item.name + ".txt")
+            item_fp = fingerprint(common_fp, item)
+            if manifest.is_current(item_file, item_fp):
+                continue
+            jobs.append((item.id, item_file, item_fp))
 
-    for item in items:
-        name = item.name
-        item_id = item.id
-        encoded_name = name.encode("utf8")
-        item_file = os.path.join(outdir, encoded_name + ".txt")
-        print("Writing", item_id, item_file)
-        with open(item_file, "w") as f:
-            out = get_utf8_writer(f)
-            item_row = rewards.find_item(db, name, err_out)
-            if item_row is None:
-                sys.exit(os.EX_DATAERR)
-            ir = rewards.ItemRewards(db, item_row)
-            ir.print_all(out)
+        processes = args.processes or os.cpu_count() or 1
+        manifest.update(write_item_files(db.game, jobs, processes))
+        manifest.finish()
+
+        if not args.in_place:
+            publish_dir(builddir, args.outdir)
+            print("Published", args.outdir, "->", builddir)
+    except BaseException:
+        if not args.in_place:
+            # leave the published files alone
+            shutil.rmtree(builddir, ignore_errors=True)
+        raise
+
+
+if __name__ == '__main__':
+    main()
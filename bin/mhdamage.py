@@ -4,9 +4,15 @@ import sys
 import argparse
 import shlex
 import copy
-import codecs
 import os
 import os.path
+import io
+import csv
+import json
+import contextlib
+import heapq
+import multiprocessing
+import time
 from collections import defaultdict
 
 import _pathfix
@@ -18,10 +24,21 @@ from colorama import Fore
 
 from mhapi.db import MHDB, MHDBX
 from mhapi.damage import MotionValueDB, WeaponMonsterDamage
-from mhapi.damage import WeaponType, WeaponTypeMotionValues
+from mhapi.damage import WeaponType, WeaponTypeMotionValues, BreakEvenEnvelope
 from mhapi.model import SharpnessLevel, Weapon, ItemStars
+from mhapi.timeline import SharpnessTimeline
 from mhapi import skills
+from mhapi import templates
 from mhapi.util import ELEMENTS, WEAPON_TYPES, WTYPE_ABBR, DAMAGE_TYPES
+from mhapi.util import atomic_open, load_pickle_cache, save_pickle_cache
+from mhapi.build import (BuildManifest, fingerprint, file_fingerprint,
+                         code_fingerprint)
+from mhapi.damagerank import (get_wtype_match, get_element_match, crit_boost,
+                              wex_affinity, get_monster_breaks)
+from mhapi.damagerank import weapon_damage_result as _weapon_damage_result
+import mhapi.damage
+import mhapi.model
+import mhapi.db
 
 
 def weapon_match_tuple(arg):
@@ -40,6 +57,17 @@ def weapon_match_tuple(arg):
     return (wtype, element)
 
 
+def positive_int(arg):
+    try:
+        value = int(arg)
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise argparse.ArgumentTypeError("must be a positive integer: %r"
+                                         % arg)
+    return value
+
+
 ANY = object()
 def parse_stars(arg):
     if arg is None:
@@ -59,23 +87,6 @@ def quest_level_tuple(arg):
     return [parse_stars(p) for p in parts]
 
 
-def crit_boost(level):
-    assert(level >= 0 and level <= 3)
-    return 25 + 5 * level
-
-
-def wex_affinity(level):
-    if level == 0:
-        return 0
-    elif level == 1:
-        return 15
-    elif level == 2:
-        return 30
-    elif level == 3:
-        return 50
-    assert(False)
-
-
 def _make_db_sharpness_string(level_string):
     #print "level string", level_string
     level_value = SharpnessLevel.__dict__[level_string.upper()]
@@ -119,27 +130,6 @@ def weapon_stats_tuple(arg):
     return Weapon(weapon)
 
 
-def get_wtype_match(term):
-    abbr_result = WTYPE_ABBR.get(term.upper())
-    if abbr_result is not None:
-        return abbr_result
-    term = term.title()
-    for wtype in WEAPON_TYPES:
-        if wtype.startswith(term):
-            return wtype
-    raise ValueError("Unknown weapon type: %s" % term)
-
-
-def get_element_match(term):
-    term = term.title()
-    for element in ELEMENTS:
-        if element.startswith(term):
-            return element
-    if term.lower() == "raw":
-        return "Raw"
-    raise ValueError("Unknown element or status: %s" % term)
-
-
 def parse_weapon_arg(arg, base_args):
     """
     Return (name, skill_args), where skill_args is None if not specified.
@@ -276,16 +266,62 @@ def parse_args(argv):
     parser.add_argument("-r", "--rarity",
                         help="include weapons of given type with max rarity",
                         type=int, nargs="?")
+    parser.add_argument("--hunt-hits", type=int,
+                        help="Also rank weapons by total damage over the"
+                            +" given number of hits, with sharpness loss")
+    parser.add_argument("--hits-per-point", type=float, default=1.0,
+                        help="Hits before one sharpness point is lost,"
+                            +" used with --hunt-hits")
+    parser.add_argument("--sharpen-level", type=str.lower,
+                        choices=[SharpnessLevel.name(level).lower()
+                                 for level in SharpnessLevel.ALL],
+                        help="Sharpen when dropping below this sharpness"
+                            +" level, used with --hunt-hits")
+    parser.add_argument("--kill-hp", type=int,
+                        help="Also rank weapons by hits needed to deal the"
+                            +" given damage, with 10/50/90 percentiles from"
+                            +" the crit distribution (requires numpy)")
+    parser.add_argument("--stream", choices=["jsonl", "csv"],
+                        help="Print each weapon's average and part damage as"
+                            +" soon as it is calculated, as JSON Lines or"
+                            +" CSV. Tables and other output go to stderr")
+    parser.add_argument("--top", type=positive_int,
+                        help="With --stream, only print the N weapons with"
+                            +" the highest uniform average, sorted")
     parser.add_argument("--html-out",
                         help="Write table of values as HTML and save to path")
     parser.add_argument("--html-site",
                         help="Write entire site of all monster & quest levels")
+    parser.add_argument("--incremental", action="store_true", default=False,
+                        help="With --html-site, only rebuild pages whose"
+                            +" inputs changed since the last incremental"
+                            +" build, and remove pages no longer generated")
+    parser.add_argument("--batch",
+                        help="Run jobs from a JSON Lines or CSV file ('-' for"
+                            +" stdin) and print one JSON result per line")
+    parser.add_argument("-j", "--processes", type=int,
+                        help="Number of processes for --batch and"
+                            +" --html-site, default is the number of CPUs")
     parser.add_argument("-n", "--monster", help="Full name of monster")
     parser.add_argument("weapon", nargs="*",
                         help="One or more weapons of same class to compare,"
                              " full names")
 
-    return parser.parse_args(argv)
+    args = parser.parse_args(argv)
+    if args.top is not None and not args.stream:
+        parser.error("--top requires --stream")
+    if args.stream:
+        # stream mode only prints the averages and part damage
+        for option, value in (("--diff", args.diff),
+                              ("--phial", args.phial),
+                              ("--hunt-hits", args.hunt_hits),
+                              ("--kill-hp", args.kill_hp),
+                              ("--html-out", args.html_out),
+                              ("--html-site", args.html_site),
+                              ("--batch", args.batch)):
+            if value:
+                parser.error("%s can't be used with --stream" % option)
+    return args
 
 
 def print_sorted_phial_damage(names, damage_map_base, weapon_damage_map, parts,
@@ -330,24 +366,34 @@ def _get_part_headers(parts, damage_map_base, maxlen=4):
     return cols
 
 
+def _part_abbrs(parts, maxlen=4):
+    """
+    Short part names for table headers. Some monsters have parts with the
+    same prefix, e.g. Back and Back Legs, use the full name for those.
+    """
+    abbrs = []
+    for part in parts:
+        if part[:maxlen] in abbrs:
+            abbrs.append(part)
+        else:
+            abbrs.append(part[:maxlen])
+    return abbrs
+
+
 def write_damage_html(path, monster, monster_damage, quest_level, names,
                       damage_map_base, weapon_damage_map, parts,
                       part_max_damage, monster_breaks, monster_stars):
     print(path)
+    # pages show the first motion only, i.e. the average motion
+    weapon_damage_map = dict((name, wd_list[0])
+                             for name, wd_list in weapon_damage_map.items())
+
     def uniform_average(weapon):
         return weapon_damage_map[weapon].averages["uniform"]
 
     names_sorted = list(names)
     names_sorted.sort(key=uniform_average, reverse=True)
 
-    from mako.lookup import TemplateLookup
-    from mako.runtime import Context
-
-    tlookup = TemplateLookup(directories=["templates/damage"],
-                             output_encoding="utf-8",
-                             input_encoding="utf-8")
-    damage_template = tlookup.get_template("/monster_damage.html")
-
     wtype = damage_map_base.weapon.wtype
     weapon_damage_type = WeaponType.damage_type(wtype)
     damage_types = list(DAMAGE_TYPES)
@@ -357,45 +403,41 @@ def write_damage_html(path, monster, monster_damage, quest_level, names,
     weapon_types.remove("Light Bowgun")
     weapon_types.remove("Heavy Bowgun")
 
-    with codecs.open(path, "w", "utf8") as f:
-        template_args = dict(
-            monster=monster.name,
-            monster_damage=monster_damage,
-            damage_types=DAMAGE_TYPES,
-            weapon_types=weapon_types,
-            weapon_type=wtype,
-            weapon_damage_type=weapon_damage_type,
-            village_stars=quest_level[0],
-            guild_stars=quest_level[1],
-            part_names=parts,
-            part_max_damage=part_max_damage,
-            weapon_names=names_sorted,
-            weapon_damage_map=weapon_damage_map,
-            monster_breaks=set(monster_breaks),
-            monster_stars=monster_stars
-        )
-        ctx = Context(f, **template_args)
-        damage_template.render_context(ctx)
+    template_args = dict(
+        monster=monster.name,
+        monster_damage=monster_damage,
+        damage_types=DAMAGE_TYPES,
+        weapon_types=weapon_types,
+        weapon_type=wtype,
+        weapon_damage_type=weapon_damage_type,
+        village_stars=quest_level[0],
+        guild_stars=quest_level[1],
+        part_names=parts,
+        part_max_damage=part_max_damage,
+        weapon_names=names_sorted,
+        weapon_damage_map=weapon_damage_map,
+        monster_breaks=set(monster_breaks),
+        monster_stars=monster_stars
+    )
+    html = templates.render("damage", "/monster_damage.html", **template_args)
+    with atomic_open(path, "w", "utf8") as f:
+        f.write(html)
 
 
 def write_damage_html_by_rarity(path, rarity, monster, monster_damage, names,
                                 damage_map_base, weapon_damage_map, parts,
                                 part_max_damage):
     print(path)
+    # pages show the first motion only, i.e. the average motion
+    weapon_damage_map = dict((name, wd_list[0])
+                             for name, wd_list in weapon_damage_map.items())
+
     def uniform_average(weapon):
         return weapon_damage_map[weapon].averages["uniform"]
 
     names_sorted = list(names)
     names_sorted.sort(key=uniform_average, reverse=True)
 
-    from mako.lookup import TemplateLookup
-    from mako.runtime import Context
-
-    tlookup = TemplateLookup(directories=["templates/damage"],
-                             output_encoding="utf-8",
-                             input_encoding="utf-8")
-    damage_template = tlookup.get_template("/monster_damage_by_rarity.html")
-
     wtype = damage_map_base.weapon.wtype
     weapon_damage_type = WeaponType.damage_type(wtype)
     damage_types = list(DAMAGE_TYPES)
@@ -405,22 +447,23 @@ def write_damage_html_by_rarity(path, rarity, monster, monster_damage, names,
     weapon_types.remove("Light Bowgun")
     weapon_types.remove("Heavy Bowgun")
 
-    with codecs.open(path, "w", "utf8") as f:
-        template_args = dict(
-            monster=monster.name,
-            monster_damage=monster_damage,
-            rarity=rarity,
-            damage_types=DAMAGE_TYPES,
-            weapon_types=weapon_types,
-            weapon_type=wtype,
-            weapon_damage_type=weapon_damage_type,
-            part_names=parts,
-            part_max_damage=part_max_damage,
-            weapon_names=names_sorted,
-            weapon_damage_map=weapon_damage_map,
-        )
-        ctx = Context(f, **template_args)
-        damage_template.render_context(ctx)
+    template_args = dict(
+        monster=monster.name,
+        monster_damage=monster_damage,
+        rarity=rarity,
+        damage_types=DAMAGE_TYPES,
+        weapon_types=weapon_types,
+        weapon_type=wtype,
+        weapon_damage_type=weapon_damage_type,
+        part_names=parts,
+        part_max_damage=part_max_damage,
+        weapon_names=names_sorted,
+        weapon_damage_map=weapon_damage_map,
+    )
+    html = templates.render("damage", "/monster_damage_by_rarity.html",
+                            **template_args)
+    with atomic_open(path, "w", "utf8") as f:
+        f.write(html)
 
 
 def print_sorted_damage(names, damage_map_base, weapon_damage_map, parts):
@@ -432,7 +475,7 @@ def print_sorted_damage(names, damage_map_base, weapon_damage_map, parts):
     names_sorted.sort(key=uniform_average, reverse=True)
 
     maxlen = 4
-    headers = ["Name", "Avg"] + [p[:maxlen] for p in parts]
+    headers = ["Name", "Avg"] + _part_abbrs(parts, maxlen)
     avg_hitbox = (sum(damage_map_base[part].hitbox for part in parts)
                   / float(len(parts)))
     first_row = (["", avg_hitbox] +
@@ -507,21 +550,80 @@ def print_sorted_damage(names, damage_map_base, weapon_damage_map, parts):
             print("%-22s   %02d  %02d  %0.2f  %s" % tuple(line))
 
 
+def print_timeline_damage(names, weapon_damage_map, hits, hits_per_point,
+                          sharpen_level):
+    timelines = dict()
+    for name in names:
+        timelines[name] = [SharpnessTimeline(wd, hits_per_point=hits_per_point,
+                                             sharpen_level=sharpen_level)
+                           for wd in weapon_damage_map[name]]
+
+    def hunt_damage(name):
+        tl_list = timelines[name]
+        return sum(tl.damage(hits) for tl in tl_list) / len(tl_list)
+
+    names_sorted = list(names)
+    names_sorted.sort(key=hunt_damage, reverse=True)
+
+    headers = ["Name", "Total", "Avg", "Sharpen", "Sharpness (hits)"]
+    t = prettytable.PrettyTable(border=True,
+                                field_names=headers,
+                                hrules=prettytable.HEADER,
+                                vrules=prettytable.NONE,
+                                float_format="5.1",
+                                padding_width=1)
+    t.align["Name"] = "l"
+    t.align["Sharpness (hits)"] = "l"
+    for name in names_sorted:
+        tl = timelines[name][0]
+        total = hunt_damage(name)
+        segments = " ".join("%s:%d" % (seg.sharpness_name[:3], seg.hits)
+                            for seg in tl.segments)
+        t.add_row([name, total, total / hits, tl.sharpen_count(hits),
+                   segments])
+    print()
+    print("Damage over %d hits:" % hits)
+    print(t)
+
+
+def print_kill_percentiles(names, weapon_damage_map, hp):
+    from mhapi.distribution import compare_kill_percentiles
+
+    # use the first motion of each weapon, like the main table
+    weapon_damages = [weapon_damage_map[name][0] for name in names]
+    wd_names = dict((id(wd), name) for wd, name in zip(weapon_damages, names))
+    percentiles = (10, 50, 90)
+    results = compare_kill_percentiles(weapon_damages, hp, percentiles)
+
+    headers = ["Name"] + ["%d%%" % q for q in percentiles]
+    t = prettytable.PrettyTable(border=True,
+                                field_names=headers,
+                                hrules=prettytable.HEADER,
+                                vrules=prettytable.NONE,
+                                padding_width=1)
+    t.align["Name"] = "l"
+    for wd, hits in results:
+        t.add_row([wd_names[id(wd)]] + hits)
+    print()
+    print("Hits to deal %d damage:" % hp)
+    print(t)
+
+
 def print_damage_percent_diff(names, damage_map_base, weapon_damage_map, parts):
     for part in parts:
         tdiffs = [percent_change(
                     damage_map_base[part].total,
-                    weapon_damage_map[w][part].total
+                    weapon_damage_map[w][0][part].total
                   )
                   for w in names[1:]]
         ediffs = [percent_change(
                     damage_map_base[part].element,
-                    weapon_damage_map[w][part].element
+                    weapon_damage_map[w][0][part].element
                   )
                   for w in names[1:]]
         bdiffs = [percent_change(
                     damage_map_base[part].break_diff(),
-                    weapon_damage_map[w][part].break_diff()
+                    weapon_damage_map[w][0][part].break_diff()
                   )
                   for w in names[1:]]
         tdiff_s = ",".join("%+0.1f%%" % i for i in tdiffs)
@@ -538,11 +640,11 @@ def print_damage_percent_diff(names, damage_map_base, weapon_damage_map, parts):
                ediff_s,
                damage.break_diff(),
                bdiff_s))
-        if weapon_type == "Charge Blade":
+        if damage_map_base.weapon_type == "Charge Blade":
             for level in (0, 1, 2, 3, 5):
                 print(" " * 20, level, end=' ')
                 for wname in names:
-                    wd = weapon_damage_map[wname]
+                    wd = weapon_damage_map[wname][0]
                     damage = wd.cb_phial_damage[part][level]
                     print("(%0.f, %0.f, %0.f);" % damage, end=' ')
                 print()
@@ -553,7 +655,7 @@ def print_damage_percent_diff(names, damage_map_base, weapon_damage_map, parts):
         base = damage_map_base.averages[avg_type]
         diffs = [percent_change(
                     base,
-                    weapon_damage_map[w].averages[avg_type]
+                    weapon_damage_map[w][0].averages[avg_type]
                  )
                  for w in names[1:]]
 
@@ -561,6 +663,35 @@ def print_damage_percent_diff(names, damage_map_base, weapon_damage_map, parts):
 
         print("%22s %0.2f (%s)" % (avg_type, base, diff_s))
 
+    print_break_even(names, weapon_damage_map)
+
+
+def print_break_even(names, weapon_damage_map):
+    """
+    Print which weapon is best for each range of raw / element hitbox ratio,
+    and for each part of the monster.
+    """
+    envelope = BreakEvenEnvelope.from_weapon_damages(
+                        [(name, weapon_damage_map[name][0]) for name in names])
+    print()
+    print("Best weapon by raw/element hitbox ratio:")
+    for start, end, name in envelope.intervals():
+        print("  %5.2f - %5.2f  %s" % (start, end, name))
+
+    re_ratios = None
+    for name in names:
+        wd = weapon_damage_map[name][0]
+        if wd.etype:
+            re_ratios = wd.get_raw_element_ratios()
+            break
+    if re_ratios is None:
+        return
+    print()
+    for part, hitbox, ehitbox, ratio, name in envelope.map_parts(re_ratios):
+        # (part, raw, element, ratio)
+        print("%-22s   %02d  %02d  %0.2f  %s"
+              % (part, hitbox, ehitbox, ratio, name))
+
 
 def match_quest_level(match_level, weapon_level):
     #print match_level, weapon_level
@@ -575,7 +706,74 @@ def match_quest_level(match_level, weapon_level):
     return True
 
 
-def run_comparison(args, db, motiondb, game_uses_true_raw, item_stars=None):
+def get_weapon_quest_stars(weapon, item_stars):
+    """
+    Get hub stars needed to make the weapon, from the weapon data if
+    available (newer games) or calculated from the item stars.
+    """
+    if "village_stars" in weapon:
+        return dict(Village=weapon["village_stars"],
+                    Guild=weapon["guild_stars"],
+                    Permit=weapon["permit_stars"],
+                    Arena=weapon["arena_stars"])
+    return item_stars.get_weapon_stars(weapon)
+
+
+def filter_quest_level(weapons, quest_level, item_stars):
+    """
+    Get the weapons that can be made at the (village, guild, permit, arena)
+    @quest_level, excluding weapons that can be upgraded to another
+    matching weapon. Keeps the original order.
+    """
+    village, guild, permit, arena = quest_level
+    weapons2 = dict()
+    for w in weapons:
+        stars = get_weapon_quest_stars(w, item_stars)
+        if (not match_quest_level(village, stars["Village"])
+                and not match_quest_level(guild, stars["Guild"])):
+            continue
+        if not match_quest_level(permit, stars["Permit"]):
+            continue
+        if not match_quest_level(arena, stars["Arena"]):
+            continue
+        weapons2[w.id] = w
+    parent_ids = set(w.parent_id for w in weapons2.values())
+    for wid in list(weapons2.keys()):
+        if wid in parent_ids:
+            del weapons2[wid]
+    return list(weapons2.values())
+
+
+def get_weapon_damages(args, skill_args, row, monster, monster_damage,
+                       monster_breaks, motion_list, game_uses_true_raw, game):
+    """
+    Get list of WeaponMonsterDamage for the weapon @row, one per motion.
+    """
+    wd_list = []
+    for motion in motion_list:
+        wd = WeaponMonsterDamage(row,
+                                 monster, monster_damage, motion,
+                                 skill_args.sharpness_plus,
+                                 monster_breaks,
+                                 attack_skill=skill_args.attack_up,
+                                 critical_eye_skill=skill_args.critical_eye,
+                                 element_skill=skill_args.element_up,
+                                 awaken=skill_args.awaken,
+                                 artillery_level=skill_args.artillery,
+                                 limit_parts=args.parts,
+                                 frenzy_bonus=skill_args.frenzy,
+                                 is_true_attack=game_uses_true_raw,
+                                 blunt_power=skill_args.blunt_power,
+                                 anti_species=args.anti_species,
+                                 crit_boost=crit_boost(args.crit_boost),
+                                 wex_affinity=wex_affinity(args.weakness_exploit),
+                                 game=game)
+        wd_list.append(wd)
+    return wd_list
+
+
+def run_comparison(args, db, motiondb, game_uses_true_raw, item_stars=None,
+                   stream_out=None):
     monster = db.get_monster_by_name(args.monster)
     if not monster:
         raise ValueError("Monster '%s' not found" % args.monster)
@@ -634,21 +832,15 @@ def run_comparison(args, db, motiondb, game_uses_true_raw, item_stars=None):
 
     names = [w.name for w in weapons]
 
-    monster_breaks = db.get_monster_breaks(monster.id)
+    monster_breaks = get_monster_breaks(db, monster, monster_damage)
     part_names = list(monster_damage.keys())
 
-    for i in range(len(monster_breaks)):
-        if monster_breaks[i] not in monster_damage:
-            plural = monster_breaks[i] + "s"
-            if plural in monster_damage:
-                monster_breaks[i] = plural
-
     states = monster_damage.state_names()
     print("States:", states)
     print("Parts: ", part_names)
     print()
 
-    hitbox_table_fields = [monster.name] + [p[:4] for p in part_names]
+    hitbox_table_fields = [monster.name] + _part_abbrs(part_names)
     t = prettytable.PrettyTable(border=True,
                                 field_names=hitbox_table_fields,
                                 hrules=prettytable.HEADER,
@@ -677,13 +869,13 @@ def run_comparison(args, db, motiondb, game_uses_true_raw, item_stars=None):
         ])
         print("Specified Motion: %0.1f" % motions.average)
     if args.match_motion:
-        motion_list = motions.get_matching_motions(args.match_motion)
+        motion_indexes = motions.get_matching_indexes(args.match_motion)
+        motion_list = [motions[motions.names[i]] for i in motion_indexes]
         print("Matching Motions:")
-        total_raw = 0
-        total_ele_mod = 0
+        total_raw = sum(motions.totals[i] for i in motion_indexes)
+        total_ele_mod = sum(motions.ele_mod_averages[i]
+                            for i in motion_indexes)
         for motion in motion_list:
-            total_raw += motion.total
-            total_ele_mod += sum(motion.ele_mod) / len(motion.ele_mod)
             print(" ", motion.name,
                   ",".join([str(pair) for pair in zip(motion.powers, motion.ele_mod)]))
         print(" ", "Average", "(" + str(total_raw/len(motion_list)) + ", "
@@ -700,30 +892,8 @@ def run_comparison(args, db, motiondb, game_uses_true_raw, item_stars=None):
         limit_parts = None
 
     if args.quest_level:
-        village, guild, permit, arena = args.quest_level
         print("Filter by Quest Levels:", args.quest_level)
-        weapons2 = dict()
-        for w in weapons:
-            if "village_stars" in w:
-                stars = dict(Village=w["village_stars"],
-                             Guild=w["guild_stars"],
-                             Permit=w["permit_stars"],
-                             Arena=w["arena_stars"])
-            else:
-                stars = item_stars.get_weapon_stars(w)
-            if (not match_quest_level(village, stars["Village"])
-                    and not match_quest_level(guild, stars["Guild"])):
-                continue
-            if not match_quest_level(permit, stars["Permit"]):
-                continue
-            if not match_quest_level(arena, stars["Arena"]):
-                continue
-            weapons2[w.id] = w
-        parent_ids = set(w.parent_id for w in weapons2.values())
-        for wid in list(weapons2.keys()):
-            if wid in parent_ids:
-                del weapons2[wid]
-        weapons = list(weapons2.values())
+        weapons = filter_quest_level(weapons, args.quest_level, item_stars)
         names = [w.name for w in weapons]
 
     if args.rarity:
@@ -767,6 +937,28 @@ def run_comparison(args, db, motiondb, game_uses_true_raw, item_stars=None):
         weapons = list(weapons2.values())
         names = [w.name for w in weapons]
 
+    if args.stream:
+        stream = WeaponDamageStream(stream_out or sys.stdout, args.stream,
+                                    limit_parts, top=args.top)
+        for row in weapons:
+            if row["wtype"] != weapon_type:
+                raise ValueError(
+                    "Weapon '%s' is different type, got '%s' expected '%s'"
+                    % (row["name"], row["wtype"], weapon_type))
+            try:
+                wd_list = get_weapon_damages(
+                                args, skill_args_map.get(row["name"], args),
+                                row, monster, monster_damage, monster_breaks,
+                                motion_list, game_uses_true_raw, db.game)
+            except ValueError as e:
+                print(str(e))
+                sys.exit(1)
+            # only the summary is kept, so memory doesn't grow with the
+            # number of weapons
+            stream.add(_weapon_damage_result(row["name"], wd_list))
+        stream.close()
+        return monster, names, None
+
     part_max_damage = defaultdict(int)
     weapon_damage_map = dict()
     weapon_table = []
@@ -782,26 +974,10 @@ def run_comparison(args, db, motiondb, game_uses_true_raw, item_stars=None):
         #print(name, row)
         try:
             skill_args = skill_args_map.get(name, args)
-            wd_list = []
-            for motion in motion_list:
-                wd = WeaponMonsterDamage(row,
-                                         monster, monster_damage, motion,
-                                         skill_args.sharpness_plus,
-                                         monster_breaks,
-                                         attack_skill=skill_args.attack_up,
-                                         critical_eye_skill=skill_args.critical_eye,
-                                         element_skill=skill_args.element_up,
-                                         awaken=skill_args.awaken,
-                                         artillery_level=skill_args.artillery,
-                                         limit_parts=args.parts,
-                                         frenzy_bonus=skill_args.frenzy,
-                                         is_true_attack=game_uses_true_raw,
-                                         blunt_power=skill_args.blunt_power,
-                                         anti_species=args.anti_species,
-                                         crit_boost=crit_boost(args.crit_boost),
-                                         wex_affinity=wex_affinity(args.weakness_exploit),
-                                         game=db.game)
-                wd_list.append(wd)
+            wd_list = get_weapon_damages(args, skill_args, row, monster,
+                                         monster_damage, monster_breaks,
+                                         motion_list, game_uses_true_raw,
+                                         db.game)
             wd = wd_list[0]
             estring = ""
             if wd.etype:
@@ -868,6 +1044,18 @@ def run_comparison(args, db, motiondb, game_uses_true_raw, item_stars=None):
         print_sorted_damage(names, damage_map_base,
                             weapon_damage_map, parts)
 
+    if args.hunt_hits:
+        if args.sharpen_level:
+            sharpen_level = getattr(SharpnessLevel,
+                                    args.sharpen_level.upper())
+        else:
+            sharpen_level = None
+        print_timeline_damage(names, weapon_damage_map, args.hunt_hits,
+                              args.hits_per_point, sharpen_level)
+
+    if args.kill_hp:
+        print_kill_percentiles(names, weapon_damage_map, args.kill_hp)
+
     if args.html_out:
         if args.mhr:
             if not args.rarity:
@@ -889,6 +1077,8 @@ def run_comparison(args, db, motiondb, game_uses_true_raw, item_stars=None):
                               part_max_damage, monster_breaks,
                               monster_stars)
 
+    return monster, names, weapon_damage_map
+
 
 def write_html_site(args, db, motiondb, game_uses_true_raw):
     if db.game == "4u":
@@ -899,15 +1089,19 @@ def write_html_site(args, db, motiondb, game_uses_true_raw):
 
     monsters = db.get_monsters("Boss")
     monster_names = [monster.name for monster in monsters]
-    weapon_types = db.get_weapon_types()
+    weapon_types = [wtype for wtype in db.get_weapon_types()
+                    if "Bowgun" not in wtype and wtype != "Bow"]
 
     item_stars = ItemStars(db)
+    stars_cache_key = load_stars_cache(db, item_stars)
     monster_stars = {}
     for monster in monsters:
         monster_stars[monster.id] = item_stars.get_monster_stars(monster.id)
 
-    n = 0
+    units = []
+    monster_pages = defaultdict(list)
     base_dir = args.html_site
+    manifest = BuildManifest(base_dir, enabled=args.incremental)
     for monster in monsters:
         stars = monster_stars[monster.id]
         if stars["Village"] is None:
@@ -943,54 +1137,388 @@ def write_html_site(args, db, motiondb, game_uses_true_raw):
                 if not os.path.isdir(quest_path):
                     os.makedirs(quest_path)
                 for wtype in weapon_types:
-                    if "Bowgun" in wtype or wtype == "Bow":
+                    html_out = os.path.join(quest_path, wtype + ".html")
+                    if not args.incremental and os.path.isfile(html_out):
+                        print(html_out, " exists, skipping")
                         continue
-                    args.html_out = os.path.join(quest_path, wtype + ".html")
-                    if os.path.isfile(args.html_out):
-                        print(args.html_out, " exists, skipping")
-                        continue
-                    args.html_site = None
-                    n += 1
-                    args.monster = monster.name
-                    args.quest_level = (v if v else 1, g if g else 1,
-                                        None, None)
-                    args.match = [(wtype, None)]
-                    run_comparison(args, db, motiondb, game_uses_true_raw,
-                                   item_stars=item_stars)
-    print("n =", n)
+                    quest_level = (v if v else 1, g if g else 1, None, None)
+                    monster_pages[(monster.name, wtype)].append(
+                                                    (html_out, quest_level))
+    # damage is calculated once per monster and weapon type, and each
+    # quest level page is a filtered view of it
+    for (monster_name, wtype), pages in monster_pages.items():
+        unit = dict(monster=monster_name, wtype=wtype, pages=pages)
+        if args.incremental:
+            unit["previous"] = dict((html_out, manifest.get_previous(html_out))
+                                    for html_out, quest_level in pages)
+        units.append(unit)
+    built = run_html_site(args, units,
+                          (db, motiondb, game_uses_true_raw, item_stars),
+                          star_weapon_types=weapon_types)
+    save_stars_cache(db, item_stars, stars_cache_key)
+    manifest.update(built)
+    manifest.finish()
+
+
+STARS_CACHE_VERSION = 1
+
+
+def _stars_cache_path(db):
+    return os.path.splitext(db.path)[0] + ".stars.pickle"
+
+
+def load_stars_cache(db, item_stars):
+    """
+    Load the item stars saved by a previous site build for the same DB
+    and stars code into @item_stars. Calculating stars for every weapon
+    takes longer than an incremental build that changes nothing.
+
+    Returns the cache key, for save_stars_cache.
+    """
+    st = os.stat(db.path)
+    cache_key = (STARS_CACHE_VERSION, db.game, st.st_mtime_ns, st.st_size,
+                 code_fingerprint(mhapi.model, mhapi.db))
+    snapshot = load_pickle_cache(_stars_cache_path(db), cache_key)
+    if snapshot is not None:
+        item_stars.load_snapshot(snapshot)
+    return cache_key
+
+
+def save_stars_cache(db, item_stars, cache_key):
+    save_pickle_cache(_stars_cache_path(db), cache_key,
+                      item_stars.get_snapshot())
 
 
 def write_html_site_rise(args, db, motiondb, game_uses_true_raw=True):
+    if args.incremental:
+        raise ValueError("--incremental is not supported for rise sites")
     monsters = db.get_monsters()
-    weapon_types = db.get_weapon_types()
+    weapon_types = [wtype for wtype in db.get_weapon_types()
+                    if "Bowgun" not in wtype and wtype != "Bow"]
 
-    n = 0
+    units = []
     base_dir = args.html_site
     for monster in monsters:
         for rarity in range(1, 11):
-            args.rarity = rarity
             rarity_dir = "r{}".format(rarity)
             mpath = os.path.join(base_dir, monster.name, rarity_dir)
             if not os.path.isdir(mpath):
                 os.makedirs(mpath)
             for wtype in weapon_types:
-                if "Bowgun" in wtype or wtype == "Bow":
+                html_out = os.path.join(mpath, wtype + ".html")
+                if os.path.isfile(html_out):
+                    print(html_out, " exists, skipping")
+                    continue
+                units.append(dict(html_out=html_out,
+                                  monster=monster.name,
+                                  rarity=rarity,
+                                  match=[(wtype, None)]))
+    run_html_site(args, units, (db, motiondb, game_uses_true_raw, None))
+
+
+# per process state for html site pages, (base_args, db, motiondb,
+# game_uses_true_raw, item_stars)
+_html_site_state = None
+
+# per process weapons by type, loading the item components for every
+# weapon takes longer than checking that a page is unchanged
+_html_site_weapons = {}
+
+
+def _html_site_get_weapons(db, wtype):
+    weapons = _html_site_weapons.get(wtype)
+    if weapons is None:
+        weapons = db.get_weapons_by_query(wtype=wtype)
+        _html_site_weapons[wtype] = weapons
+    return weapons
+
+
+def _html_site_init(base_args, stars_snapshot):
+    """
+    Pool initializer, each worker opens its own DB connection and starts
+    from the parent's item stars.
+    """
+    global _html_site_state
+    _html_site_weapons.clear()
+    db, motiondb, game_uses_true_raw = get_game_db(base_args)
+    item_stars = ItemStars(db)
+    if stars_snapshot is not None:
+        item_stars.load_snapshot(stars_snapshot)
+    _html_site_state = (base_args, db, motiondb, game_uses_true_raw,
+                        item_stars)
+
+
+def _html_site_weapon_stars(wtype):
+    """
+    Calculate stars for all weapons of @wtype, returns the stars snapshot.
+    """
+    db = _html_site_state[1]
+    item_stars = _html_site_state[4]
+    for w in _html_site_get_weapons(db, wtype):
+        item_stars.get_weapon_stars(w)
+    return item_stars.get_snapshot()
+
+
+def _html_site_unit(unit):
+    """
+    Write the pages for a work unit, returns list of
+    (path, error, fingerprint, built), where error is None on success, and
+    fingerprint is the page inputs fingerprint for incremental builds.
+    """
+    if "pages" in unit:
+        return _html_site_monster(unit)
+    return [_html_site_page(unit)]
+
+
+def _html_site_code_fingerprint(motiondb):
+    """
+    Fingerprint for inputs shared by all pages: damage code, templates, and
+    motion values.
+    """
+    return fingerprint(
+        code_fingerprint(mhapi.damage, mhapi.model,
+                         sys.modules[__name__]),
+        file_fingerprint(templates.template_path("damage",
+                                                 "monster_damage.html"),
+                         templates.template_path("damage", "base.html")),
+        file_fingerprint(motiondb.json_path))
+
+
+# args that don't change page content
+_HTML_SITE_IGNORE_ARGS = ("html_site", "incremental", "processes", "monster")
+
+
+def _html_site_monster(unit):
+    """
+    Write all the quest level pages for a monster and weapon type. The
+    damage for every weapon of the type is calculated at most once, and
+    each page uses the weapons matching its quest level.
+
+    For incremental builds, @unit has a "previous" dict mapping the page
+    path to its fingerprint from the last build, and pages with the same
+    inputs are not written again.
+    """
+    base_args, db, motiondb, game_uses_true_raw, item_stars = _html_site_state
+    args = copy.copy(base_args)
+    args.html_site = None
+    args.monster = unit["monster"]
+    wtype = unit["wtype"]
+    paths = [html_out for html_out, quest_level in unit["pages"]]
+
+    monster = db.get_monster_by_name(args.monster)
+    if not monster:
+        return [(path, "Monster '%s' not found" % args.monster, None, False)
+                for path in paths]
+    monster_damage = db.get_monster_damage(monster.id)
+    if not monster_damage.is_valid():
+        return [(path, "invalid damage data for monster '%s'" % args.monster,
+                 None, False)
+                for path in paths]
+    monster_breaks = get_monster_breaks(db, monster, monster_damage)
+    monster_stars = item_stars.get_monster_stars(monster.id)
+
+    previous = unit.get("previous")
+    if previous is not None:
+        unit_fp = fingerprint(
+            _html_site_code_fingerprint(motiondb),
+            dict((k, v) for k, v in vars(args).items()
+                 if k not in _HTML_SITE_IGNORE_ARGS),
+            monster, monster_damage, sorted(monster_breaks), monster_stars,
+            wtype)
+
+    if args.motion:
+        motions = WeaponTypeMotionValues(wtype, [
+            dict(type=[0], name="Custom", power=[args.motion]),
+        ])
+    else:
+        motions = motiondb[wtype]
+    motion_list = [motions.get_average_mv()]
+
+    weapons = _html_site_get_weapons(db, wtype)
+    weapon_damages = dict()
+
+    results = []
+    for html_out, quest_level in unit["pages"]:
+        output = io.StringIO()
+        page_fp = None
+        try:
+            page_weapons = filter_quest_level(weapons, quest_level,
+                                              item_stars)
+            if not page_weapons:
+                raise ValueError("Err: no matching weapons")
+            if previous is not None:
+                # use the DB rows, the weapon objects get components
+                # added when calculating stars
+                page_fp = fingerprint(unit_fp, quest_level,
+                                      [dict(w._row) for w in page_weapons])
+                if (previous.get(html_out) == page_fp
+                        and os.path.isfile(html_out)):
+                    results.append((html_out, None, page_fp, False))
                     continue
-                args.html_out = os.path.join(mpath, wtype + ".html")
-                if os.path.isfile(args.html_out):
-                    print(args.html_out, " exists, skipping")
+            names = [w.name for w in page_weapons]
+            part_max_damage = defaultdict(int)
+            weapon_damage_map = dict()
+            for w in page_weapons:
+                if w.id not in weapon_damages:
+                    weapon_damages[w.id] = get_weapon_damages(
+                                        args, args, w, monster,
+                                        monster_damage, monster_breaks,
+                                        motion_list, game_uses_true_raw,
+                                        db.game)
+                wd_list = weapon_damages[w.id]
+                wd = wd_list[0]
+                for part in wd.parts:
+                    if wd[part].average() > part_max_damage[part]:
+                        part_max_damage[part] = wd[part].average()
+                weapon_damage_map[w.name] = wd_list
+            damage_map_base = weapon_damage_map[names[0]][0]
+            if args.parts:
+                parts = args.parts.split(",")
+            else:
+                parts = damage_map_base.parts
+            with contextlib.redirect_stdout(output):
+                write_damage_html(html_out, monster, monster_damage,
+                                  quest_level, names, damage_map_base,
+                                  weapon_damage_map, parts, part_max_damage,
+                                  monster_breaks, monster_stars)
+        except Exception as e:
+            results.append((html_out, str(e) or e.__class__.__name__,
+                            None, False))
+            continue
+        results.append((html_out, None, page_fp, True))
+    return results
+
+
+def _html_site_page(unit):
+    """
+    Write one page of the site, with args from @unit overriding the base
+    args. Returns (path, error), error is None on success.
+    """
+    base_args, db, motiondb, game_uses_true_raw, item_stars = _html_site_state
+    args = copy.copy(base_args)
+    args.html_site = None
+    for k, v in unit.items():
+        setattr(args, k, v)
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            run_comparison(args, db, motiondb, game_uses_true_raw,
+                           item_stars=item_stars)
+    except (Exception, SystemExit) as e:
+        lines = output.getvalue().strip().splitlines()
+        if isinstance(e, SystemExit) and lines:
+            return unit["html_out"], lines[-1], None, False
+        return (unit["html_out"], str(e) or e.__class__.__name__,
+                None, False)
+    return unit["html_out"], None, None, True
+
+
+def run_html_site(args, units, state, star_weapon_types=None):
+    """
+    Write the pages for all @units, in a process pool when there is more
+    than one process. Pages are written atomically, so an interrupted run
+    can be restarted and will skip all completed pages.
+
+    Returns list of (path, fingerprint, built) for pages without errors.
+
+    @param state: (db, motiondb, game_uses_true_raw, item_stars) already
+                  loaded in this process, used directly when running
+                  serially.
+    @param star_weapon_types: when running in parallel, calculate item
+                              stars for weapons of these types first (one
+                              type per worker), so all workers start with
+                              the complete snapshot instead of each
+                              recomputing them.
+    """
+    global _html_site_state
+    _html_site_weapons.clear()
+    processes = args.processes or os.cpu_count() or 1
+    processes = max(1, min(processes, len(units)))
+    db, motiondb, game_uses_true_raw, item_stars = state
+    if processes == 1:
+        if item_stars is None:
+            item_stars = ItemStars(db)
+        _html_site_state = (args, db, motiondb, game_uses_true_raw,
+                            item_stars)
+        results = map(_html_site_unit, units)
+        pool = None
+    else:
+        snapshot = item_stars.get_snapshot() if item_stars else None
+        if snapshot is not None and star_weapon_types:
+            # skip if all loaded from the stars cache
+            star_weapon_types = [
+                wtype for wtype in star_weapon_types
+                if any(w.id not in snapshot["weapons"]
+                       for w in _html_site_get_weapons(db, wtype))]
+        if snapshot is not None and star_weapon_types:
+            start_time = time.time()
+            with multiprocessing.Pool(processes,
+                                      initializer=_html_site_init,
+                                      initargs=(args, snapshot)) as pool:
+                for part in pool.imap_unordered(_html_site_weapon_stars,
+                                                star_weapon_types):
+                    for k in snapshot:
+                        snapshot[k].update(part[k])
+            print("weapon stars: %d weapons, %0.1fs"
+                  % (len(snapshot["weapons"]), time.time() - start_time))
+            # so the caller can save them
+            item_stars.load_snapshot(snapshot)
+        pool = multiprocessing.Pool(processes, initializer=_html_site_init,
+                                    initargs=(args, snapshot))
+        results = pool.imap_unordered(_html_site_unit, units)
+
+    n = sum(len(unit.get("pages", [None])) for unit in units)
+    i = 0
+    errors = 0
+    done = []
+    start_time = time.time()
+    try:
+        for unit_results in results:
+            for path, error, fp, built in unit_results:
+                i += 1
+                elapsed = time.time() - start_time
+                rate = i / elapsed if elapsed > 0 else 0.0
+                if error:
+                    errors += 1
+                    print("ERROR %s: %s" % (path, error))
                     continue
-                args.html_site = None
-                n += 1
-                args.monster = monster.name
-                args.match = [(wtype, None)]
-                print(rarity, wtype)
-                run_comparison(args, db, motiondb, game_uses_true_raw)
-    print("n =", n)
+                done.append((path, fp, built))
+                if built:
+                    print("[%d/%d] %s (%0.1f pages/s)" % (i, n, path, rate))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    elapsed = time.time() - start_time
+    print("n = %d, errors = %d, %d processes, %0.1fs (%0.1f pages/s)"
+          % (n, errors, processes, elapsed, n / elapsed if elapsed else 0.0))
+    return done
+
+
+# game specific modifiers are set on the classes, save the defaults so
+# batch mode can switch between games in the same process
+_DEFAULT_SHARPNESS_MODIFIER = SharpnessLevel._modifier
+_DEFAULT_CRITICAL_EYE_MODIFIER = skills.CriticalEye._modifier
+
+
+def set_game_modifiers(args):
+    """
+    Set the game specific modifiers without loading the DB.
+    """
+    SharpnessLevel._modifier = _DEFAULT_SHARPNESS_MODIFIER
+    skills.CriticalEye._modifier = _DEFAULT_CRITICAL_EYE_MODIFIER
+    if args.mhw or args.mhr:
+        SharpnessLevel._modifier = SharpnessLevel._modifier_mhw
+        skills.CriticalEye._modifier = skills.CriticalEye._modifier_mhw
 
 
-def main():
-    args = parse_args(None)
+def get_game_db(args):
+    """
+    Load the DB and motion values for the game selected in @args, and set
+    the game specific modifiers.
+
+    Returns (db, motiondb, game_uses_true_raw).
+    """
     game = "4u"
 
     game_uses_true_raw = False
@@ -999,6 +1527,8 @@ def main():
     else:
         comps = False
 
+    set_game_modifiers(args)
+
     if args.monster_hunter_cross:
         db = MHDBX()
         game_uses_true_raw = True
@@ -1008,14 +1538,10 @@ def main():
     elif args.mhw:
         db = MHDBX(game="mhw")
         game_uses_true_raw = False
-        SharpnessLevel._modifier = SharpnessLevel._modifier_mhw
-        skills.CriticalEye._modifier = skills.CriticalEye._modifier_mhw
         game = "mhw"
     elif args.mhr:
         db = MHDBX(game="mhr")
         game_uses_true_raw = True
-        SharpnessLevel._modifier = SharpnessLevel._modifier_mhw
-        skills.CriticalEye._modifier = skills.CriticalEye._modifier_mhw
         game = "mhr"
     elif args.mh3u:
         db = MHDB(game="3u", include_item_components=comps)
@@ -1030,11 +1556,258 @@ def main():
         game_motion_db_path = _pathfix.motion_values_path
     motiondb = MotionValueDB(game_motion_db_path)
 
+    return db, motiondb, game_uses_true_raw
+
+
+BATCH_GAME_ARGS = {
+    "4u": [],
+    "gu": ["--monster-hunter-gen"],
+    "mhx": ["--monster-hunter-cross"],
+    "mhw": ["--mhw"],
+    "mhr": ["--mhr"],
+    "3u": ["--mh3u"],
+}
+
+BATCH_FIELDS = ["monster", "weapon", "match", "skills", "motion", "game",
+                "args"]
+
+
+def read_batch_jobs(path):
+    """
+    Read jobs from a JSON Lines file, one object per line, or a CSV file
+    with a header row using the names in BATCH_FIELDS. In CSV, multiple
+    weapons or matches are separated by "|". Use "-" for stdin.
+    """
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    lines = [line for line in lines
+             if line.strip() and not line.lstrip().startswith("#")]
+    if not lines:
+        return []
+    if lines[0].lstrip().startswith("{"):
+        return [json.loads(line) for line in lines]
+    jobs = []
+    for row in csv.DictReader(lines):
+        job = dict()
+        for k, v in row.items():
+            if k is None or v is None or not v.strip():
+                continue
+            k = k.strip()
+            if k not in BATCH_FIELDS:
+                raise ValueError("Unknown batch column: %s" % k)
+            if k in ("weapon", "match"):
+                v = [x.strip() for x in v.split("|") if x.strip()]
+            else:
+                v = v.strip()
+            job[k] = v
+        jobs.append(job)
+    return jobs
+
+
+def batch_job_argv(job):
+    """
+    Convert a batch job into command line arguments for parse_args.
+    """
+    if not job.get("monster"):
+        raise ValueError("batch job missing monster")
+    argv = []
+    weapons = job.get("weapon", [])
+    if isinstance(weapons, str):
+        weapons = [weapons]
+    argv.extend(weapons)
+    argv.extend(["-n", job["monster"]])
+    matches = job.get("match", [])
+    if isinstance(matches, str):
+        matches = [matches]
+    for m in matches:
+        argv.extend(["-m", m])
+    if job.get("skills"):
+        argv.extend(shlex.split(job["skills"]))
+    motion = job.get("motion")
+    if motion:
+        if isinstance(motion, int) or str(motion).isdigit():
+            argv.extend(["--motion", str(motion)])
+        else:
+            argv.extend(["--match-motion", motion])
+    game = job.get("game") or "4u"
+    if game not in BATCH_GAME_ARGS:
+        raise ValueError("Unknown game: %s" % game)
+    argv.extend(BATCH_GAME_ARGS[game])
+    if job.get("args"):
+        argv.extend(shlex.split(job["args"]))
+    return argv
+
+
+# per process cache of (db, motiondb, game_uses_true_raw, item_stars) by
+# game and whether item components are needed, shared by all batch jobs
+# run in the process
+_batch_cache = dict()
+
+
+class WeaponDamageStream(object):
+    """
+    Write weapon damage results from _weapon_damage_result to @out as they
+    are added, one JSON object or CSV row per weapon. With @top, only the
+    @top results with the highest uniform average are kept (in a heap, so
+    memory is bounded) and written sorted on close.
+
+    @param fmt: "jsonl" or "csv"
+    @param parts: part names for the CSV columns, default is the parts of
+                  the first result
+    """
+    def __init__(self, out, fmt, parts=None, top=None):
+        if fmt not in ("jsonl", "csv"):
+            raise ValueError("Unknown stream format: %s" % fmt)
+        if top is not None and top < 1:
+            raise ValueError("top must be at least 1")
+        self.out = out
+        self.fmt = fmt
+        self.parts = parts
+        self.top = top
+        self._heap = []
+        self._count = 0
+        self._csv = None
+        self._columns = None
+
+    def add(self, result):
+        self._count += 1
+        if self.top is None:
+            self._write(result)
+            return
+        # ties keep the first weapon added, like a stable sort
+        item = (result["uniform"], -self._count, result)
+        if len(self._heap) < self.top:
+            heapq.heappush(self._heap, item)
+        else:
+            heapq.heappushpop(self._heap, item)
+
+    def close(self):
+        if self.top is not None:
+            for _, _, result in sorted(self._heap, key=lambda x: x[:2],
+                                       reverse=True):
+                self._write(result)
+            self._heap = []
+        self.out.flush()
+
+    def _write(self, result):
+        if self.fmt == "jsonl":
+            self.out.write(json.dumps(result))
+            self.out.write("\n")
+        else:
+            if self._csv is None:
+                self._start_csv(result)
+            row = [result[k] for k in self._columns]
+            row.extend(result["parts"].get(p, "") for p in self.parts)
+            self._csv.writerow(row)
+        # flush each line, so the output can be consumed while running
+        self.out.flush()
+
+    def _start_csv(self, result):
+        self._csv = csv.writer(self.out, lineterminator="\n")
+        self._columns = [k for k in result if k != "parts"]
+        if self.parts is None:
+            self.parts = list(result["parts"])
+        self._csv.writerow(self._columns + list(self.parts))
+
+
+def run_batch_job(indexed_job):
+    """
+    Run one batch job, returning a JSON serializable dict. Errors are
+    reported in the result rather than raised, so one bad job doesn't stop
+    the batch.
+    """
+    index, job = indexed_job
+    result = dict(job=index, monster=job.get("monster"),
+                  game=job.get("game") or "4u")
+    output = io.StringIO()
+    try:
+        args = parse_args(batch_job_argv(job))
+        key = (result["game"], bool(args.quest_level))
+        if key not in _batch_cache:
+            db, motiondb, game_uses_true_raw = get_game_db(args)
+            _batch_cache[key] = (db, motiondb, game_uses_true_raw,
+                                 ItemStars(db))
+        else:
+            # switch back the game specific modifiers
+            set_game_modifiers(args)
+        db, motiondb, game_uses_true_raw, item_stars = _batch_cache[key]
+        with contextlib.redirect_stdout(output):
+            comparison = run_comparison(args, db, motiondb,
+                                        game_uses_true_raw, item_stars)
+    except (Exception, SystemExit) as e:
+        lines = output.getvalue().strip().splitlines()
+        if isinstance(e, SystemExit) and lines:
+            result["error"] = lines[-1]
+        else:
+            result["error"] = str(e) or e.__class__.__name__
+        return result
+    if comparison is None:
+        result["error"] = output.getvalue().strip()
+        return result
+
+    monster, names, weapon_damage_map = comparison
+    result["monster"] = monster.name
+    wd = weapon_damage_map[names[0]][0]
+    result["weapon_type"] = wd.weapon_type
+    result["motions"] = [x.motion.name for x in weapon_damage_map[names[0]]]
+    weapons = [_weapon_damage_result(name, weapon_damage_map[name])
+               for name in names]
+    weapons.sort(key=lambda w: w["uniform"], reverse=True)
+    result["weapons"] = weapons
+    return result
+
+
+def run_batch(path, processes=None, out=None):
+    """
+    Run all jobs in the batch file, writing one JSON line per job to @out
+    (default stdout) in job order, as soon as each is ready.
+    """
+    if out is None:
+        out = sys.stdout
+    jobs = list(enumerate(read_batch_jobs(path)))
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(jobs))
+    if processes <= 1:
+        results = map(run_batch_job, jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(run_batch_job, jobs)
+    try:
+        for result in results:
+            out.write(json.dumps(result, sort_keys=True))
+            out.write("\n")
+            out.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def main():
+    args = parse_args(None)
+
+    if args.batch:
+        run_batch(args.batch, args.processes)
+        return
+
+    db, motiondb, game_uses_true_raw = get_game_db(args)
+
     if args.html_site:
         if args.mhr:
             write_html_site_rise(args, db, motiondb, game_uses_true_raw)
         else:
             write_html_site(args, db, motiondb, game_uses_true_raw)
+    elif args.stream:
+        # keep stdout for the data, so it can be piped
+        out = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            run_comparison(args, db, motiondb, game_uses_true_raw,
+                           stream_out=out)
     else:
         run_comparison(args, db, motiondb, game_uses_true_raw)
 
@@ -20,29 +20,16 @@ ITEM_TYPES = "Bone Bug Flesh Ore Sac/Fluid".split()
 
 def print_top_items(db, rank="G"):
     items = db.get_items(ITEM_TYPES)
-    ev = dict()
-    strats = dict()
+    # expected values for all items are cached with the DB
+    ev_matrix = rewards.RewardsEVMatrix.load(db)
+    sell = dict()
     for item in items:
-        trade = db.get_wyporium_trade(item.id)
-        if trade is not None:
-            ev[item.id] = 0
-            continue
-
         if item.sell == "":
             item.sell = 0
         else:
             item.sell = int(item.sell)
-
-        ir = rewards.ItemRewards(db, item)
-        strat = ir.get_best_strat(rank=rank)
-        if strat is None:
-            ev[item.id] = 0
-        else:
-            ev[item.id] = strat.ev
-            strats[item.id] = strat
-
-    def item_value(i):
-        return i.sell * ev[i.id] / 100.0
+        if item.id in ev_matrix:
+            sell[item.id] = item.sell
 
     min_value = 10000
     if rank == "LR":
@@ -50,13 +37,13 @@ def print_top_items(db, rank="G"):
     if rank == "HR":
         min_value = 5000
 
-    items.sort(key=item_value, reverse=True)
-    for item in items:
-        value = item_value(item)
+    items_by_id = dict((item.id, item) for item in items)
+    for item_id, value, ev in ev_matrix.top_items(sell, rank=rank):
         if value < min_value:
             break
+        item = items_by_id[item_id]
         print("    %-20s % 7.f % 6d (% 5.f)" % \
-            (item.name, value, int(item.sell), ev[item.id]))
+            (item.name, value, int(item.sell), ev))
 
 
 if __name__ == '__main__':
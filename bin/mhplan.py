@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Script to find the quests to run to get several items, e.g.
+
+    mhplan.py "Zinogre Jasper=3" "Thunderbug=5" "Fucium Ore=2"
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import _pathfix
+
+from mhapi.db import MHDB
+from mhapi import rewards
+from mhapi.skills import LuckSkill, CapSkill, CarvingSkill
+
+
+def item_count_tuple(arg):
+    name, _, count = arg.rpartition("=")
+    if not name:
+        name, count = count, "1"
+    name = name.strip()
+    try:
+        count = int(count)
+    except ValueError:
+        count = 0
+    if not name or count <= 0:
+        raise argparse.ArgumentTypeError("bad count for %r, use 'name=count'"
+                                         % arg)
+    return (name, count)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=
+        "Find quests to run to get the given items with the fewest"
+        " expected runs")
+    parser.add_argument("-r", "--rank", choices=["LR", "HR", "G"],
+                        default="G",
+                        help="Highest quest rank available, default G")
+    parser.add_argument("-l", "--luck-skill", type=int, default=0,
+                        choices=range(LuckSkill.NONE, LuckSkill.AMAZING+1),
+                        help="0 none, 1 good, 2 great, 3 amazing")
+    parser.add_argument("-c", "--cap-skill", type=int, default=0,
+                        choices=range(CapSkill.NONE, CapSkill.GOD+1),
+                        help="0 none, 1 expert, 2 master, 3 god")
+    parser.add_argument("-k", "--carving-skill", type=int, default=0,
+                        choices=range(CarvingSkill.NONE, CarvingSkill.GOD+1),
+                        help="0 none, 1 felyne low, 2 felyne hi,"
+                            +" 3 celebrity, 4 god")
+    parser.add_argument("-e", "--explorer", action="store_true",
+                        help="Speed Gatherer, Great Luck, etc")
+    parser.add_argument("item", nargs="+", type=item_count_tuple,
+                        help="Item name and count, e.g. 'Thunderbug=5',"
+                            +" count is 1 if not given")
+    args = parser.parse_args(argv)
+    if args.explorer and args.rank == "LR":
+        parser.error("explorer is not available in low rank")
+    return args
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    db = MHDB()
+
+    start_time = time.time()
+    items = []
+    for name, count in args.item:
+        item_row = rewards.find_item(db, name, sys.stderr)
+        if item_row is None:
+            sys.exit(os.EX_DATAERR)
+        items.append((item_row, count))
+
+    plan = rewards.plan_farming(db, items, rank=args.rank,
+                                luck_skill=args.luck_skill,
+                                cap_skill=args.cap_skill,
+                                carving_skill=args.carving_skill,
+                                explorer=args.explorer)
+    plan.print(sys.stdout)
+    print("\n(%0.2fs)" % (time.time() - start_time), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Script to calculate the odds of getting items from quest runs, e.g. how
+many runs it takes to get 3 Zinogre Jasper with 90% probability.
+
+    mhruns.py "Zinogre Jasper" 3
+    mhruns.py --all --count 1,3 > runs.jsonl
+
+Requires numpy.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import _pathfix
+
+from mhapi.db import MHDB
+from mhapi import rewards
+from mhapi import rewardprob
+from mhapi.skills import LuckSkill, CapSkill, CarvingSkill
+
+
+def comma_separated(value):
+    return [int(v) for v in value.split(",")]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=
+        "Exact odds of getting items from quest runs")
+    parser.add_argument("-r", "--rank", choices=["LR", "HR", "G"],
+                        default="G",
+                        help="Highest quest rank available, default G")
+    parser.add_argument("-l", "--luck-skill", type=int, default=0,
+                        choices=range(LuckSkill.NONE, LuckSkill.AMAZING+1),
+                        help="0 none, 1 good, 2 great, 3 amazing")
+    parser.add_argument("-c", "--cap-skill", type=int, default=0,
+                        choices=range(CapSkill.NONE, CapSkill.GOD+1),
+                        help="0 none, 1 expert, 2 master, 3 god")
+    parser.add_argument("-k", "--carving-skill", type=int, default=0,
+                        choices=range(CarvingSkill.NONE, CarvingSkill.GOD+1),
+                        help="0 none, 1 felyne low, 2 felyne hi,"
+                            +" 3 celebrity, 4 god")
+    parser.add_argument("-p", "--percentiles", type=comma_separated,
+                        default=[50, 90],
+                        help="Comma separated, default 50,90")
+    parser.add_argument("-n", "--top", type=int, default=5,
+                        help="Number of quests to show, default 5")
+    parser.add_argument("--runs", type=comma_separated, default=[1, 5, 10],
+                        help="Show probability of getting the items after"
+                            +" these numbers of runs, default 1,5,10")
+    parser.add_argument("--all", action="store_true",
+                        help="Print one JSON line per reward item and count"
+                            +" with the best quest")
+    parser.add_argument("--count", type=comma_separated, default=[1],
+                        help="Item counts for --all, default 1")
+    parser.add_argument("item", nargs="?", help="Full name of item")
+    parser.add_argument("item_count", nargs="?", type=int, default=1,
+                        help="Number of items needed, default 1")
+    args = parser.parse_args(argv)
+    if not args.all and not args.item:
+        parser.error("item name is required unless using --all")
+    return args
+
+
+def _skill_args(args):
+    return dict(rank=args.rank, luck_skill=args.luck_skill,
+                cap_skill=args.cap_skill, carving_skill=args.carving_skill)
+
+
+def print_item_odds(db, args):
+    item = rewards.find_item(db, args.item, sys.stderr)
+    if item is None:
+        sys.exit(os.EX_DATAERR)
+    count = args.item_count
+    odds_list = rewardprob.item_farming_odds(db, item, **_skill_args(args))
+    if not odds_list:
+        print("%s is not available from %s quests" % (item.name, args.rank))
+        return
+    odds_list.sort(key=lambda o: o.expected_runs(count))
+    for odds in odds_list[:args.top]:
+        print("%s %s" % (odds.quest.one_line_u(), odds.strat))
+        print("  %0.2f per run, %0.2f expected runs for %d"
+              % (odds.mean, odds.expected_runs(count), count))
+        print("  runs for %d: %s" % (count, ", ".join(
+                    "%d%% %d" % (q, runs)
+                    for q, runs in zip(args.percentiles,
+                                       odds.runs_for(count,
+                                                     args.percentiles)))))
+        print("  P(at least %d): %s" % (count, ", ".join(
+                    "%d runs %0.1f%%" % (runs,
+                                         100 * odds.p_at_least(count, runs))
+                    for runs in args.runs)))
+
+
+def print_all_items(db, args, out):
+    """
+    Print JSON lines with the best quest and runs needed for each reward
+    item and count.
+    """
+    rewards_db = rewards.BulkRewardsDB(db)
+    start_time = time.time()
+    items = rewards.get_reward_items(db)
+    for item in items:
+        odds_list = rewardprob.item_farming_odds(rewards_db, item,
+                                                 **_skill_args(args))
+        for count in args.count:
+            odds = rewardprob.best_farming_odds(odds_list, count)
+            if odds is None:
+                continue
+            d = dict(item=item.name, count=count,
+                     quest=odds.quest.name, quest_id=odds.quest.id,
+                     strat=odds.strat,
+                     per_run=round(odds.mean, 4),
+                     expected_runs=round(odds.expected_runs(count), 4))
+            for q, runs in zip(args.percentiles,
+                               odds.runs_for(count, args.percentiles)):
+                d["runs_%d" % q] = runs
+            out.write(json.dumps(d, sort_keys=True))
+            out.write("\n")
+    print("%d items, %0.1fs" % (len(items), time.time() - start_time),
+          file=sys.stderr)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    db = MHDB()
+    if args.all:
+        print_all_items(db, args, sys.stdout)
+    else:
+        print_item_odds(db, args)
+
+
+if __name__ == '__main__':
+    main()
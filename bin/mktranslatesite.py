@@ -4,22 +4,15 @@ import sys
 import json
 import os.path
 import types
-import codecs
-
-from mako.lookup import TemplateLookup
-from mako.runtime import Context
 
 import _pathfix
 
 #from mhapi.db import MHDB
-from mhapi.util import get_utf8_writer
+from mhapi import templates
+from mhapi.build import (BuildManifest, fingerprint, file_fingerprint,
+                         code_fingerprint)
 
-tlookup = TemplateLookup(directories=["templates/translate"],
-                         output_encoding="utf-8",
-                         input_encoding="utf-8")
-                         #default_filters=["decode.utf8"])
-list_template = tlookup.get_template("/list.html")
-index_template = tlookup.get_template("/index.html")
+OUT_DIR = "web/translate"
 
 
 def get_auto_divider_fn(field):
@@ -35,7 +28,26 @@ def get_auto_divider_fn(field):
     return auto_divider_fn
 
 
-def mk_html_list(link, title, dict_list, keys, sort_keys, divider_fn="auto"):
+def template_fingerprint(name):
+    """
+    Fingerprint of the template and the code that fills it in, including
+    the divider and sort functions defined in this script.
+    """
+    return fingerprint(file_fingerprint(
+                            templates.template_path("translate", name),
+                            templates.template_path("translate", "base.html")),
+                       code_fingerprint(sys.modules[__name__]))
+
+
+def render_page(manifest, outpath, name, fp, **template_args):
+    if manifest.is_current(outpath, fp):
+        return
+    html = templates.render("translate", name, **template_args)
+    manifest.write_built(outpath, html, fp)
+
+
+def mk_html_list(manifest, link, title, dict_list, keys, sort_keys,
+                 divider_fn="auto"):
     if divider_fn == "auto":
         divider_fn = get_auto_divider_fn(keys[0])
     elif divider_fn is None:
@@ -72,19 +84,19 @@ def mk_html_list(link, title, dict_list, keys, sort_keys, divider_fn="auto"):
         search_link=search_link
     )
 
-    outpath = os.path.join("web/translate", link)
-
-    with codecs.open(outpath, "w", "utf8") as f:
-        ctx = Context(f, **template_args)
-        list_template.render_context(ctx)
+    outpath = os.path.join(OUT_DIR, link)
+    fp = fingerprint(template_fingerprint("list.html"), link, title, keys,
+                     list(it))
+    render_page(manifest, outpath, "/list.html", fp, **template_args)
 
 
 def _main():
-    outpath = "web/translate/index.html"
+    incremental = ("-i" in sys.argv[1:] or "--incremental" in sys.argv[1:])
+    manifest = BuildManifest(OUT_DIR, enabled=incremental)
 
-    with codecs.open(outpath, "w", "utf8") as f:
-        ctx = Context(f)
-        index_template.render_context(ctx)
+    outpath = os.path.join(OUT_DIR, "index.html")
+    render_page(manifest, outpath, "/index.html",
+                template_fingerprint("index.html"))
 
     #db = MHDB(game="mhx")
     #strees = db.get_skill_trees()
@@ -99,10 +111,10 @@ def _main():
     with open(stree_path) as f:
         stree_list = json.load(f)
 
-    mk_html_list("skilltrees-en.html", "Skill Trees (en)",
+    mk_html_list(manifest, "skilltrees-en.html", "Skill Trees (en)",
                  stree_list, ("name", "name_jp"), ("name",))
 
-    mk_html_list("skilltrees-jp.html", "Skill Trees (jp)",
+    mk_html_list(manifest, "skilltrees-jp.html", "Skill Trees (jp)",
                  stree_list, ("name_jp", "name"), jplen_sort_fn,
                  divider_fn=jplen_divider_fn)
 
@@ -117,10 +129,10 @@ def _main():
                               "items.json")
     with open(items_path) as f:
         items = json.load(f)
-    mk_html_list("items-en.html", "Items (en)", items,
+    mk_html_list(manifest, "items-en.html", "Items (en)", items,
                  ("icon_name", "name", "name_jp"), ("icon_name", "name"),
                  divider_fn=item_divider_fn)
-    mk_html_list("items-jp.html", "Items (jp)", items,
+    mk_html_list(manifest, "items-jp.html", "Items (jp)", items,
                  ("icon_name", "name_jp", "name"), ("name_jp",),
                  divider_fn=None)
 
@@ -128,10 +140,12 @@ def _main():
                                "monster_carves.json")
     with open(carves_path) as f:
         carves_list = json.load(f)
-    mk_html_list("items-carve-en.html", "Items: Carve (en)", carves_list,
+    mk_html_list(manifest, "items-carve-en.html", "Items: Carve (en)",
+                 carves_list,
                  ("icon_name", "name", "name_jp"), ("icon_name", "name"),
                  divider_fn=item_divider_fn)
-    mk_html_list("items-carve-jp.html", "Items: Carve (jp)", carves_list,
+    mk_html_list(manifest, "items-carve-jp.html", "Items: Carve (jp)",
+                 carves_list,
                  ("icon_name", "name_jp", "name"), ("name_jp",),
                  divider_fn=None)
 
@@ -146,7 +160,7 @@ def _main():
         elif d["section"] != prev_d["section"]:
             return d["section"]
         return None
-    mk_html_list("hunterarts.html", "Hunter Arts", ha_list,
+    mk_html_list(manifest, "hunterarts.html", "Hunter Arts", ha_list,
                  ("name", "name_jp", "description"), None,
                  divider_fn=ha_divider_fn)
 
@@ -159,16 +173,21 @@ def _main():
     with open(monster_path) as f:
         monster_list = json.load(f)
 
-    mk_html_list("monsters-en.html", "Monsters (en)", monster_list,
+    mk_html_list(manifest, "monsters-en.html", "Monsters (en)",
+                 monster_list,
                  ("name", "name_jp", "title_jp"), ("name",))
 
-    mk_html_list("monsters-jp.html", "Monsters (jp)", monster_list,
+    mk_html_list(manifest, "monsters-jp.html", "Monsters (jp)",
+                 monster_list,
                  ("name_jp", "name", "title_jp"), ("name_jp",))
 
     titled_monster_list = [m for m in monster_list if m["title_jp"]]
-    mk_html_list("monster-titles.html", "Monster Titles", titled_monster_list,
+    mk_html_list(manifest, "monster-titles.html", "Monster Titles",
+                 titled_monster_list,
                  ("title_jp", "name"), ("title_jp",), divider_fn=None)
 
+    manifest.finish()
+
 
 def _icon_prefix(d):
     if d is None:
@@ -192,5 +211,4 @@ def jplen_sort_fn(d):
 
 
 if __name__ == '__main__':
-    sys.stdout = get_utf8_writer(sys.stdout)
     _main()
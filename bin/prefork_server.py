@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Serve the mhapi app with several worker processes forked from a master
+that has loaded the shared data, see mhapi.web.prefork. Stops gracefully
+on SIGTERM or SIGINT, SIGHUP replaces all workers.
+"""
+
+import argparse
+import logging
+import sys
+
+import _pathfix
+
+from mhapi.web.prefork import PreforkServer
+
+
+def comma_separated(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=
+        "Serve the mhapi app with prefork worker processes")
+    parser.add_argument("-H", "--host", default="",
+                        help="Address to listen on, default all")
+    parser.add_argument("-p", "--port", type=int, default=8080,
+                        help="Port to listen on, default 8080")
+    parser.add_argument("-w", "--workers", type=int,
+                        help="Worker processes, default is the number of"
+                            +" CPUs")
+    parser.add_argument("-t", "--threads", type=int, default=4,
+                        help="Threads per worker for requests that aren't"
+                            +" cached, default 4")
+    parser.add_argument("-q", "--queue-size", type=int, default=64,
+                        help="Requests per worker waiting for a thread"
+                            +" before new ones get 503, default 64")
+    parser.add_argument("-c", "--max-connections", type=int, default=10000,
+                        help="Connections per worker, default 10000")
+    parser.add_argument("--max-requests", type=int,
+                        help="Replace workers after this many requests")
+    parser.add_argument("--max-requests-jitter", type=int, default=0,
+                        help="Add up to this many to --max-requests for"
+                            +" each worker")
+    parser.add_argument("--max-worker-memory", type=int,
+                        help="Replace workers using more than this many MB"
+                            +" of private (not shared) memory, Linux only")
+    parser.add_argument("--heartbeat-timeout", type=float, default=30,
+                        help="Kill workers with a blocked event loop after"
+                            +" this many seconds, default 30")
+    parser.add_argument("-s", "--shutdown-timeout", type=float, default=30,
+                        help="Seconds to wait for requests in progress on"
+                            +" shutdown, default 30")
+    parser.add_argument("--preload-jsonapi", type=comma_separated,
+                        default=[],
+                        help="Comma separated games to load JSON API files"
+                            +" for in the master, e.g. mh4u, in addition to"
+                            +" MHAPI_JSONAPI_PRELOAD")
+    parser.add_argument("--preload-damage", type=comma_separated,
+                        default=["4u"],
+                        help="Comma separated games to load damage data"
+                            +" for in the master, default 4u")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    for name in ("mhapi.prefork", "mhapi.aioserver"):
+        logging.getLogger(name).addHandler(logging.StreamHandler())
+
+    # loads the DB, name indexes and warm caches in the master
+    from mhapi.web.wsgi import application
+    application.preload(jsonapi_games=args.preload_jsonapi,
+                        damage_games=args.preload_damage)
+
+    max_memory = None
+    if args.max_worker_memory:
+        max_memory = args.max_worker_memory << 20
+    server = PreforkServer(application, host=args.host, port=args.port,
+                           workers=args.workers,
+                           max_requests=args.max_requests,
+                           max_requests_jitter=args.max_requests_jitter,
+                           max_worker_memory=max_memory,
+                           heartbeat_timeout=args.heartbeat_timeout,
+                           shutdown_timeout=args.shutdown_timeout,
+                           server_args=dict(
+                               workers=args.threads,
+                               queue_size=args.queue_size,
+                               max_connections=args.max_connections))
+    server.run()
+
+
+if __name__ == '__main__':
+    main()
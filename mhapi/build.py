@@ -0,0 +1,333 @@
+"""
+Support for incremental builds of generated files (damage pages, JSON API,
+rewards text files, translate pages), and for publishing a complete
+output directory atomically.
+
+A manifest maps each generated file to a fingerprint of the inputs used
+to create it. It is kept in MANIFEST_DIR, not in the output directory, so
+it is not published with the generated files. On the next build, files
+with the same fingerprint are skipped, and files from the previous build
+that were not generated again are removed as stale.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+from mhapi.model import ModelJSONEncoder
+from mhapi.util import atomic_open
+
+
+# manifests are stored here, keyed by the output directory
+MANIFEST_DIR = (os.environ.get("MHAPI_BUILD_MANIFEST_DIR")
+                or os.path.join(os.path.dirname(__file__), "..", ".cache",
+                                "build"))
+# name of manifests in the output directory from older builds
+MANIFEST_NAME = ".manifest.json"
+MANIFEST_VERSION = 1
+
+
+def fingerprint(*values):
+    """
+    Get a hex digest for a JSON serializable set of values. Model objects
+    are serialized with their as_data, so DB rows can be passed directly.
+    """
+    h = hashlib.sha1()
+    for value in values:
+        if isinstance(value, bytes):
+            h.update(value)
+        elif isinstance(value, str):
+            h.update(value.encode("utf8"))
+        else:
+            h.update(json.dumps(value, cls=ModelJSONEncoder,
+                                sort_keys=True).encode("utf8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+_file_fingerprints = {}
+
+
+def file_fingerprint(*paths):
+    """
+    Get a hex digest of the contents of one or more files, e.g. templates,
+    motion value data, or source files for the code version. Cached per
+    process, files are not expected to change during a build.
+    """
+    digests = []
+    for path in paths:
+        path = os.path.abspath(path)
+        digest = _file_fingerprints.get(path)
+        if digest is None:
+            h = hashlib.sha1()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(65536), b""):
+                    h.update(block)
+            digest = h.hexdigest()
+            _file_fingerprints[path] = digest
+        digests.append(digest)
+    if len(digests) == 1:
+        return digests[0]
+    return fingerprint(*digests)
+
+
+def code_fingerprint(*modules):
+    """
+    Get a hex digest of the source of python @modules, e.g. the script
+    and the mhapi modules used to generate a file.
+    """
+    paths = []
+    for m in modules:
+        path = m.__file__
+        if path.endswith(".pyc"):
+            path = path[:-1]
+        paths.append(path)
+    return file_fingerprint(*paths)
+
+
+def manifest_path(outdir):
+    """
+    Path of the manifest for files published in @outdir.
+    """
+    outdir = os.path.abspath(outdir)
+    return os.path.join(MANIFEST_DIR, "%s-%s.json"
+                        % (os.path.basename(outdir), fingerprint(outdir)[:12]))
+
+
+class BuildManifest(object):
+    """
+    Map of generated file path (relative to the output dir) to the
+    fingerprint of its inputs.
+
+    @param outdir: base directory of generated files
+    @param enabled: if False, always build and don't record anything, so
+                    callers can use the same code for full builds
+    @param published: directory the files are published as, when @outdir
+                      is a staging dir from stage_dir, default @outdir.
+                      Selects the manifest, see manifest_path.
+    """
+    def __init__(self, outdir, enabled=True, published=None):
+        self.outdir = outdir
+        self.enabled = enabled
+        self.path = manifest_path(published or outdir)
+        self.legacy_path = os.path.join(published or outdir, MANIFEST_NAME)
+        self.previous = {}
+        self.current = {}
+        self.built = 0
+        self.skipped = 0
+        if enabled:
+            self._load()
+
+    def _load(self):
+        path = self.path
+        if not os.path.exists(path):
+            # built before manifests moved out of the output directory
+            path = self.legacy_path
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != MANIFEST_VERSION:
+            return
+        self.previous = data.get("files", {})
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path),
+                               os.path.abspath(self.outdir))
+
+    def is_current(self, path, fp):
+        """
+        True if @path exists and was built from inputs with fingerprint @fp.
+        Marks the path as part of this build either way.
+        """
+        if not self.enabled:
+            return False
+        key = self._key(path)
+        if self.previous.get(key) == fp and os.path.isfile(path):
+            self.current[key] = fp
+            self.skipped += 1
+            return True
+        return False
+
+    def record(self, path, fp):
+        """
+        Record that @path was built from inputs with fingerprint @fp.
+        """
+        self.built += 1
+        if self.enabled:
+            self.current[self._key(path)] = fp
+
+    def update(self, entries):
+        """
+        Add (path, fp, built) entries, e.g. results from worker processes.
+        """
+        for path, fp, built in entries:
+            if built:
+                self.record(path, fp)
+            elif self.enabled:
+                self.current[self._key(path)] = fp
+                self.skipped += 1
+
+    def keep_previous(self, subdir):
+        """
+        Keep the previous entries for files under @subdir, for partial
+        builds that don't regenerate them, so they are not removed as
+        stale.
+        """
+        prefix = os.path.normpath(subdir) + os.sep
+        for key, fp in self.previous.items():
+            if key.startswith(prefix):
+                self.current.setdefault(key, fp)
+
+    def get_previous(self, path):
+        return self.previous.get(self._key(path))
+
+    def write(self, path, data, mode="w", encoding="utf8"):
+        """
+        Write @data to @path if its content fingerprint changed. Use for
+        files where the content is cheap to create and is itself the best
+        record of the inputs, e.g. JSON serialized DB rows.
+
+        Returns True if the file was written.
+        """
+        fp = fingerprint(data)
+        if self.is_current(path, fp):
+            return False
+        self.write_built(path, data, fp, mode, encoding)
+        return True
+
+    def write_built(self, path, data, fp, mode="w", encoding="utf8"):
+        """
+        Write @data to @path and record it as built from inputs with
+        fingerprint @fp. For expensive files, where the caller checks
+        is_current with the input fingerprint before generating @data.
+        """
+        if "b" in mode:
+            encoding = None
+        dir_path = os.path.dirname(path)
+        if dir_path and not os.path.isdir(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+        with atomic_open(path, mode, encoding=encoding) as f:
+            f.write(data)
+        self.record(path, fp)
+
+    def stale_paths(self):
+        """
+        Paths from the previous build that were not part of this build.
+        """
+        return [os.path.join(self.outdir, key)
+                for key in sorted(self.previous)
+                if key not in self.current]
+
+    def remove_stale(self):
+        """
+        Remove stale files, returns list of removed paths.
+        """
+        removed = []
+        if not self.enabled:
+            return removed
+        for path in self.stale_paths():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed.append(path)
+        return removed
+
+    def save(self):
+        if not self.enabled:
+            return
+        manifest_dir = os.path.dirname(self.path)
+        if not os.path.isdir(manifest_dir):
+            os.makedirs(manifest_dir, exist_ok=True)
+        with atomic_open(self.path, "w", encoding="utf8") as f:
+            json.dump(dict(version=MANIFEST_VERSION, files=self.current), f,
+                      indent=1, sort_keys=True)
+        try:
+            os.remove(os.path.join(self.outdir, MANIFEST_NAME))
+        except FileNotFoundError:
+            pass
+
+    def finish(self, remove_stale=True):
+        """
+        Remove stale files if requested, save the manifest, and print a
+        summary.
+        """
+        removed = []
+        if remove_stale:
+            removed = self.remove_stale()
+            for path in removed:
+                print("Removed stale", path)
+        self.save()
+        if self.enabled:
+            print("built %d, unchanged %d, removed %d"
+                  % (self.built, self.skipped, len(removed)))
+        return removed
+
+
+def stage_dir(outdir, link_previous=False):
+    """
+    Create a new empty directory next to @outdir to build into, for
+    publishing with publish_dir when the build is complete.
+
+    @param link_previous: start from hard links to the files in the
+                          currently published @outdir, for incremental
+                          builds. Files must be replaced (e.g. with
+                          atomic_open), not modified in place, so the
+                          published copy is not changed.
+    """
+    parent, name = os.path.split(os.path.abspath(outdir))
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    staging = tempfile.mkdtemp(dir=parent, prefix=name + ".build-")
+    # mkdtemp creates directories readable only by the owner
+    os.chmod(staging, 0o755)
+    if link_previous and os.path.isdir(outdir):
+        shutil.copytree(outdir, staging, copy_function=os.link,
+                        dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns(MANIFEST_NAME))
+    return staging
+
+
+def publish_dir(staging, outdir):
+    """
+    Make @outdir a symlink to @staging, replacing the previous symlink
+    atomically, so readers see either the complete old or the complete
+    new output. The previously published directory is removed if it was
+    created by stage_dir.
+
+    If @outdir is a plain directory from a build that didn't use staging,
+    it is moved aside first, so there is a very short window where it does
+    not exist.
+    """
+    outdir = os.path.abspath(outdir)
+    staging = os.path.abspath(staging)
+    parent, name = os.path.split(outdir)
+    if os.path.dirname(staging) != parent:
+        raise ValueError("staging dir must be in the same directory as %s"
+                         % outdir)
+    old = None
+    if os.path.islink(outdir):
+        old = os.path.realpath(outdir)
+        if (os.path.dirname(old) != parent
+                or not os.path.basename(old).startswith(name + ".build-")):
+            # not created by stage_dir, leave it alone
+            old = None
+    elif os.path.isdir(outdir):
+        old = tempfile.mkdtemp(dir=parent, prefix=name + ".old-")
+        os.rename(outdir, os.path.join(old, name))
+    elif os.path.exists(outdir):
+        raise ValueError("not a directory or symlink: %s" % outdir)
+
+    tmp_link = os.path.join(parent, ".%s.link-%d" % (name, os.getpid()))
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    # relative, so the tree can be moved or served from a chroot
+    os.symlink(os.path.basename(staging), tmp_link)
+    os.replace(tmp_link, outdir)
+
+    if old is not None and old != staging and os.path.isdir(old):
+        shutil.rmtree(old)
@@ -0,0 +1,111 @@
+"""
+In memory name completion, e.g. for search boxes. Names match if the
+query is a prefix of the name or of any word in the name, ignoring case,
+so "jasp" finds "Zinogre Jasper".
+"""
+
+import array
+import bisect
+import heapq
+
+
+# weights by type, so items (the most common search) rank first
+DEFAULT_TYPE_WEIGHTS = dict(item=4, monster=3, skill=2, weapon=1)
+
+
+def normalize_name(name):
+    return " ".join(name.lower().split())
+
+
+class NameIndex(object):
+    """
+    Sorted array of every word suffix of every name, searched with binary
+    search. Results for one and two character queries, which match a large
+    part of the names, are computed up front.
+
+    @param entries: iterable of (name, type, weight), higher weight ranks
+                    first, then shorter names
+    @param max_results: most results returned by complete
+    """
+    PRECOMPUTE_LENGTH = 2
+
+    def __init__(self, entries, max_results=50):
+        self.max_results = max_results
+        seen = set()
+        ranked = []
+        for name, name_type, weight in entries:
+            if (name, name_type) in seen:
+                continue
+            seen.add((name, name_type))
+            ranked.append((-weight, len(name), name, name_type))
+        ranked.sort()
+        # rank -> (name, type)
+        self._entries = [(name, name_type)
+                         for _, _, name, name_type in ranked]
+
+        keys = []
+        for rank, (name, name_type) in enumerate(self._entries):
+            normalized = normalize_name(name)
+            start = 0
+            while start >= 0:
+                keys.append((normalized[start:], rank))
+                start = normalized.find(" ", start)
+                if start >= 0:
+                    start += 1
+        keys.sort()
+        self._keys = [k for k, rank in keys]
+        self._ranks = array.array("i", [rank for k, rank in keys])
+
+        # prefix -> best ranks
+        short = dict()
+        for key, rank in keys:
+            for length in range(1, self.PRECOMPUTE_LENGTH + 1):
+                if len(key) >= length:
+                    short.setdefault(key[:length], set()).add(rank)
+        self._short = dict((prefix, heapq.nsmallest(max_results, ranks))
+                           for prefix, ranks in short.items())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def complete(self, query, n=10):
+        """
+        List of up to @n (name, type) matching @query, best first.
+        """
+        query = normalize_name(query)
+        if not query or n <= 0:
+            return []
+        n = min(n, self.max_results)
+        if len(query) <= self.PRECOMPUTE_LENGTH:
+            ranks = self._short.get(query, [])[:n]
+        else:
+            lo = bisect.bisect_left(self._keys, query)
+            hi = bisect.bisect_left(self._keys, query + "\uffff", lo)
+            ranks = heapq.nsmallest(n, set(self._ranks[lo:hi]))
+        return [self._entries[rank] for rank in ranks]
+
+
+def db_name_entries(db, item_types, weights=None,
+                    type_weights=DEFAULT_TYPE_WEIGHTS):
+    """
+    (name, type, weight) for items of @item_types, monsters, weapons and
+    skills in @db.
+
+    @param weights: optional dict of name to popularity weight, added to
+                    the type weight, e.g. from request counts
+    """
+    if weights is None:
+        weights = dict()
+
+    def entries(names, name_type):
+        base = type_weights[name_type]
+        for name in names:
+            yield name, name_type, base + weights.get(name, 0)
+
+    result = []
+    result.extend(entries(db.get_item_names(item_types), "item"))
+    result.extend(entries(db.get_monster_names(), "monster"))
+    result.extend(entries((w.name for w in db.get_weapons()), "weapon"))
+    result.extend(entries((s.name for s in db.get_skill_trees()), "skill"))
+    result.extend(entries((s.name for s in db.get_skills()), "skill"))
+    return result
@@ -1,12 +1,16 @@
 
 from collections import defaultdict
+import array
+import bisect
 import json
+import os
 import difflib
 import re
 import math
 
 from mhapi import skills
 from mhapi.model import SharpnessLevel, _break_find
+from mhapi.util import load_pickle_cache, save_pickle_cache
 
 
 WEAKPART_WEIGHT = 0.5
@@ -80,10 +84,38 @@ class MotionValue(object):
         self.total = sum(self.powers)
 
 
+def combine_motions(motions, name="Combo"):
+    """
+    Combine a sequence of motions, e.g. a combo, into a single motion
+    with all the hits.
+    """
+    types = []
+    powers = []
+    ele_mod = []
+    part_mod = []
+    for mv in motions:
+        types.extend(mv.types)
+        powers.extend(mv.powers)
+        ele_mod.extend(mv.ele_mod)
+        part_mod.extend(mv.part_mod)
+    return MotionValue(name, types, powers, ele_mod, part_mod)
+
+
 class WeaponTypeMotionValues(object):
+    """
+    Motion values for a weapon type. In addition to the MotionValue
+    objects, totals[i] and ele_mod_averages[i] hold the total power and
+    average element modifier of the motion names[i], and motion names are
+    indexed by substring for get_matching_indexes.
+    """
     def __init__(self, weapon_type, motion_data):
         self.weapon_type = weapon_type
         self.motion_values = dict()
+
+        self.names = []
+        self.totals = array.array("d")
+        self.ele_mod_averages = array.array("d")
+
         for d in motion_data:
             name = d["name"]
             ele_mod = d.get("ele_mod")
@@ -91,41 +123,121 @@ class WeaponTypeMotionValues(object):
             self.motion_values[name] = MotionValue(name, d["type"], d["power"],
                                                    ele_mod, part_mod)
 
-        self.average = (sum(mv.total
-                            for mv in self.motion_values.values())
-                        / len(self))
+        for name in self.motion_values:
+            mv = self.motion_values[name]
+            self.names.append(name)
+            self.totals.append(mv.total)
+            self.ele_mod_averages.append(sum(mv.ele_mod) / len(mv.ele_mod))
+
+        self.average = sum(self.totals) / len(self)
+
+        self._token_index = self._build_token_index()
+        self._match_cache = dict()
+
+    def _build_token_index(self):
+        """
+        Map every substring of every space separated token in the motion
+        names to the set of motion indexes containing it. Names are short,
+        so this stays small.
+        """
+        index = defaultdict(set)
+        for i, name in enumerate(self.names):
+            for token in name.split():
+                for start in range(len(token)):
+                    for end in range(start + 1, len(token) + 1):
+                        index[token[start:end]].add(i)
+        return index
+
+    def _candidates(self, pattern):
+        """
+        Set of motion indexes that may contain @pattern, or None if the
+        index can't narrow it down. Every space separated token of the
+        pattern is a substring of a token of any matching name.
+        """
+        tokens = pattern.split()
+        if not tokens:
+            return None
+        candidates = None
+        for token in tokens:
+            ids = self._token_index.get(token)
+            if not ids:
+                return set()
+            if candidates is None:
+                candidates = set(ids)
+            else:
+                candidates &= ids
+        return candidates
+
+    def get_matching_indexes(self, pattern):
+        """
+        Indexes into names of all motions with @pattern in the name, in
+        the original order.
+        """
+        indexes = self._match_cache.get(pattern)
+        if indexes is None:
+            candidates = self._candidates(pattern)
+            if candidates is None:
+                candidates = range(len(self.names))
+            indexes = [i for i in sorted(candidates)
+                       if pattern in self.names[i]]
+            self._match_cache[pattern] = indexes
+        return indexes
 
     def get_average_mv(self):
         return MotionValue("Average", types=[0], powers=[self.average])
 
     def get_matching_motions(self, pattern):
-        return [self.motion_values[name]
-                for name in self.keys()
-                if pattern in name]
+        return [self.motion_values[self.names[i]]
+                for i in self.get_matching_indexes(pattern)]
 
     def __len__(self):
         return len(self.motion_values)
 
     def keys(self):
-        return list(self.motion_values.keys())
+        return list(self.names)
 
     def __getitem__(self, key):
         return self.motion_values[key]
 
 
 class MotionValueDB(object):
-    def __init__(self, json_path):
-        with open(json_path) as f:
-            self._raw_data = json.load(f)
-
-        self.motion_values_map = dict()
-
-        for d in self._raw_data:
+    """
+    Motion values for all weapon types, loaded from a JSON file. The
+    compiled form is cached in a pickle file next to the JSON and reused
+    as long as the JSON file is not modified. Pass cache_path=False to
+    disable the cache.
+    """
+    CACHE_VERSION = 2
+
+    def __init__(self, json_path, cache_path=None):
+        if cache_path is None:
+            cache_path = os.path.splitext(json_path)[0] + ".pickle"
+        self.json_path = json_path
+        self.motion_values_map = None
+        st = os.stat(json_path)
+        cache_key = (self.CACHE_VERSION, st.st_mtime_ns, st.st_size)
+
+        if cache_path:
+            self.motion_values_map = load_pickle_cache(cache_path, cache_key)
+
+        if self.motion_values_map is None:
+            with open(json_path) as f:
+                raw_data = json.load(f)
+            self.motion_values_map = self._compile(raw_data)
+            if cache_path:
+                save_pickle_cache(cache_path, cache_key,
+                                  self.motion_values_map)
+
+    @staticmethod
+    def _compile(raw_data):
+        motion_values_map = dict()
+        for d in raw_data:
             wtype = d["name"]
             if wtype == "Sword":
                 wtype = "Sword and Shield"
-            self.motion_values_map[wtype] = WeaponTypeMotionValues(wtype,
+            motion_values_map[wtype] = WeaponTypeMotionValues(wtype,
                                                               d["motions"])
+        return motion_values_map
 
     def __getitem__(self, weapon_type):
         return self.motion_values_map[weapon_type]
@@ -198,6 +310,23 @@ class WeaponType(object):
         return cls._multiplier[weapon_type]
 
 
+def get_weapon_sharpness(weapon, sharp_plus=False, game="4u"):
+    """
+    Get the WeaponSharpness for the weapon with the given Sharpness+ level.
+    For Rise, @sharp_plus is the Handicraft level (0-5).
+    """
+    if sharp_plus:
+        if game == "mhr":
+            if weapon.sharpness_has_plus:
+                return weapon.sharpness_plus.get_rise_handicraft(sharp_plus)
+            return weapon.sharpness
+        if sharp_plus == 1:
+            return weapon.sharpness_plus
+        elif sharp_plus == 2:
+            return weapon.sharpness_plus2
+    return weapon.sharpness
+
+
 class WeaponMonsterDamage(object):
     """
     Class for calculating how much damage a weapon does to a monster.
@@ -256,20 +385,10 @@ class WeaponMonsterDamage(object):
                 # anti-species gem available with 2-slot, give the weapon a raw boost
                 self.true_raw = floor(self.true_raw * 1.05)
                 self.species_boost = True
-        if sharp_plus:
-            if game == "mhr":
-                if self.weapon.sharpness_has_plus:
-                    sharp_n = self.weapon.sharpness_plus.get_rise_handicraft(sharp_plus)
-                else:
-                    sharp_n = self.weapon.sharpness
-                self.sharpness, self.sharpness_points = sharp_n.get_max_points()
-            else:
-                if sharp_plus == 1:
-                    self.sharpness, self.sharpness_points = self.weapon.sharpness_plus.get_max_points()
-                elif sharp_plus == 2:
-                    self.sharpness, self.sharpness_points = self.weapon.sharpness_plus2.get_max_points()
-        else:
-            self.sharpness, self.sharpness_points = self.weapon.sharpness.get_max_points()
+        self.weapon_sharpness = get_weapon_sharpness(self.weapon, sharp_plus,
+                                                     game)
+        self.sharpness, self.sharpness_points = \
+            self.weapon_sharpness.get_max_points()
 
         self.sharpness_name = SharpnessLevel.name(self.sharpness)
 
@@ -325,15 +444,13 @@ class WeaponMonsterDamage(object):
 
         self.affinity = min(self.affinity + wex_affinity, 100)
 
-        if self.blunt_power:
-            if self.sharpness in (SharpnessLevel.RED, SharpnessLevel.ORANGE):
-                self.true_raw += 30
-            elif self.sharpness == SharpnessLevel.YELLOW:
-                self.true_raw += 25
-            elif self.sharpness == SharpnessLevel.GREEN:
-                self.true_raw += 15
+        # true raw before any sharpness dependent bonus, used to
+        # recalculate damage at lower sharpness levels
+        self._base_true_raw = self.true_raw
+        self.true_raw += self._blunt_power_bonus(self.sharpness)
 
         self.parts = []
+        self._part_rows = []
         self.break_count = 0
 
         self.averages = dict(
@@ -356,6 +473,17 @@ class WeaponMonsterDamage(object):
             return self.true_raw
         return self.true_raw * WeaponType.multiplier(self.weapon_type)
 
+    def _blunt_power_bonus(self, sharpness):
+        if not self.blunt_power:
+            return 0
+        if sharpness in (SharpnessLevel.RED, SharpnessLevel.ORANGE):
+            return 30
+        elif sharpness == SharpnessLevel.YELLOW:
+            return 25
+        elif sharpness == SharpnessLevel.GREEN:
+            return 15
+        return 0
+
     def _calculate_damage(self):
         for row in self.monster_damage._rows:
             # TODO: refactor to take advantage of new model
@@ -372,41 +500,9 @@ class WeaponMonsterDamage(object):
             if row["cut"] == -1:
                 continue
 
-            hitbox = 0
-            hitbox_cut = int(row["cut"])
-            hitbox_impact = int(row["impact"])
-            if self.damage_type == WeaponType.CUT:
-                hitbox = hitbox_cut
-            elif self.damage_type == WeaponType.IMPACT:
-                hitbox = hitbox_impact
-            elif self.damage_type == WeaponType.MIXED:
-                # Info from /u/ShadyFigure, see
-                # https://www.reddit.com/r/MonsterHunter/comments/3fr2u0/124th_weekly_stupid_question_thread/cts3hz8?context=3
-                hitbox = max(hitbox_cut, hitbox_impact * .72)
-
-            raw_total = 0
-            element_total = 0
-            for i, motion_raw in enumerate(self.motion.powers):
-                raw = raw_damage(self.true_raw, self.sharpness, self.affinity,
-                                 hitbox, motion_raw, crit_boost=self.crit_boost)
-
-                element = 0
-                ehitbox = 0
-                if self.etype in "Fire Water Ice Thunder Dragon".split():
-                    ehitbox = int(row[str(self.etype.lower())])
-                    eattack_mod = self.eattack * self.motion.ele_mod[i]
-                    element = element_damage(eattack_mod, self.sharpness, ehitbox)
-                    if self.etype2:
-                        # handle dual blades double element/status
-                        element = element / 2.0
-                        if self.etype2 in "Fire Water Ice Thunder Dragon".split():
-                            ehitbox2 = int(row[str(self.etype2.lower())])
-                            eattack2_mod = self.eattack2 * self.motion.ele_mod[i]
-                            element2 = element_damage(eattack2_mod,
-                                                      self.sharpness, ehitbox2)
-                            element += element2 / 2.0
-                raw_total += raw
-                element_total += element
+            self._part_rows.append((part, alt, row))
+            raw_total, element_total, hitbox, ehitbox = \
+                self._row_damage(row, self.sharpness, self.true_raw)
 
             part_damage = self.damage_map[part]
             part_damage.set_damage(raw_total, element_total, hitbox, ehitbox, state=alt)
@@ -441,6 +537,74 @@ class WeaponMonsterDamage(object):
         self.averages["break_only"] = self.break_only()
         self._calculate_cb_phial_damage()
 
+    def _row_damage(self, row, sharpness, true_raw):
+        """
+        Calculate damage from the motion to the hitzone in a single
+        monster damage row. Returns (raw, element, hitbox, ehitbox).
+        """
+        hitbox = 0
+        hitbox_cut = int(row["cut"])
+        hitbox_impact = int(row["impact"])
+        if self.damage_type == WeaponType.CUT:
+            hitbox = hitbox_cut
+        elif self.damage_type == WeaponType.IMPACT:
+            hitbox = hitbox_impact
+        elif self.damage_type == WeaponType.MIXED:
+            # Info from /u/ShadyFigure, see
+            # https://www.reddit.com/r/MonsterHunter/comments/3fr2u0/124th_weekly_stupid_question_thread/cts3hz8?context=3
+            hitbox = max(hitbox_cut, hitbox_impact * .72)
+
+        raw_total = 0
+        element_total = 0
+        ehitbox = 0
+        for i, motion_raw in enumerate(self.motion.powers):
+            raw = raw_damage(true_raw, sharpness, self.affinity,
+                             hitbox, motion_raw, crit_boost=self.crit_boost)
+
+            element = 0
+            ehitbox = 0
+            if self.etype in "Fire Water Ice Thunder Dragon".split():
+                ehitbox = int(row[str(self.etype.lower())])
+                eattack_mod = self.eattack * self.motion.ele_mod[i]
+                element = element_damage(eattack_mod, sharpness, ehitbox)
+                if self.etype2:
+                    # handle dual blades double element/status
+                    element = element / 2.0
+                    if self.etype2 in "Fire Water Ice Thunder Dragon".split():
+                        ehitbox2 = int(row[str(self.etype2.lower())])
+                        eattack2_mod = self.eattack2 * self.motion.ele_mod[i]
+                        element2 = element_damage(eattack2_mod,
+                                                  sharpness, ehitbox2)
+                        element += element2 / 2.0
+            raw_total += raw
+            element_total += element
+        return raw_total, element_total, hitbox, ehitbox
+
+    def get_sharpness_damage_map(self, sharpness):
+        """
+        Get the part -> PartDamage map for the same weapon, skills and
+        motion at a different sharpness level, e.g. after the weapon has
+        been dulled during a hunt. Breakable flags are copied from the
+        damage map at max sharpness.
+        """
+        if sharpness == self.sharpness:
+            return self.damage_map
+        true_raw = self._base_true_raw + self._blunt_power_bonus(sharpness)
+        damage_map = dict()
+        for part, alt, row in self._part_rows:
+            if part not in self.damage_map:
+                continue
+            part_damage = damage_map.get(part)
+            if part_damage is None:
+                part_damage = damage_map[part] = PartDamage()
+                part_damage.part = part
+                part_damage.breakable = self.damage_map[part].breakable
+            raw_total, element_total, hitbox, ehitbox = \
+                self._row_damage(row, sharpness, true_raw)
+            part_damage.set_damage(raw_total, element_total, hitbox, ehitbox,
+                                   state=alt)
+        return damage_map
+
     def _calculate_cb_phial_damage(self):
         if self.weapon_type != "Charge Blade":
             return
@@ -632,9 +796,16 @@ class WeaponMonsterDamage(object):
         """
         if motion is None:
             motion = self.motion
+        if isinstance(motion, MotionValue):
+            # raw is linear in motion value, element is per hit
+            power = motion.total
+            hits = sum(motion.ele_mod)
+        else:
+            power = motion
+            hits = 1
         raw = raw_damage_nohitbox(self.true_raw, self.sharpness,
-                                  self.affinity, motion)
-        element = element_damage_nohitbox(self.eattack, self.sharpness)
+                                  self.affinity, power)
+        element = element_damage_nohitbox(self.eattack, self.sharpness) * hits
         return (raw, element)
 
     def __getitem__(self, key):
@@ -644,6 +815,102 @@ class WeaponMonsterDamage(object):
         return self.parts
 
 
+class BreakEvenEnvelope(object):
+    """
+    Batch version of WeaponMonsterDamage.compare_break_even. Damage to a
+    part is proportional to raw * ratio + element, where ratio is the raw
+    hitbox divided by the element hitbox, so each weapon is a line over
+    the ratio. The upper envelope of the lines gives the best weapon for
+    every ratio, computed in O(n log n) instead of comparing all pairs.
+    Assumes same element, like compare_break_even.
+
+    @param lines: list of (key, raw, element), e.g. from nohitbox_damage
+    """
+    def __init__(self, lines):
+        # sort by slope, and for same slope keep the highest element;
+        # stable sort means ties go to the first key given
+        by_slope = sorted(lines, key=lambda l: (l[1], -l[2]))
+        hull = []
+        for line in by_slope:
+            if hull and hull[-1][1] == line[1]:
+                continue
+            while hull:
+                if line[2] >= hull[-1][2]:
+                    # steeper and higher at ratio 0, top is never best
+                    hull.pop()
+                    continue
+                if (len(hull) > 1
+                and (_intersect(hull[-2], line)
+                     <= _intersect(hull[-2], hull[-1]))):
+                    hull.pop()
+                    continue
+                break
+            hull.append(line)
+
+        self.starts = []
+        self.keys = []
+        self.lines = []
+        for i, line in enumerate(hull):
+            start = _intersect(hull[i-1], line) if i else 0.0
+            self.starts.append(max(0.0, start))
+            self.keys.append(line[0])
+            self.lines.append(line)
+
+    @classmethod
+    def from_weapon_damages(cls, named_damages, motion=None):
+        """
+        Create from list of (key, WeaponMonsterDamage).
+        """
+        lines = []
+        for key, wd in named_damages:
+            raw, element = wd.nohitbox_damage(motion)
+            lines.append((key, raw, element))
+        return cls(lines)
+
+    def intervals(self):
+        """
+        List of (start_ratio, end_ratio, key), where key is the best
+        weapon for ratios in the interval. The last end is infinity.
+        """
+        ends = self.starts[1:] + [float("inf")]
+        return list(zip(self.starts, ends, self.keys))
+
+    def best(self, ratio):
+        """
+        Key of the best weapon for the raw / element hitbox ratio. Use None
+        for an element hitbox of 0, where raw is all that matters.
+        """
+        if ratio is None:
+            return self.keys[-1]
+        i = bisect.bisect_right(self.starts, ratio) - 1
+        return self.keys[max(i, 0)]
+
+    def map_parts(self, raw_element_ratios):
+        """
+        Add the best weapon to each part from
+        WeaponMonsterDamage.get_raw_element_ratios, which uses ratio 0 for
+        parts with element hitbox 0.
+
+        Returns list of (part, hitbox, ehitbox, ratio, key).
+        """
+        result = []
+        for part, hitbox, ehitbox, ratio in raw_element_ratios:
+            if ehitbox > 0:
+                key = self.best(ratio)
+            else:
+                key = self.best(None)
+            result.append((part, hitbox, ehitbox, ratio, key))
+        return result
+
+
+def _intersect(line1, line2):
+    """
+    Ratio where two (key, raw, element) lines cross, line2 must have the
+    larger raw.
+    """
+    return float(line1[2] - line2[2]) / (line2[1] - line1[1])
+
+
 class PartDamageState(object):
     def __init__(self, raw, element, hitbox, ehitbox, state=None):
         self.raw = raw
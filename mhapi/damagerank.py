@@ -0,0 +1,312 @@
+"""
+Weapon damage rankings against a monster as JSON serializable dicts, for
+the /mhapi/damage web endpoint. Uses the same calculations and result
+format as mhdamage.py batch mode.
+
+Only games that use the default sharpness and critical eye modifiers are
+supported, the MHWorld and MHRise modifiers are global class state that
+can't be switched per request in a threaded server.
+"""
+
+import time
+
+from mhapi.db import db_exists
+from mhapi.damage import WeaponMonsterDamage, WeaponTypeMotionValues
+from mhapi.model import SharpnessLevel
+from mhapi.util import ELEMENTS, WEAPON_TYPES, WTYPE_ABBR
+
+
+# game -> whether weapon attack is true raw
+GAMES = {
+    "4u": False,
+    "3u": False,
+    "gu": True,
+}
+
+
+def available_games():
+    """
+    Supported games with the DB installed.
+    """
+    return [game for game in GAMES if db_exists(game)]
+
+
+class DamageBudgetExceeded(Exception):
+    """
+    Raised when a ranking uses more CPU time than allowed.
+    """
+    pass
+
+
+def get_wtype_match(term):
+    abbr_result = WTYPE_ABBR.get(term.upper())
+    if abbr_result is not None:
+        return abbr_result
+    term = term.title()
+    for wtype in WEAPON_TYPES:
+        if wtype.startswith(term):
+            return wtype
+    raise ValueError("Unknown weapon type: %s" % term)
+
+
+def get_element_match(term):
+    term = term.title()
+    for element in ELEMENTS:
+        if element.startswith(term):
+            return element
+    if term.lower() == "raw":
+        return "Raw"
+    raise ValueError("Unknown element or status: %s" % term)
+
+
+def crit_boost(level):
+    assert(level >= 0 and level <= 3)
+    return 25 + 5 * level
+
+
+def wex_affinity(level):
+    if level == 0:
+        return 0
+    elif level == 1:
+        return 15
+    elif level == 2:
+        return 30
+    elif level == 3:
+        return 50
+    assert(False)
+
+
+def get_monster_breaks(db, monster, monster_damage):
+    """
+    Get break part names, matched to the part names used in the damage data.
+    """
+    monster_breaks = db.get_monster_breaks(monster.id)
+    for i in range(len(monster_breaks)):
+        if monster_breaks[i] not in monster_damage:
+            plural = monster_breaks[i] + "s"
+            if plural in monster_damage:
+                monster_breaks[i] = plural
+    return monster_breaks
+
+
+def weapon_damage_result(name, wd_list, parts=None):
+    """
+    Summary of the WeaponMonsterDamage list for a weapon, one per motion,
+    with the averages over the motions.
+    """
+    wd = wd_list[0]
+    if parts is None:
+        parts = wd.parts
+    result = dict(name=name,
+                  efr=wd.efr,
+                  attack=wd.attack,
+                  affinity=wd.affinity,
+                  element_type=wd.etype,
+                  element_attack=wd.eattack,
+                  sharpness=SharpnessLevel.name(wd.sharpness),
+                  sharpness_points=wd.sharpness_points)
+    for avg_type in wd.averages:
+        result[avg_type] = (sum(x.averages[avg_type] for x in wd_list)
+                            / len(wd_list))
+    result["parts"] = dict(
+        (part, sum(x[part].average() for x in wd_list) / len(wd_list))
+        for part in parts)
+    return result
+
+
+def _normalize_name(name):
+    return " ".join(name.split())
+
+
+class DamageQuery(object):
+    """
+    Normalized parameters for a damage ranking, so equivalent requests
+    have the same key.
+
+    @param weapons: weapon names to compare, all the same type
+    @param weapon_type: rank all final weapons of this type instead,
+                        abbreviations like LS are allowed
+    @param element: with weapon_type, only weapons with this element or
+                    status, or "Raw"
+    @param skills: dict with keys from SKILLS
+    @param motion: custom motion value, otherwise the average motion value
+                   for the weapon type is used
+    @param match_motion: use the average of the motions with names
+                         containing this
+    @param parts: only include these parts in the part damage
+    """
+    # skill -> allowed levels, same as the mhdamage options
+    SKILLS = dict(
+        sharpness_plus=(0, 1, 2),
+        awaken=(0, 1),
+        attack_up=tuple(range(0, 5)),
+        critical_eye=tuple(range(0, 8)),
+        element_up=tuple(range(0, 6)),
+        artillery=(0, 1, 2),
+        frenzy=(0, 15, 30),
+        blunt_power=(0, 1),
+        crit_boost=(0, 1, 2, 3),
+        weakness_exploit=(0, 1, 2, 3),
+    )
+
+    def __init__(self, monster, weapons=(), weapon_type=None, element=None,
+                 skills=None, motion=None, match_motion=None, parts=None,
+                 game="4u"):
+        if game not in GAMES:
+            raise ValueError("Unsupported game: %s" % game)
+        if game not in available_games():
+            raise ValueError("Game not available: %s" % game)
+        self.game = game
+        self.monster = _normalize_name(monster or "")
+        if not self.monster:
+            raise ValueError("monster is required")
+        # order doesn't matter, results are sorted by damage
+        self.weapons = tuple(sorted(set(_normalize_name(w)
+                                        for w in weapons if w.strip())))
+        self.weapon_type = None
+        self.element = None
+        if weapon_type:
+            self.weapon_type = get_wtype_match(weapon_type.strip())
+            if element:
+                self.element = get_element_match(element.strip())
+        elif element:
+            raise ValueError("element requires weapon type")
+        if not self.weapons and not self.weapon_type:
+            raise ValueError("weapon names or weapon type required")
+
+        self.skills = dict((name, 0) for name in self.SKILLS)
+        for name, level in (skills or {}).items():
+            if name not in self.SKILLS:
+                raise ValueError("Unknown skill: %s" % name)
+            if str(level) not in map(str, self.SKILLS[name]):
+                raise ValueError("Bad level for %s: %s" % (name, level))
+            self.skills[name] = int(level)
+
+        if motion is not None and match_motion:
+            raise ValueError("motion and match_motion can't both be used")
+        self.motion = None
+        if motion is not None:
+            if not str(motion).isdigit() or int(motion) <= 0:
+                raise ValueError("motion must be a positive integer")
+            self.motion = int(motion)
+        self.match_motion = match_motion.strip() if match_motion else None
+        self.parts = tuple(sorted(set(_normalize_name(p) for p in parts
+                                      if p.strip()))) if parts else None
+
+    def key(self):
+        return (self.game, self.monster, self.weapons, self.weapon_type,
+                self.element, tuple(sorted(self.skills.items())),
+                self.motion, self.match_motion, self.parts)
+
+    def get_weapons(self, db):
+        """
+        Weapon rows matching the query, raises ValueError if a named weapon
+        doesn't exist or the weapons are not all the same type.
+        """
+        weapons = []
+        for name in self.weapons:
+            weapon = db.get_weapon_by_name(name)
+            if not weapon:
+                raise ValueError("Weapon '%s' not found" % name)
+            weapons.append(weapon)
+        if self.weapon_type:
+            names = set(self.weapons)
+            for w in db.get_weapons_by_query(wtype=self.weapon_type,
+                                             element=self.element, final=1):
+                if w.name not in names:
+                    weapons.append(w)
+        if not weapons:
+            raise ValueError("No matching weapons")
+        weapon_type = weapons[0]["wtype"]
+        for w in weapons:
+            if w["wtype"] != weapon_type:
+                raise ValueError(
+                    "Weapon '%s' is different type, got '%s' expected '%s'"
+                    % (w.name, w["wtype"], weapon_type))
+        return weapons
+
+    def get_motions(self, motiondb, weapon_type):
+        """
+        List of MotionValue to average over, raises ValueError if there are
+        no motion values for @weapon_type (e.g. bows and bowguns).
+        """
+        if weapon_type not in motiondb.keys():
+            raise ValueError("No motion values for weapon type: %s"
+                             % weapon_type)
+        motions = motiondb[weapon_type]
+        if self.motion:
+            motions = WeaponTypeMotionValues(weapon_type, [
+                dict(type=[0], name="Custom", power=[self.motion]),
+            ])
+        if self.match_motion:
+            indexes = motions.get_matching_indexes(self.match_motion)
+            if not indexes:
+                raise ValueError("No motions matching '%s'"
+                                 % self.match_motion)
+            return [motions[motions.names[i]] for i in indexes]
+        return [motions.get_average_mv()]
+
+
+def rank_weapons(db, motiondb, query, cpu_budget=None):
+    """
+    Rank the weapons in @query by uniform average damage to the monster.
+    Returns dict with monster, weapon_type, motions and weapons, the same
+    as mhdamage batch mode results.
+
+    @param cpu_budget: seconds of thread CPU time allowed, checked after
+                       each weapon, raises DamageBudgetExceeded
+    """
+    start = time.thread_time()
+    monster = db.get_monster_by_name(query.monster)
+    if not monster:
+        raise ValueError("Monster '%s' not found" % query.monster)
+    monster_damage = db.get_monster_damage(monster.id)
+    if not monster_damage.is_valid():
+        raise ValueError("invalid damage data for monster '%s'"
+                         % query.monster)
+    if query.parts:
+        for part in query.parts:
+            if part not in monster_damage.parts:
+                raise ValueError("Unknown part: %s, %s has %s"
+                                 % (part, monster.name,
+                                    ", ".join(monster_damage.parts)))
+    monster_breaks = get_monster_breaks(db, monster, monster_damage)
+
+    weapons = query.get_weapons(db)
+    weapon_type = weapons[0]["wtype"]
+    motion_list = query.get_motions(motiondb, weapon_type)
+    limit_parts = list(query.parts) if query.parts else None
+    s = query.skills
+
+    results = []
+    for row in weapons:
+        wd_list = []
+        for motion in motion_list:
+            wd = WeaponMonsterDamage(
+                        row, monster, monster_damage, motion,
+                        s["sharpness_plus"], monster_breaks,
+                        attack_skill=s["attack_up"],
+                        critical_eye_skill=s["critical_eye"],
+                        element_skill=s["element_up"],
+                        awaken=bool(s["awaken"]),
+                        artillery_level=s["artillery"],
+                        limit_parts=limit_parts,
+                        frenzy_bonus=s["frenzy"],
+                        is_true_attack=GAMES[query.game],
+                        blunt_power=bool(s["blunt_power"]),
+                        crit_boost=crit_boost(s["crit_boost"]),
+                        wex_affinity=wex_affinity(s["weakness_exploit"]),
+                        game=query.game)
+            wd_list.append(wd)
+        results.append(weapon_damage_result(row["name"], wd_list,
+                                            limit_parts))
+        if (cpu_budget is not None
+                and time.thread_time() - start > cpu_budget):
+            raise DamageBudgetExceeded(
+                "ranking %d weapons exceeds %gs CPU budget"
+                % (len(weapons), cpu_budget))
+    results.sort(key=lambda w: w["uniform"], reverse=True)
+    return dict(monster=monster.name, weapon_type=weapon_type,
+                motions=[m.name for m in motion_list], weapons=results,
+                skills=dict((name, level) for name, level in s.items()
+                            if level))
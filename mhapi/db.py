@@ -26,6 +26,16 @@ def _db_path(game=None):
     return os.path.join(project_path, "db", "mh%s.db" % game)
 
 
+def db_exists(game):
+    """
+    True if the DB file for @game is installed. Check before opening a
+    DB that may be missing, sqlite creates an empty file instead of
+    failing.
+    """
+    path = _db_path(game)
+    return os.path.exists(path) and os.path.getsize(path) > 0
+
+
 ARMOR_HUNTER_TYPES = {
     "Blade": 0,
     "Gunner": 1,
@@ -93,6 +103,7 @@ class MHDB(object):
                                   + "WHERE 1=1\n")
         if path is None:
             path = _db_path(game)
+        self.path = path
         self.conn = sqlite3.connect(path)
         self.conn.row_factory = sqlite3.Row
         self.use_cache = use_cache
@@ -323,6 +334,41 @@ class MHDB(object):
             WHERE quest_id=?
         """, (quest_id,))
 
+    def get_all_quest_rewards(self):
+        """
+        All quest_rewards rows, e.g. for grouping in memory with
+        rewards.BulkRewardsDB.
+        """
+        return self._query_all("all_quest_rewards", """
+            SELECT * FROM quest_rewards
+        """)
+
+    def get_all_hunting_rewards(self):
+        return self._query_all("all_hunting_rewards", """
+            SELECT * FROM hunting_rewards
+        """)
+
+    def get_all_quest_monsters(self):
+        return self._query_all("all_quest_monsters", """
+            SELECT quest_id, monster_id, unstable FROM monster_to_quest
+        """)
+
+    def get_all_gathering(self):
+        return self._query_all("all_gathering", """
+            SELECT * FROM gathering
+        """)
+
+    def get_all_wyporium(self):
+        """
+        All wyporium rows, empty list if the game doesn't have the
+        wyporium.
+        """
+        if self.game != "4u":
+            return []
+        return self._query_all("all_wyporium", """
+            SELECT * FROM wyporium
+        """)
+
     def get_monster_quests(self, monster_id, rank=None):
 
         query = """SELECT DISTINCT quests.* FROM quests, monster_to_quest
@@ -656,7 +702,8 @@ class MHDBX(object):
         module_path = os.path.dirname(__file__)
         self._mhx_db_path = os.path.abspath(os.path.join(module_path, "..",
                                             "db", game))
-        self._4udb = MHDB(game="gu")
+        # check first, sqlite would create an empty DB file
+        self._4udb = MHDB(game="gu") if db_exists("gu") else None
         self._weapon_list = []
         self._weapons_by_name = {}
         self._weapons_by_id = {}
@@ -744,18 +791,24 @@ class MHDBX(object):
         m = self._monsters_by_name.get(name)
         if m and m.id in self._monster_damage:
             return m
+        if self._4udb is None:
+            return None
         return self._4udb.get_monster_by_name(name)
 
     def get_monster_damage(self, monster_id):
         d = self._monster_damage.get(monster_id)
         if d:
             return d
+        if self._4udb is None:
+            return None
         return self._4udb.get_monster_damage(monster_id)
 
     def get_monster_breaks(self, monster_id):
         b = self._monster_breaks.get(monster_id)
         if b:
             return b
+        if self._4udb is None:
+            return []
         return self._4udb.get_monster_breaks(monster_id)
 
     def get_weapons_by_query(self, wtype=None, element=None,
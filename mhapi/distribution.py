@@ -0,0 +1,364 @@
+"""
+Exact probability distributions for damage, taking into account the
+randomness of critical hits. The damage functions in mhapi.damage use
+expected value for affinity, which is fine for comparing average damage
+but hides the variance, e.g. for chaotic gore weapons with both negative
+and positive affinity.
+
+Distributions are represented as NumPy arrays of probabilities over an
+integer damage grid, and combined with convolution (FFT for many hits).
+
+Requires numpy.
+"""
+
+import numpy as np
+
+from mhapi.damage import raw_damage
+
+
+# negative critical hits do 75% raw damage, which is the same as a
+# critical with affinity -100 and a boost of 25
+NEGATIVE_CRIT_BOOST = 25
+
+
+class DamageDistribution(object):
+    """
+    Probability mass function for damage, where pmf[i] is the probability
+    of doing i * resolution damage.
+    """
+    def __init__(self, pmf, resolution=1.0):
+        self.pmf = np.asarray(pmf, dtype=float)
+        self.resolution = resolution
+
+    @classmethod
+    def from_outcomes(cls, values, probs, resolution=1.0):
+        idx = np.rint(np.asarray(values, dtype=float)
+                      / resolution).astype(int)
+        if len(idx) and idx.min() < 0:
+            raise ValueError("damage values must be non-negative")
+        pmf = np.zeros(idx.max() + 1 if len(idx) else 1)
+        np.add.at(pmf, idx, probs)
+        return cls(pmf, resolution)
+
+    @classmethod
+    def mixture(cls, dists, weights):
+        """
+        Distribution where each of @dists is chosen with the matching weight.
+        """
+        size = max(len(d.pmf) for d in dists)
+        pmf = np.zeros(size)
+        for d, w in zip(dists, weights):
+            pmf[:len(d.pmf)] += w * d.pmf
+        return cls(pmf, dists[0].resolution)
+
+    @property
+    def values(self):
+        return np.arange(len(self.pmf)) * self.resolution
+
+    def mean(self):
+        return float(np.dot(self.values, self.pmf))
+
+    def variance(self):
+        values = self.values
+        mean = np.dot(values, self.pmf)
+        return float(np.dot((values - mean) ** 2, self.pmf))
+
+    def std(self):
+        return self.variance() ** 0.5
+
+    def cdf(self):
+        return np.cumsum(self.pmf)
+
+    def percentile(self, q):
+        """
+        Smallest damage d such that P(damage <= d) >= q / 100.
+        """
+        i = np.searchsorted(self.cdf(), q / 100.0 - 1e-12)
+        return min(i, len(self.pmf) - 1) * self.resolution
+
+    def convolve(self, other):
+        """
+        Distribution of the sum of independent damage from self and @other.
+        """
+        return DamageDistribution(_fft_convolve(self.pmf, other.pmf),
+                                  self.resolution)
+
+    def repeat(self, n):
+        """
+        Distribution of the total from @n independent draws.
+        """
+        if n == 0:
+            return DamageDistribution([1.0], self.resolution)
+        size = (len(self.pmf) - 1) * n + 1
+        fft_size = _next_fft_size(size)
+        f = np.fft.rfft(self.pmf, fft_size) ** n
+        return DamageDistribution(_clean(np.fft.irfft(f, fft_size)[:size]),
+                                  self.resolution)
+
+    def support(self):
+        """
+        (damage_indexes, probabilities) for outcomes with non-zero
+        probability.
+        """
+        idx = np.nonzero(self.pmf > 0)[0]
+        return idx, self.pmf[idx]
+
+
+def _next_fft_size(n):
+    size = 1
+    while size < n:
+        size <<= 1
+    return size
+
+
+def _clean(pmf):
+    # FFT leaves tiny negative values from rounding error
+    pmf = np.clip(pmf, 0, None)
+    total = pmf.sum()
+    if total > 0:
+        pmf /= total
+    return pmf
+
+
+def _fft_convolve(a, b):
+    size = len(a) + len(b) - 1
+    if min(len(a), len(b)) < 64:
+        return np.convolve(a, b)
+    fft_size = _next_fft_size(size)
+    f = np.fft.rfft(a, fft_size) * np.fft.rfft(b, fft_size)
+    return _clean(np.fft.irfft(f, fft_size)[:size])
+
+
+def crit_probabilities(weapon_damage):
+    """
+    Get (negative_p, positive_p) critical probabilities for the weapon
+    damage. For chaotic gore weapons (e.g. -35/10) the negative part is
+    only applied when not frenzied, the rest of the affinity including
+    skills is positive.
+    """
+    affinity = weapon_damage.affinity
+    negative = 0
+    if weapon_damage.chaotic and not weapon_damage.frenzy_bonus:
+        negative = sum(-int(x)
+                       for x in weapon_damage.weapon["affinity"].split("/")
+                       if int(x) < 0)
+        affinity += negative
+    elif affinity < 0:
+        negative = -affinity
+        affinity = 0
+    positive = max(0, min(affinity, 100))
+    negative = min(negative, 100 - positive)
+    return negative / 100.0, positive / 100.0
+
+
+def _state_weights(part_damage, break_weight=0.25, rage_weight=0.5):
+    """
+    Weights for each state of a PartDamage, matching PartDamage.average.
+    """
+    weights = dict()
+
+    def add(state, w):
+        weights[state] = weights.get(state, 0) + w
+
+    def add_alt(state, alt_weight, scale):
+        if state in part_damage.states:
+            add(state, alt_weight * scale)
+            add(None, (1 - alt_weight) * scale)
+        else:
+            add(None, scale)
+
+    if part_damage.break_diff():
+        if part_damage.rage_diff():
+            add_alt("Break Part", break_weight, 0.5)
+            add_alt("Enraged", rage_weight, 0.5)
+        else:
+            add_alt("Break Part", break_weight, 1.0)
+    else:
+        add_alt("Enraged", rage_weight, 1.0)
+    return weights
+
+
+def motion_distribution(weapon_damage, part, resolution=1.0):
+    """
+    Distribution of damage from one use of the weapon damage motion on
+    @part, mixing the part states the same way as PartDamage.average.
+    """
+    wd = weapon_damage
+    p_neg, p_pos = crit_probabilities(wd)
+    probs = [p_neg, 1.0 - p_neg - p_pos, p_pos]
+    part_damage = wd[part]
+    dists = []
+    weights = []
+    for state, weight in _state_weights(part_damage).items():
+        state_damage = part_damage.states[state]
+        dist = DamageDistribution.from_outcomes([state_damage.element], [1.0],
+                                                resolution)
+        for power in wd.motion.powers:
+            values = [raw_damage(wd.true_raw, wd.sharpness, -100,
+                                 state_damage.hitbox, power,
+                                 crit_boost=NEGATIVE_CRIT_BOOST),
+                      raw_damage(wd.true_raw, wd.sharpness, 0,
+                                 state_damage.hitbox, power),
+                      raw_damage(wd.true_raw, wd.sharpness, 100,
+                                 state_damage.hitbox, power,
+                                 crit_boost=wd.crit_boost)]
+            dist = dist.convolve(DamageDistribution.from_outcomes(
+                                                values, probs, resolution))
+        dists.append(dist)
+        weights.append(weight)
+    return DamageDistribution.mixture(dists, weights)
+
+
+def hit_distribution(weapon_damage, part_weights=None, resolution=1.0):
+    """
+    Distribution of damage from one use of the motion, where the part hit
+    is chosen according to @part_weights (default uniform).
+    """
+    parts = weapon_damage.parts
+    if part_weights is None:
+        part_weights = dict((part, 1.0) for part in parts)
+    part_weights = dict((p, w) for p, w in part_weights.items() if p in parts)
+    total = float(sum(part_weights.values()))
+    dists = [motion_distribution(weapon_damage, p, resolution)
+             for p in part_weights]
+    weights = [w / total for w in part_weights.values()]
+    return DamageDistribution.mixture(dists, weights)
+
+
+def total_damage_distribution(weapon_damage, hits, part_weights=None,
+                              resolution=1.0):
+    """
+    Distribution of total damage from @hits uses of the motion.
+    """
+    return hit_distribution(weapon_damage, part_weights,
+                            resolution).repeat(hits)
+
+
+class KillHits(object):
+    """
+    Distribution of the number of hits needed to deal @hp damage, given the
+    damage distribution for a single hit.
+
+    The total after n hits is the n-th power of the single hit transform,
+    and the probability of the total staying below hp is its dot product
+    with the transform of the [0, hp) indicator (Parseval), so the kill
+    probability for a whole range of n is one vectorized exp and matrix
+    product. The FFT is sized so there is no wrap around, i.e. the result
+    is exact up to float rounding.
+    """
+    def __init__(self, hit_dist, hp):
+        self.hit_dist = hit_dist
+        self.hp_idx = int(np.ceil(hp / hit_dist.resolution))
+        self.mean = hit_dist.mean() / hit_dist.resolution
+        self.std = hit_dist.std() / hit_dist.resolution
+        if self.mean <= 0:
+            raise ValueError("weapon does no damage")
+        self._transforms = dict()
+
+    def _get_transforms(self, max_hits):
+        size = _next_fft_size(max((len(self.hit_dist.pmf) - 1) * max_hits + 1,
+                                  self.hp_idx))
+        # any larger size is exact too
+        for cached_size in sorted(self._transforms):
+            if cached_size >= size:
+                return self._transforms[cached_size]
+        hit_fft = np.fft.rfft(self.hit_dist.pmf, size)
+        # avoid log(0), any power of a tiny value is still ~0
+        hit_fft[np.abs(hit_fft) < 1e-300] = 1e-300
+        alive_fft = np.conj(np.fft.rfft(np.ones(self.hp_idx), size))
+        # real signal, count the mirrored half of the spectrum twice
+        weights = np.full(len(alive_fft), 2.0)
+        weights[0] = 1.0
+        if size % 2 == 0:
+            weights[-1] = 1.0
+        transforms = (np.log(hit_fft), weights * alive_fft / size)
+        self._transforms[size] = transforms
+        return transforms
+
+    def cdf(self, hits_list):
+        """
+        Array with the probability of dealing at least hp damage within
+        each number of hits in @hits_list.
+        """
+        hits = np.asarray(hits_list, dtype=int)
+        if not len(hits):
+            return np.zeros(0)
+        log_fft, alive_fft = self._get_transforms(max(1, hits.max()))
+        alive = np.real(np.exp(np.outer(np.maximum(hits, 0), log_fft))
+                        .dot(alive_fft))
+        p = np.clip(1.0 - alive, 0.0, 1.0)
+        p[hits <= 0] = 0.0
+        return p
+
+    def p_kill(self, hits):
+        return float(self.cdf([hits])[0])
+
+    def percentiles(self, qs):
+        """
+        Fewest hits needed to kill with probability at least q percent,
+        for each q in @qs.
+        """
+        cache = dict()
+
+        def p_kill(hits):
+            if hits not in cache:
+                cache[hits] = self.p_kill(hits)
+            return cache[hits]
+
+        # start from the normal approximation and bisect, evaluations are
+        # shared between percentiles
+        n_mean = self.hp_idx / self.mean
+        n_sd = (n_mean ** 0.5) * self.std / self.mean
+        # size the transform for the whole window up front
+        self._get_transforms(int(np.ceil(n_mean + 6 * n_sd)) + 1)
+        results = []
+        for q in qs:
+            target = q / 100.0 - 1e-9
+            lo = max(0, int(n_mean - 6 * n_sd) - 1)
+            hi = int(np.ceil(n_mean + 6 * n_sd)) + 1
+            while lo > 0 and p_kill(lo) >= target:
+                lo //= 2
+            while p_kill(hi) < target:
+                lo, hi = hi, hi * 2
+            # invariant: p_kill(lo) < target <= p_kill(hi)
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if p_kill(mid) >= target:
+                    hi = mid
+                else:
+                    lo = mid
+            results.append(hi)
+        return results
+
+    def percentile(self, q):
+        return self.percentiles([q])[0]
+
+
+def kill_hits_percentiles(weapon_damage, hp, percentiles=(10, 50, 90),
+                          part_weights=None, resolution=1.0):
+    """
+    Number of hits needed to deal @hp damage with the given probabilities,
+    e.g. the 90th percentile is the number of hits needed to kill the
+    monster 90% of the time.
+    """
+    kill_hits = KillHits(hit_distribution(weapon_damage, part_weights,
+                                          resolution), hp)
+    return kill_hits.percentiles(percentiles)
+
+
+def compare_kill_percentiles(weapon_damages, hp, percentiles=(10, 50, 90),
+                             part_weights=None, resolution=1.0):
+    """
+    Get list of (weapon_damage, percentile_hits) for each weapon damage,
+    sorted by fewest hits at the median or the first percentile given.
+    """
+    results = []
+    for wd in weapon_damages:
+        results.append((wd, kill_hits_percentiles(wd, hp, percentiles,
+                                                  part_weights, resolution)))
+    if 50 in percentiles:
+        key_index = list(percentiles).index(50)
+    else:
+        key_index = 0
+    results.sort(key=lambda r: r[1][key_index])
+    return results
@@ -0,0 +1,284 @@
+"""
+JSON files that mimic a REST API for monster hunter data, one file per
+weapon, armor, item etc plus list, index and all files for each entity.
+Used by bin/mkjsonapi.py to create static files, and by the web app to
+serve the same files from memory.
+
+The *_json functions write files for one entity under @path using a
+BuildManifest or MemoryWriter, so both get exactly the same bytes.
+"""
+
+import os
+import json
+import urllib.request, urllib.parse, urllib.error
+
+from mhapi.db import MHDB, MHDBX
+from mhapi import model
+
+
+ENTITIES = """item weapon monster armor
+              skilltree skill decoration
+              horn_melody wyporium""".split()
+
+
+def get_entities(game):
+    """
+    Entities available for @game.
+    """
+    if game != "4u":
+        return [e for e in ENTITIES if e != "wyporium"]
+    return list(ENTITIES)
+
+
+def open_db(game):
+    if game in ("mhx", "mhr"):
+        return MHDBX(game=game)
+    return MHDB(game=game, include_item_components=True)
+
+
+class MemoryWriter(object):
+    """
+    Keeps files written by the *_json functions in memory, as UTF-8 bytes
+    keyed by path relative to @base.
+    """
+    def __init__(self, base=""):
+        self.base = base
+        self.files = dict()
+
+    def write(self, path, data):
+        key = os.path.relpath(path, self.base) if self.base else path
+        self.files[os.path.normpath(key)] = data.encode("utf8")
+        return True
+
+
+def entity_json(db, entity, outpath, manifest):
+    """
+    Write files for @entity in the @entity directory under @outpath.
+    """
+    if entity not in ENTITIES:
+        raise ValueError("Unknown entity: %s" % entity)
+    fn = globals()["%s_json" % entity]
+    fn(db, os.path.join(outpath, entity), manifest)
+
+
+SAFE_CHARS = " &'+\""
+
+
+def file_path(path, model_object, alt_name_field=None):
+    if alt_name_field:
+        key = urllib.parse.quote(model_object[alt_name_field].encode("utf8"),
+                           SAFE_CHARS)
+    else:
+        key = str(model_object.id)
+    return os.path.join(path, "%s.json" % key)
+
+
+def write_json_file(manifest, path, data):
+    """
+    Write data as JSON, skipping the write if the file is unchanged since
+    the last incremental build. @manifest is a BuildManifest, or a
+    MemoryWriter to keep the files in memory.
+    """
+    manifest.write(path, json.dumps(data, cls=model.ModelJSONEncoder,
+                                    indent=2))
+
+
+def write_list_file(path, model_list, manifest):
+    list_path = os.path.join(path, "_list.json")
+    write_json_file(manifest, list_path,
+                    [o.as_list_data() for o in model_list])
+
+
+def write_index_file(path, indexes, manifest):
+    for key, data in indexes.items():
+        index_path = os.path.join(path, "_index_%s.json" % key)
+        write_json_file(manifest, index_path, data)
+
+
+def write_all_file(path, all_data, manifest):
+    all_path = os.path.join(path, "_all.json")
+    write_json_file(manifest, all_path, all_data)
+
+
+def write_map_file(path, map_data, manifest):
+    map_path = os.path.join(path, "_map.json")
+    write_json_file(manifest, map_path, map_data)
+
+
+def monster_json(db, path, manifest):
+    monsters = db.get_monsters()
+    write_list_file(path, monsters, manifest)
+
+    indexes = {}
+    for m in monsters:
+        monster_path = file_path(path, m)
+        m.update_indexes(indexes)
+        data = m.as_data()
+        damage = db.get_monster_damage(m.id)
+        damage.set_breakable(db.get_monster_breaks(m.id))
+        data["damage"] = damage.as_data()
+        write_json_file(manifest, monster_path, data)
+
+    write_index_file(path, indexes, manifest)
+
+
+def armor_json(db, path, manifest):
+    armors = db.get_armors()
+    write_list_file(path, armors, manifest)
+    all_data = []
+
+    indexes = {}
+    for a in armors:
+        armor_path = file_path(path, a)
+        a.update_indexes(indexes)
+        skills = db.get_item_skills(a.id)
+        if not skills:
+            print("WARN: armor '%s' (%d) has no skills" % (a.name, a.id))
+        a.set_skills(skills)
+
+        all_data.append(a.as_data())
+
+        write_json_file(manifest, armor_path, a)
+
+    write_index_file(path, indexes, manifest)
+    write_all_file(path, all_data, manifest)
+
+
+def decoration_json(db, path, manifest):
+    decorations = db.get_decorations()
+    write_list_file(path, decorations, manifest)
+    all_data = []
+
+    indexes = {}
+    for a in decorations:
+        decoration_path = file_path(path, a)
+        a.update_indexes(indexes)
+        skills = db.get_item_skills(a.id)
+        if not skills:
+            print("WARN: decoration '%s' (%d) has no skills" % (a.name, a.id))
+        a.set_skills(skills)
+
+        all_data.append(a.as_data())
+
+        write_json_file(manifest, decoration_path, a)
+
+    write_index_file(path, indexes, manifest)
+    write_all_file(path, all_data, manifest)
+
+
+def skill_json(db, path, manifest):
+    skills = db.get_skills()
+    write_list_file(path, skills, manifest)
+
+    indexes = {}
+    for s in skills:
+        s.update_indexes(indexes)
+        skill_path = file_path(path, s)
+        write_json_file(manifest, skill_path, s)
+
+    write_index_file(path, indexes, manifest)
+
+
+def skilltree_json(db, path, manifest):
+    skill_trees = db.get_skill_trees()
+    write_list_file(path, skill_trees, manifest)
+
+    all_data = {}
+    for st in skill_trees:
+        ds = db.get_decorations_by_skills([st.id])
+        for d in ds:
+            d.set_skills(db.get_item_skills(d.id))
+        st.set_decorations(ds)
+        skilltree_path = file_path(path, st)
+        all_data[st.name] = st
+        write_json_file(manifest, skilltree_path, st)
+
+    write_all_file(path, all_data, manifest)
+
+
+def weapon_json(db, path, manifest):
+    weapons = db.get_weapons()
+    write_list_file(path, weapons, manifest)
+
+    item_stars = model.ItemStars(db)
+
+    all_data = []
+    melodies = {}
+    indexes = {}
+    for w in weapons:
+        weapon_path = file_path(path, w)
+        w.update_indexes(indexes)
+        data = w.as_data()
+
+        child_weapons = db.get_weapons_by_parent(w.id)
+        data["children"] = [dict(id=c.id, name=c.name) for c in child_weapons]
+
+        if w.horn_notes:
+            if w.horn_notes not in melodies:
+                melodies[w.horn_notes] = [
+                    dict(song=melody.song, effect1=melody.effect1)
+                    for melody in db.get_horn_melodies_by_notes(w.horn_notes)
+                ]
+            data["horn_melodies"] = melodies[w.horn_notes]
+
+        if db.game == "4u":
+            stars = item_stars.get_weapon_stars(w)
+            data["village_stars"] = stars["Village"]
+            data["guild_stars"] = stars["Guild"]
+            data["permit_stars"] = stars["Permit"]
+            data["arena_stars"] = stars["Arena"]
+
+        all_data.append(data)
+
+        write_json_file(manifest, weapon_path, data)
+
+        tree_path = os.path.join(path, "%s_tree.json" % w.id)
+        costs = model.get_costs(db, w)
+        for cost in costs:
+            cost["path"] = [dict(name=w.name, id=w.id)
+                            for w in cost["path"]]
+        write_json_file(manifest, tree_path, costs)
+
+    write_index_file(path, indexes, manifest)
+    write_all_file(path, all_data, manifest)
+
+
+def item_json(db, path, manifest):
+    if db.game == "4u":
+        items = db.get_items(wyporium=True)
+    else:
+        items = db.get_items()
+    write_list_file(path, items, manifest)
+
+
+    indexes = {}
+    for item in items:
+        item_path = file_path(path, item)
+        item.update_indexes(indexes)
+        write_json_file(manifest, item_path, item)
+
+    write_index_file(path, indexes, manifest)
+
+
+def wyporium_json(db, path, manifest):
+    trade_map = {}
+    for item in db.get_wyporium_trades():
+        trade_map[item.id] = dict(id=item.id,
+                                  name=item.name)
+        all_data = item.as_data()
+        for k in all_data.keys():
+            if not k.startswith("wyporium"):
+                continue
+            trade_map[item.id][k] = all_data[k]
+    write_map_file(path, trade_map, manifest)
+
+
+def horn_melody_json(db, path, manifest):
+    # only 143 rows, just do index with all data
+    melodies = db.get_horn_melodies()
+
+    indexes = {}
+    for melody in melodies:
+        melody.update_indexes(indexes)
+
+    write_index_file(path, indexes, manifest)
@@ -659,7 +659,7 @@ class MonsterDamage(ModelBase):
 
     def as_data(self):
         return dict(
-            states=list(self.states),
+            states=self.state_names(),
             parts=self.parts
         )
 
@@ -878,6 +878,20 @@ class ItemStars(object):
         if self.db.game == "4u":
             self.init_wyporium_trades()
 
+    def get_snapshot(self):
+        """
+        Get a copy of the cached stars as plain dicts, which can be sent to
+        other processes and loaded with load_snapshot.
+        """
+        return dict(items=dict(self._item_stars),
+                    weapons=dict(self._weapon_stars),
+                    monsters=dict(self._monster_stars))
+
+    def load_snapshot(self, snapshot):
+        self._item_stars.update(snapshot["items"])
+        self._weapon_stars.update(snapshot["weapons"])
+        self._monster_stars.update(snapshot["monsters"])
+
     def init_wyporium_trades(self):
         trades = self.db.get_wyporium_trades()
         for item in trades:
@@ -0,0 +1,284 @@
+"""
+Exact probability distributions for the number of an item obtained from
+running a quest, combining quest rewards (A, B and Sub lines), carves,
+capture rewards and breaks. The expected values in mhapi.rewards are
+enough to rank strategies, but don't say how likely it is to have the
+items after a given number of runs, or how many runs it takes.
+
+The count for one run is a NumPy array over item counts, the same
+representation as the damage distributions in mhapi.distribution, and
+multi run totals and quantiles use the same FFT based code.
+
+Gathering is not included, the number of gathering attempts depends on
+the player.
+
+Requires numpy.
+"""
+
+import numpy as np
+
+from mhapi import stats
+from mhapi.distribution import DamageDistribution, KillHits
+from mhapi.rewards import (ItemRewards, RankAndSkills, STRAT_KILL, STRAT_CAP,
+                           SKILL_CAP, SKILL_CARVING)
+from mhapi.skills import LuckSkill, CapSkill, CarvingSkill
+
+
+def draws_pmf(draw_p, draw_pmf):
+    """
+    Distribution of the total from a random number of independent draws.
+
+    @param draw_p: sequence where item c is the probability of c draws
+    @param draw_pmf: distribution of the count from one draw
+    """
+    draw_pmf = np.asarray(draw_pmf, dtype=float)
+    max_draws = len(draw_p) - 1
+    pmf = np.zeros((len(draw_pmf) - 1) * max_draws + 1)
+    total = np.ones(1)
+    for c, p in enumerate(draw_p):
+        if c > 0:
+            total = np.convolve(total, draw_pmf)
+        if p:
+            pmf[:len(total)] += p * total
+    return pmf
+
+
+def _reward_pmf(stack_size, percentage):
+    """
+    Distribution of the count from one draw that gives @stack_size with
+    @percentage chance.
+    """
+    pmf = np.zeros(stack_size + 1)
+    p = min(percentage / 100.0, 1.0)
+    pmf[0] = 1.0 - p
+    pmf[stack_size] += p
+    return pmf
+
+
+def _fixed_p(c):
+    """
+    Draw count distribution for exactly @c draws.
+    """
+    p = [0.0] * (c + 1)
+    p[c] = 1.0
+    return p
+
+
+def quest_line_pmf(quest_rewards, luck_skill=LuckSkill.NONE):
+    """
+    Distribution of the item count from the QuestReward objects of one
+    reward line (A, B or Sub) of a quest.
+
+    Each reward that isn't fixed is a chance on every draw that is not
+    taken by a fixed reward, the same as QuestReward expected values.
+    """
+    pmf = np.ones(1)
+    if not quest_rewards:
+        return pmf
+    slot = quest_rewards[0].slot
+    fixed_rewards = quest_rewards[0].fixed_rewards
+    count_p = stats.QUEST_REWARD_COUNT_P[(slot, luck_skill)]
+    # fixed rewards are always one draw each
+    draw_p = [0.0] * len(count_p)
+    for c, p in enumerate(count_p):
+        draw_p[max(0, c - fixed_rewards)] += p
+
+    draw_pmf = np.ones(1)
+    for qr in quest_rewards:
+        if qr.percentage == 100:
+            pmf = np.convolve(pmf, _reward_pmf(qr.stack_size, 100))
+            continue
+        # rewards in a line are exclusive on each draw
+        r = np.zeros(max(len(draw_pmf), qr.stack_size + 1))
+        r[:len(draw_pmf)] = draw_pmf
+        p = qr.percentage / 100.0
+        r[0] -= p
+        r[qr.stack_size] += p
+        draw_pmf = r
+    if len(draw_pmf) > 1:
+        draw_pmf[0] = max(0.0, draw_pmf[0])
+        pmf = np.convolve(pmf, draws_pmf(draw_p, draw_pmf))
+    return pmf
+
+
+def hunt_reward_pmf(hunt_reward, strategy, cap_skill=CapSkill.NONE,
+                    carving_skill=CarvingSkill.NONE):
+    """
+    Distribution of the item count from one HuntReward, matching
+    HuntReward.expected_value.
+    """
+    if strategy == STRAT_CAP and not hunt_reward.cap:
+        return np.ones(1)
+    if strategy == STRAT_KILL and not hunt_reward.kill:
+        return np.ones(1)
+    percentage = hunt_reward.percentage
+    if hunt_reward.skill == SKILL_CARVING:
+        # stack size is the number of carves, each a chance for one
+        carve_p = stats.CARVE_DELTA_COUNT_P[carving_skill]
+        draw_p = [0.0] * hunt_reward.stack_size + list(carve_p)
+        return draws_pmf(draw_p, _reward_pmf(1, percentage))
+    elif hunt_reward.skill == SKILL_CAP:
+        return draws_pmf(stats.CAPTURE_REWARD_COUNT_P[cap_skill],
+                         _reward_pmf(1, percentage))
+    elif "Carve" in hunt_reward.condition:
+        return draws_pmf(_fixed_p(hunt_reward.stack_size),
+                         _reward_pmf(1, percentage))
+    else:
+        return _reward_pmf(hunt_reward.stack_size, percentage)
+
+
+def run_distribution(quest_item, hunt_items, strategy,
+                     luck_skill=LuckSkill.NONE,
+                     cap_skill=CapSkill.NONE,
+                     carving_skill=CarvingSkill.NONE):
+    """
+    Distribution of the item count from one run of a quest.
+
+    @param quest_item: QuestItemExpectedValue for the item and quest, or
+                       None if the item is not a quest reward
+    @param hunt_items: HuntItemExpectedValue for each quest monster
+    @param strategy: STRAT_KILL or STRAT_CAP
+    Returns a DamageDistribution over item counts.
+    """
+    pmf = np.ones(1)
+    for slot in ("A", "B", "Sub"):
+        if quest_item is None:
+            break
+        line = quest_item.slot_rewards[slot]
+        if line:
+            pmf = np.convolve(pmf, quest_line_pmf(line, luck_skill))
+    for hunt_item in hunt_items:
+        for reward in hunt_item.matching_rewards:
+            pmf = np.convolve(pmf, hunt_reward_pmf(reward, strategy,
+                                                   cap_skill,
+                                                   carving_skill))
+    return DamageDistribution(pmf)
+
+
+def expected_runs(run_dist, count):
+    """
+    Expected number of runs to get at least @count of the item, or None
+    if the item can't be obtained.
+
+    Exact: with E(r) the expected runs to get r more, each run gives i
+    items with probability p_i, so E(r) = 1 + sum_i p_i E(r - i), where
+    E(r) = 0 for r <= 0.
+    """
+    pmf = run_dist.pmf
+    p_none = pmf[0]
+    if p_none >= 1.0:
+        return None
+    e = np.zeros(count + 1)
+    for r in range(1, count + 1):
+        total = 1.0
+        for i in range(1, min(r, len(pmf))):
+            total += pmf[i] * e[r - i]
+        e[r] = total / (1.0 - p_none)
+    return float(e[count])
+
+
+class FarmingOdds(object):
+    """
+    Odds of getting an item from running a quest with a strategy.
+
+    @param run_dist: count distribution for one run, see run_distribution
+    """
+    def __init__(self, item_id, quest, strat, run_dist):
+        self.item_id = item_id
+        self.quest = quest
+        self.strat = strat
+        self.run_dist = run_dist
+        self._kill_hits = dict()
+
+    def _runs(self, count):
+        # the number of runs to collect count items is the same problem as
+        # the number of hits to deal hp damage
+        kh = self._kill_hits.get(count)
+        if kh is None:
+            kh = KillHits(self.run_dist, count)
+            self._kill_hits[count] = kh
+        return kh
+
+    @property
+    def mean(self):
+        """Expected count per run."""
+        return self.run_dist.mean()
+
+    def count_distribution(self, runs):
+        """
+        DamageDistribution of the total count after @runs runs.
+        """
+        return self.run_dist.repeat(runs)
+
+    def p_at_least(self, count, runs):
+        """
+        Probability of having at least @count of the item after @runs
+        runs.
+        """
+        if count <= 0:
+            return 1.0
+        if self.mean <= 0:
+            return 0.0
+        return self._runs(count).p_kill(runs)
+
+    def runs_for(self, count, percentiles=(50, 90)):
+        """
+        Fewest runs needed to get @count of the item with each probability
+        in @percentiles.
+        """
+        if self.mean <= 0:
+            raise ValueError("item can't be obtained from the quest")
+        return self._runs(count).percentiles(percentiles)
+
+    def expected_runs(self, count):
+        return expected_runs(self.run_dist, count)
+
+
+def item_farming_odds(db, item, rank="G",
+                      luck_skill=LuckSkill.NONE,
+                      cap_skill=CapSkill.NONE,
+                      carving_skill=CarvingSkill.NONE):
+    """
+    Get FarmingOdds for every quest and strategy that can give the item at
+    @rank, with the given skills.
+
+    @param db: MHDB or BulkRewardsDB
+    """
+    skills = RankAndSkills(rank, luck_skill=luck_skill, cap_skill=cap_skill,
+                           carving_skill=carving_skill)
+    ir = ItemRewards(db, item)
+    results = []
+    for quest in db.get_quests():
+        quest_item = ir.get_quest_item(quest.id)
+        hunt_items = ir.get_quest_hunt_items(quest)
+        if quest_item is None and not hunt_items:
+            continue
+        # gathering is not included, see module docs
+        strats = skills.quest_strats(quest, quest_item, hunt_items, None)
+        if strats is None:
+            continue
+        for strat in strats:
+            run_dist = run_distribution(quest_item, hunt_items, strat.strat,
+                                        luck_skill, cap_skill,
+                                        carving_skill)
+            if run_dist.pmf[0] >= 1.0:
+                continue
+            results.append(FarmingOdds(ir.item_id, quest, strat.strat,
+                                       run_dist))
+    return results
+
+
+def best_farming_odds(odds_list, count=1):
+    """
+    The FarmingOdds with the fewest expected runs to get @count, or None.
+    """
+    best = None
+    best_runs = None
+    for odds in odds_list:
+        runs = odds.expected_runs(count)
+        if runs is None:
+            continue
+        if best is None or runs < best_runs:
+            best = odds
+            best_runs = runs
+    return best
@@ -4,10 +4,13 @@ and hunts for getting an item with specified skills.
 """
 
 
-from collections import OrderedDict
+import os
+from collections import OrderedDict, defaultdict
 
 from mhapi import stats
 from mhapi.skills import LuckSkill, CapSkill, CarvingSkill
+from mhapi.util import load_pickle_cache, save_pickle_cache
+from mhapi.build import file_fingerprint
 
 SKILL_CARVING = "carving"
 SKILL_CAP = "cap"
@@ -21,6 +24,10 @@ STRAT_CAP_OR_KILL = "cap/kill"
 
 ITEM_TYPES = "Materials Bone Bug Coin/Ticket Fish Flesh Meat Ore Plant Sac/Fluid".split()
 
+# types excluded from rewards in GU, which has many more item types
+GU_EXCLUDE_TYPES = [
+    "Palico Armor", "Palico Weapon", "Weapon", "Armor", "Decoration"]
+
 
 def _format_range(min_v, max_v):
     if min_v == max_v:
@@ -139,15 +146,9 @@ class QuestReward(object):
             self.skill_delta = 0
         else:
             # variable reward, expected number of draws depends on luck skill
-            if self.slot == stats.QUEST_SUB:
-                # sub quest rewards aren't affected by luck skill in 4U,
-                # so it's the same no matter what the luck skill is.
-                counts = ([stats.quest_reward_expected_c(self.slot)]
-                          * (LuckSkill.AMAZING - LuckSkill.NONE + 1))
-            else:
-                counts = [stats.quest_reward_expected_c(self.slot, skill)
-                          for skill in range(LuckSkill.NONE,
-                                              LuckSkill.AMAZING+1)]
+            # sub quest rewards aren't affected by luck skill in 4U, the
+            # stats table has the same count for every luck skill.
+            counts = stats.quest_reward_expected_c_array(self.slot)
 
 
             evs = [((count - self.fixed_rewards)
@@ -355,11 +356,7 @@ class HuntReward(object):
             self.skill = SKILL_CAP
             self.cap = True
             self.kill = False
-            counts = [
-                stats.capture_reward_expected_c(skill)
-                for skill in range(CapSkill.NONE,
-                                    CapSkill.GOD+1)
-            ]
+            counts = stats.capture_reward_expected_c_array()
         elif self.condition == "Virus Reward":
             # TODO: not sure how these work
             # Assume 1 always for easy comparison. My guess is that you
@@ -391,11 +388,8 @@ class HuntReward(object):
                                  % self.condition)
 
         if self.skill == SKILL_CARVING:
-            counts = [
-                self.stack_size + stats.carve_delta_expected_c(skill)
-                for skill in range(CarvingSkill.NONE,
-                                    CarvingSkill.GOD+1)
-            ]
+            counts = [self.stack_size + delta
+                      for delta in stats.carve_delta_expected_c_array()]
 
         evs = [(i *  self.percentage) for i in counts]
 
@@ -478,8 +472,21 @@ class RankAndSkills(object):
         self._compare_strats(kill_strat, cap_strat)
 
     def add_quest_option(self, quest_item, hunt_items, gather_location):
-        if not self._rank_available(quest_item.quest.rank):
+        strats = self.quest_strats(quest_item.quest, quest_item, hunt_items,
+                                   gather_location)
+        if strats is None:
             return False
+        kill_strat, cap_strat = strats
+        self._compare_strats(kill_strat, cap_strat)
+
+    def quest_strats(self, quest, quest_item, hunt_items, gather_location):
+        """
+        Get (kill_strat, cap_strat) for running the quest with these skills,
+        or None if the quest is not available at this rank. @quest_item is
+        None if the item is not a quest reward.
+        """
+        if not self._rank_available(quest.rank):
+            return None
 
         cap_strat = ItemStrategy(STRAT_CAP,
                                  luck_skill=self.luck_skill,
@@ -492,12 +499,13 @@ class RankAndSkills(object):
                                  carving_skill=self.carving_skill,
                                  explorer=self.explorer)
         for strat in (cap_strat, kill_strat):
-            strat.set_quest_item(quest_item)
+            if quest_item is not None:
+                strat.set_quest_item(quest_item)
             if gather_location:
                 strat.set_gather_location(gather_location)
             for hi in hunt_items:
                 strat.add_hunt_item(hi)
-        self._compare_strats(kill_strat, cap_strat)
+        return kill_strat, cap_strat
 
 
 class ItemStrategy(object):
@@ -593,8 +601,26 @@ class ItemStrategy(object):
 
         return True
 
-    def __cmp__(self, other):
-        return cmp(self.ev, other.ev)
+    # strategies are ordered by expected value
+    def __eq__(self, other):
+        return self.ev == other.ev
+
+    def __ne__(self, other):
+        return self.ev != other.ev
+
+    def __lt__(self, other):
+        return self.ev < other.ev
+
+    def __le__(self, other):
+        return self.ev <= other.ev
+
+    def __gt__(self, other):
+        return self.ev > other.ev
+
+    def __ge__(self, other):
+        return self.ev >= other.ev
+
+    __hash__ = object.__hash__
 
 
 class HuntItemExpectedValue(object):
@@ -663,6 +689,96 @@ class HuntItemExpectedValue(object):
         self.matching_rewards.append(reward)
 
 
+class BulkRewardsDB(object):
+    """
+    In memory copy of the reward tables, with the part of the MHDB
+    interface used by ItemRewards. Each table is loaded with one query and
+    grouped by item, monster or quest, so ItemRewards can be created for
+    every item without any per item queries, e.g. to generate the rewards
+    files for all items.
+
+    Rows in each group are in table order, the same as the per item
+    queries, so the results match ItemRewards with an MHDB.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.game = db.game
+
+        self._locations = db.get_locations()
+        self._monsters = dict((m.id, m) for m in db.get_monsters())
+        self._quests = dict((q.id, q) for q in db.get_quests())
+
+        self._wyporium = dict()
+        for row in db.get_all_wyporium():
+            self._wyporium.setdefault(row["item_in_id"], row)
+
+        self._item_gathering = defaultdict(list)
+        for row in db.get_all_gathering():
+            self._item_gathering[row["item_id"]].append(row)
+
+        # (monster_id, rank) -> rows, rank None for all ranks
+        self._monster_rewards = defaultdict(list)
+        # item_id -> {(monster_id, rank): row}, in order of first reward
+        self._item_monsters = defaultdict(OrderedDict)
+        for row in db.get_all_hunting_rewards():
+            mid = row["monster_id"]
+            rank = row["rank"]
+            self._monster_rewards[(mid, rank)].append(row)
+            self._monster_rewards[(mid, None)].append(row)
+            item_monsters = self._item_monsters[row["item_id"]]
+            if (mid, rank) not in item_monsters:
+                item_monsters[(mid, rank)] = dict(monster_id=mid, rank=rank)
+
+        self._quest_rewards = defaultdict(list)
+        # item_id -> quest ids, in order of first reward
+        self._item_quest_ids = defaultdict(OrderedDict)
+        for row in db.get_all_quest_rewards():
+            self._quest_rewards[row["quest_id"]].append(row)
+            self._item_quest_ids[row["item_id"]][row["quest_id"]] = True
+
+        self._quest_monsters = defaultdict(list)
+        for row in db.get_all_quest_monsters():
+            self._quest_monsters[row["quest_id"]].append(row)
+
+    def get_item(self, item_id):
+        return self.db.get_item(item_id)
+
+    def get_wyporium_trade(self, item_id):
+        return self._wyporium.get(item_id)
+
+    def get_quest(self, quest_id):
+        return self._quests.get(quest_id)
+
+    def get_locations(self):
+        return self._locations
+
+    def get_monster(self, monster_id):
+        return self._monsters.get(monster_id)
+
+    def get_item_gathering(self, item_id):
+        return self._item_gathering.get(item_id, [])
+
+    def get_item_monsters(self, item_id):
+        return list(self._item_monsters.get(item_id, {}).values())
+
+    def get_monster_rewards(self, monster_id, rank=None):
+        return self._monster_rewards.get((monster_id, rank), [])
+
+    def get_quest_monsters(self, quest_id):
+        return self._quest_monsters.get(quest_id, [])
+
+    def get_quests(self):
+        return list(self._quests.values())
+
+    def get_item_quests(self, item_id):
+        quests = []
+        for quest_id in self._item_quest_ids.get(item_id, {}):
+            quest = self._quests[quest_id]
+            quest.rewards = self._quest_rewards[quest_id]
+            quests.append(quest)
+        return quests
+
+
 class ItemRewards(object):
     def __init__(self, db, item_row):
         self.db = db
@@ -714,12 +830,23 @@ class ItemRewards(object):
 
     def _find_gather_items(self):
         gathering_rows = self.db.get_item_gathering(self.item_id)
-        locations = self.db.get_locations()
-        for loc in locations:
+        if not gathering_rows:
+            return
+        # group once, so each GatherLocation only sees its own rows and
+        # is only created for location/ranks that have the item
+        grouped = defaultdict(list)
+        for r in gathering_rows:
+            grouped[(r["location_id"], r["rank"])].append(r)
+        location_ids = set(location_id for location_id, rank in grouped)
+        for loc in self.db.get_locations():
+            if loc.id not in location_ids:
+                continue
             for rank in "LR HR G".split():
-                gl = GatherLocation(loc, rank, gathering_rows)
+                key = (loc.id, rank)
+                if key not in grouped:
+                    continue
+                gl = GatherLocation(loc, rank, grouped[key])
                 if gl:
-                    key = (loc.id, rank)
                     self._gather_items[key] = gl
 
     def _find_hunt_items(self):
@@ -745,6 +872,12 @@ class ItemRewards(object):
         key = (monster_id, monster_rank)
         return self._hunt_items.get(key)
 
+    def get_quest_item(self, quest_id):
+        return self._quest_items.get(quest_id)
+
+    def get_gather_location(self, location_id, rank):
+        return self._gather_items.get((location_id, rank))
+
     def _find_quest_items(self):
         """
         Get a list of the quests for acquiring a given item and the probability
@@ -756,26 +889,8 @@ class ItemRewards(object):
         for q in quests:
             quest_item = QuestItemExpectedValue(self.item_id, q)
             self._quest_items[q.id] = quest_item
-            quest_monsters = self.db.get_quest_monsters(quest_item.quest.id)
-            hunt_items = []
-            for m in quest_monsters:
-                mid = m["monster_id"]
-
-                # It looks like every monster other than the first is
-                # marked as stable. This looks like it's usually correct
-                # for single monster quests, but wrong for multi monster
-                # quests, so skip the unstable monsters for single monster
-                # quests.
-                unstable = (m["unstable"] == "yes")
-                if unstable:
-                    continue
-
-                hunt_item = self.get_hunt_item(mid, quest_item.quest.rank)
-                if hunt_item:
-                    hunt_items.append(hunt_item)
-
-            gather_key = (quest_item.quest.location_id, quest_item.quest.rank)
-            gather_location = self._gather_items.get(gather_key)
+            hunt_items = self.get_quest_hunt_items(q)
+            gather_location = self.get_gather_location(q.location_id, q.rank)
 
             for rank, skill_sets in self.rank_skill_sets.items():
                 for s in skill_sets.values():
@@ -821,6 +936,29 @@ class ItemRewards(object):
                 out.write("  %20s %5.2f / 100\n" % ("Shiny", shiny_ev))
             out.write("\n")
 
+    def get_quest_hunt_items(self, quest):
+        """
+        HuntItemExpectedValue for each monster in @quest that has the item.
+        """
+        hunt_items = []
+        multi_monster = quest.is_multi_monster()
+        for m in self.db.get_quest_monsters(quest.id):
+            mid = m["monster_id"]
+
+            # It looks like every monster other than the first is
+            # marked as unstable. This looks like it's usually correct
+            # for single monster quests, but wrong for multi monster
+            # quests, so skip the unstable monsters for single monster
+            # quests.
+            unstable = (m["unstable"] == "yes")
+            if unstable and not multi_monster:
+                continue
+
+            hunt_item = self.get_hunt_item(mid, quest.rank)
+            if hunt_item:
+                hunt_items.append(hunt_item)
+        return hunt_items
+
     def get_best_strat(self, rank="G", skill="No skills"):
         return self.rank_skill_sets[rank][skill].best
 
@@ -868,12 +1006,7 @@ class ItemRewards(object):
             cap_ev = [quest_ev, quest_ev]
             kill_ev = [quest_ev, quest_ev]
             shiny_ev = 0
-            for m in quest_monsters:
-                mid = m["monster_id"]
-                hunt_item = self.get_hunt_item(mid, quest_item.quest.rank)
-                if hunt_item is None or m["unstable"] == "yes":
-                    continue
-
+            for hunt_item in self.get_quest_hunt_items(quest_item.quest):
                 kill_ev[0] += hunt_item.expected_value(STRAT_KILL)
                 kill_ev[1] += hunt_item.expected_value(STRAT_KILL,
                                           carving_skill=CarvingSkill.GOD)
@@ -928,3 +1061,331 @@ class ItemRewards(object):
         self.print_gather_locations(out)
         self.print_monsters(out)
         self.print_quests(out)
+
+
+def get_reward_items(db):
+    """
+    Items that can have rewards, i.e. the items with rewards files.
+    """
+    if db.game == "gu":
+        return db.get_items(exclude_types=GU_EXCLUDE_TYPES)
+    return db.get_items(ITEM_TYPES)
+
+
+class RewardsEVMatrix(object):
+    """
+    Expected value of the best strategy for every reward item, for each
+    rank and skill set used by ItemRewards, e.g. to rank all items by sell
+    value times expected value without creating ItemRewards for each item.
+
+    Building the matrix needs ItemRewards for all items, so the result is
+    cached in a pickle file next to the DB, and reused as long as the DB
+    file and the rewards code are not modified. Use load to get the cached
+    matrix.
+
+    Values are per 100 attempts, like ItemStrategy.ev. Wyporium trade items
+    have the values of the item they are traded for, see trade_item_ids.
+    """
+    CACHE_VERSION = 1
+
+    def __init__(self, item_ids, columns, evs, strats, trade_item_ids):
+        # item_ids[i] is the item for evs[i] and strats[i], columns[j] is
+        # the (rank, skill set name) for evs[i][j] and strats[i][j]
+        self.item_ids = tuple(item_ids)
+        self.columns = tuple(columns)
+        self.evs = evs
+        self.strats = strats
+        self.trade_item_ids = frozenset(trade_item_ids)
+        self._rows = dict((item_id, i)
+                          for i, item_id in enumerate(self.item_ids))
+        self._column_index = dict((c, j)
+                                  for j, c in enumerate(self.columns))
+
+    @classmethod
+    def build(cls, rewards_db, items):
+        """
+        @param rewards_db: BulkRewardsDB or MHDB
+        @param items: item rows, e.g. from get_reward_items
+        """
+        columns = None
+        item_ids = []
+        evs = []
+        strats = []
+        trade_item_ids = []
+        for item in items:
+            ir = ItemRewards(rewards_db, item)
+            if columns is None:
+                columns = [(rank, skill)
+                           for rank, skill_sets in ir.rank_skill_sets.items()
+                           for skill in skill_sets]
+            row_evs = []
+            row_strats = []
+            for rank, skill in columns:
+                best = ir.get_best_strat(rank, skill)
+                if best is None:
+                    row_evs.append(0)
+                    row_strats.append(None)
+                else:
+                    row_evs.append(best.ev)
+                    row_strats.append(best.strat)
+            item_ids.append(item.id)
+            evs.append(tuple(row_evs))
+            strats.append(tuple(row_strats))
+            if ir.trade_item_id is not None:
+                trade_item_ids.append(item.id)
+        return cls(item_ids, columns or [], evs, strats, trade_item_ids)
+
+    @classmethod
+    def load(cls, db, cache_path=None):
+        """
+        Get the matrix for all reward items in @db, from the cache if
+        possible. Pass cache_path=False to disable the cache.
+        """
+        if cache_path is None:
+            cache_path = os.path.splitext(db.path)[0] + ".rewards_ev.pickle"
+        cache_key = None
+        if cache_path:
+            cache_key = cls._cache_key(db)
+            data = load_pickle_cache(cache_path, cache_key)
+            if data is not None:
+                return cls(*data)
+
+        matrix = cls.build(BulkRewardsDB(db), get_reward_items(db))
+        if cache_path:
+            save_pickle_cache(cache_path, cache_key, matrix._data())
+        return matrix
+
+    @classmethod
+    def _cache_key(cls, db):
+        st = os.stat(db.path)
+        return (cls.CACHE_VERSION, db.game, st.st_mtime_ns, st.st_size,
+                file_fingerprint(__file__, stats.__file__))
+
+    def _data(self):
+        return (self.item_ids, self.columns, self.evs, self.strats,
+                sorted(self.trade_item_ids))
+
+    def __contains__(self, item_id):
+        return item_id in self._rows
+
+    def column_index(self, rank="G", skill="No skills"):
+        try:
+            return self._column_index[(rank, skill)]
+        except KeyError:
+            raise ValueError("Unknown rank/skill set: %s %s" % (rank, skill))
+
+    def get_ev(self, item_id, rank="G", skill="No skills"):
+        """
+        Expected value of the best strategy for the item, 0 if the item
+        can't be obtained with the rank.
+        """
+        return self.evs[self._rows[item_id]][self.column_index(rank, skill)]
+
+    def get_strat(self, item_id, rank="G", skill="No skills"):
+        """
+        Best strategy type for the item, e.g. STRAT_KILL, or None.
+        """
+        return self.strats[self._rows[item_id]][self.column_index(rank,
+                                                                  skill)]
+
+    def column(self, rank="G", skill="No skills"):
+        """
+        Dict of item id to expected value for one rank and skill set.
+        """
+        j = self.column_index(rank, skill)
+        return dict((item_id, row[j])
+                    for item_id, row in zip(self.item_ids, self.evs))
+
+    def top_items(self, weights, rank="G", skill="No skills",
+                  include_trades=False):
+        """
+        Rank items by weight times expected value, e.g. with sell price as
+        the weight to find the best items to farm for money.
+
+        @param weights: dict of item id to weight, only these items are
+                        included
+        @param include_trades: if False, Wyporium trade items have value 0
+        Returns list of (item_id, value, ev) with the highest value first,
+        value is per attempt (ev / 100 * weight). Items with the same value
+        are in the order of the matrix.
+        """
+        j = self.column_index(rank, skill)
+        # a plain sort, with about a thousand items a numpy argsort is no
+        # faster once the weights are looked up
+        results = []
+        for item_id, row in zip(self.item_ids, self.evs):
+            weight = weights.get(item_id)
+            if weight is None:
+                continue
+            if not include_trades and item_id in self.trade_item_ids:
+                ev = 0
+            else:
+                ev = row[j]
+            results.append((item_id, weight * ev / 100.0, ev))
+        results.sort(key=lambda r: r[1], reverse=True)
+        return results
+
+
+class FarmingPlanStep(object):
+    """
+    Run a quest @runs times with strategy @strat (kill, cap, or cap/kill if
+    it doesn't matter for the items in the plan).
+
+    @param yields: expected number of each required item per run, in the
+                   same order as the plan items
+    """
+    def __init__(self, quest, strat, yields, runs=0):
+        self.quest = quest
+        self.strat = strat
+        self.yields = yields
+        self.runs = runs
+
+    def print(self, out, item_names):
+        out.write("%4d x %s %s\n"
+                  % (self.runs, self.quest.one_line_u(), self.strat))
+        for name, y in zip(item_names, self.yields):
+            if y:
+                out.write("         %-20s %5.2f / run\n" % (name, y))
+
+
+class FarmingPlan(object):
+    """
+    Quests to run to get a list of items, from plan_farming.
+
+    @param items: list of (item_row, count) required
+    @param steps: list of FarmingPlanStep, in the order they were chosen
+    @param unavailable: item rows that can't be obtained from any quest
+                        with the rank and skills
+    """
+    def __init__(self, items, steps, unavailable):
+        self.items = items
+        self.steps = steps
+        self.unavailable = unavailable
+
+    @property
+    def total_runs(self):
+        return sum(step.runs for step in self.steps)
+
+    def expected_counts(self):
+        """
+        Expected number of each item after running all the steps.
+        """
+        totals = [0.0] * len(self.items)
+        for step in self.steps:
+            for i, y in enumerate(step.yields):
+                totals[i] += step.runs * y
+        return totals
+
+    def print(self, out):
+        names = [item.name for item, count in self.items]
+        for step in self.steps:
+            step.print(out, names)
+        out.write("\nTotal runs: %d\n" % self.total_runs)
+        for (item, count), total in zip(self.items,
+                                        self.expected_counts()):
+            out.write("  %-20s %3d needed, %6.2f expected\n"
+                      % (item.name, count, total))
+        for item in self.unavailable:
+            out.write("  %-20s not available from quests\n" % item.name)
+
+
+def plan_farming(db, items, rank="G",
+                 luck_skill=LuckSkill.NONE,
+                 cap_skill=CapSkill.NONE,
+                 carving_skill=CarvingSkill.NONE,
+                 explorer=False):
+    """
+    Find quests to run to get the required count of several items, with
+    the fewest expected runs.
+
+    The yield of every quest and strategy (kill or cap) is a vector with
+    the expected count of each required item per run, combining the quest
+    rewards, hunt rewards from the quest monsters and gathering at the
+    quest location, the same as the per item strategies. All quests are
+    considered, not only those with the items as quest rewards, so e.g. a
+    quest hunting the monster that carves an item is a candidate. Quests are chosen greedily, by the
+    fraction of the remaining need covered per run, and each chosen quest
+    is run until one of the items it covers is done. This is the standard
+    greedy approximation for covering problems, and is fast enough to run
+    over every quest for each request.
+
+    Counts are expected values, so in practice it can take more or less
+    runs to get all the items.
+
+    @param db: MHDB or BulkRewardsDB
+    @param items: list of (item_row, count)
+    Returns a FarmingPlan.
+    """
+    skills = RankAndSkills(rank, luck_skill=luck_skill, cap_skill=cap_skill,
+                           carving_skill=carving_skill, explorer=explorer)
+    n = len(items)
+
+    item_rewards = [ItemRewards(db, item) for item, count in items]
+
+    # (quest_id, strat) -> FarmingPlanStep with per run yields
+    options = OrderedDict()
+    available = [False] * n
+    for quest in db.get_quests():
+        for i, ir in enumerate(item_rewards):
+            strats = skills.quest_strats(
+                        quest, ir.get_quest_item(quest.id),
+                        ir.get_quest_hunt_items(quest),
+                        ir.get_gather_location(quest.location_id, quest.rank))
+            if strats is None:
+                # not available at this rank, same for all items
+                break
+            for strat in strats:
+                if strat.ev <= 0:
+                    continue
+                key = (quest.id, strat.strat)
+                option = options.get(key)
+                if option is None:
+                    option = FarmingPlanStep(quest, strat.strat, [0.0] * n)
+                    options[key] = option
+                option.yields[i] += strat.ev / 100.0
+                available[i] = True
+
+    need = [float(count) if available[i] else 0.0
+            for i, (item, count) in enumerate(items)]
+    remaining = list(need)
+    steps = OrderedDict()
+    # tolerance for float error in the running totals
+    epsilon = 1e-9
+    while any(r > epsilon for r in remaining):
+        best = None
+        best_score = 0.0
+        for key, option in options.items():
+            score = 0.0
+            for y, r, nd in zip(option.yields, remaining, need):
+                if y and r > epsilon:
+                    score += min(y, r) / nd
+            if score > best_score:
+                best = key
+                best_score = score
+        if best is None:
+            break
+        option = options[best]
+        # run until one of the remaining items is done
+        runs = min(r / y for y, r in zip(option.yields, remaining)
+                   if y and r > epsilon)
+        runs = max(1, int(runs + epsilon))
+        for i, y in enumerate(option.yields):
+            remaining[i] -= runs * y
+        step = steps.get(best)
+        if step is None:
+            step = FarmingPlanStep(option.quest, option.strat,
+                                   option.yields)
+            steps[best] = step
+        step.runs += runs
+
+    for (quest_id, strat), step in steps.items():
+        # say so if the other strategy is just as good for all the items
+        other = STRAT_CAP if strat == STRAT_KILL else STRAT_KILL
+        other_option = options.get((quest_id, other))
+        if (other_option is not None
+                and other_option.yields == step.yields):
+            step.strat = STRAT_CAP_OR_KILL
+
+    unavailable = [item for i, (item, count) in enumerate(items)
+                   if not available[i]]
+    return FarmingPlan(items, list(steps.values()), unavailable)
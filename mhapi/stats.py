@@ -2,6 +2,8 @@
 Utility functions for calculating monster hunter related statistics.
 """
 
+from types import MappingProxyType
+
 CAP_SKILL_NONE = 0
 CAP_SKILL_EXPERT = 1
 CAP_SKILL_MASTER = 2
@@ -81,13 +83,20 @@ def reward_expected_c(min_rewards, max_rewards, extend_percent):
     return expected_attempts
 
 
-def quest_reward_expected_c(line=QUEST_A, luck_skill=LUCK_SKILL_NONE):
+def reward_count_distribution(min_rewards, max_rewards, extend_percent):
     """
-    Expected number of rewards from specified quest line with given skills.
+    Tuple where item i is the probability of getting exactly i rewards,
+    for i from 0 to @max_rewards.
+    """
+    return tuple(_reward_count_p(i, min_rewards, max_rewards, extend_percent)
+                 if i >= min_rewards else 0.0
+                 for i in range(max_rewards + 1))
 
-    Note: if the quest has fixed rewards that aren't the desired item, it will
-    reduce the expected count for the desired item. Just subtract the number
-    of fixed items from the output to get the actual value.
+
+def _quest_reward_params(line, luck_skill):
+    """
+    (min_rewards, max_rewards, extend_percent) for the quest line and luck
+    skill.
     """
     if luck_skill == LUCK_SKILL_NONE:
         extend_p = 22 * 100.0 / 32
@@ -117,34 +126,30 @@ def quest_reward_expected_c(line=QUEST_A, luck_skill=LUCK_SKILL_NONE):
     else:
         raise ValueError()
 
-    return reward_expected_c(min_c, max_c, extend_p)
+    return min_c, max_c, extend_p
 
 
-def capture_reward_expected_c(cap_skill=CAP_SKILL_NONE):
+def _capture_reward_params(cap_skill):
     """
-    Expected value for number of capture rewards given the specified
-    capture skill (none by default).
+    (min_rewards, max_rewards, extend_percent) for capture rewards with
+    the capture skill.
     """
     if cap_skill == CAP_SKILL_NONE:
-        min_c = 2
-        max_c = 3
-        extend_p = 22 * 100.0 / 32
+        return 2, 3, 22 * 100.0 / 32
     elif cap_skill == CAP_SKILL_EXPERT:
-        return 3
+        return 3, 3, 0
     elif cap_skill == CAP_SKILL_MASTER:
-        min_c = 3
-        max_c = 4
-        extend_p = 22 * 100.0 / 32
+        return 3, 4, 22 * 100.0 / 32
     elif cap_skill == CAP_SKILL_GOD:
-        return 4
+        return 4, 4, 0
     else:
         raise ValueError()
-    return reward_expected_c(min_c, max_c, extend_p)
 
 
-def carve_delta_expected_c(carve_skill):
+def _carve_delta_params(carve_skill):
     """
-    Expected value for the number of extra carves with the given skill.
+    (min_extra, max_extra, extend_percent) for extra carves with the
+    carving skill.
 
     Word on the street is that since Tri the felyne skills do not stack with
     the armor skills, i.e. if you have Carving Celebrity plus you get at
@@ -152,25 +157,128 @@ def carve_delta_expected_c(carve_skill):
     """
     if carve_skill == CARVING_SKILL_CELEBRITY:
         # Description: Increases the number of carving chances by one and prevents knockbacks while carving.
-        return 1
+        return 1, 1, 0
     elif carve_skill == CARVING_SKILL_GOD:
         # Description: Increases the number of carving chances by one (maybe more) and prevents knockbacks while carving.
         # From ShadyFigure on reddit, extend chance is 25 / 32
-        min_c = 1
-        max_c = 2
-        extend_p = 25 * 100.0 / 32
+        return 1, 2, 25 * 100.0 / 32
     elif carve_skill == CARVING_SKILL_FELYNE_LOW:
-        min_c = 0
-        max_c = 1
-        extend_p = 25
+        return 0, 1, 25
     elif carve_skill == CARVING_SKILL_FELYNE_HI:
-        min_c = 0
-        max_c = 1
-        extend_p = 50
+        return 0, 1, 50
     elif carve_skill in (CARVING_SKILL_NONE, CARVING_SKILL_PRO):
         # Description: Prevents knockbacks from attacks while carving.
-        return 0
+        return 0, 0, 0
     else:
         raise ValueError()
-    return reward_expected_c(min_c, max_c, extend_p)
 
+
+QUEST_LINES = (QUEST_A, QUEST_B, QUEST_SUB)
+LUCK_SKILLS = tuple(range(LUCK_SKILL_NONE, LUCK_SKILL_AMAZING + 1))
+CAP_SKILLS = tuple(range(CAP_SKILL_NONE, CAP_SKILL_GOD + 1))
+CARVING_SKILLS = tuple(range(CARVING_SKILL_NONE, CARVING_SKILL_GOD + 1))
+
+
+def _make_tables(keys, params_fn):
+    """
+    Build read only (expected count, count distribution) tables for all
+    @keys. There are only a few skill combinations, so everything is
+    computed once at import instead of on every reward row.
+    """
+    expected = {}
+    distribution = {}
+    for key in keys:
+        if isinstance(key, tuple):
+            params = params_fn(*key)
+        else:
+            params = params_fn(key)
+        if params[0] == params[1]:
+            # no chance of extra rewards
+            expected[key] = params[0]
+        else:
+            expected[key] = reward_expected_c(*params)
+        distribution[key] = reward_count_distribution(*params)
+    return MappingProxyType(expected), MappingProxyType(distribution)
+
+
+# (line, luck_skill) -> expected count / distribution of counts
+QUEST_REWARD_EXPECTED_C, QUEST_REWARD_COUNT_P = _make_tables(
+    [(line, luck) for line in QUEST_LINES for luck in LUCK_SKILLS],
+    _quest_reward_params)
+
+# cap_skill -> expected count / distribution of counts
+CAPTURE_REWARD_EXPECTED_C, CAPTURE_REWARD_COUNT_P = _make_tables(
+    CAP_SKILLS, _capture_reward_params)
+
+# carving_skill -> expected extra carves / distribution of extra carves
+CARVE_DELTA_EXPECTED_C, CARVE_DELTA_COUNT_P = _make_tables(
+    CARVING_SKILLS, _carve_delta_params)
+
+
+def _lookup(table, key):
+    try:
+        return table[key]
+    except KeyError:
+        raise ValueError()
+
+
+def quest_reward_expected_c(line=QUEST_A, luck_skill=LUCK_SKILL_NONE):
+    """
+    Expected number of rewards from specified quest line with given skills.
+
+    Note: if the quest has fixed rewards that aren't the desired item, it will
+    reduce the expected count for the desired item. Just subtract the number
+    of fixed items from the output to get the actual value.
+    """
+    return _lookup(QUEST_REWARD_EXPECTED_C, (line, luck_skill))
+
+
+def capture_reward_expected_c(cap_skill=CAP_SKILL_NONE):
+    """
+    Expected value for number of capture rewards given the specified
+    capture skill (none by default).
+    """
+    return _lookup(CAPTURE_REWARD_EXPECTED_C, cap_skill)
+
+
+def carve_delta_expected_c(carve_skill):
+    """
+    Expected value for the number of extra carves with the given skill.
+    """
+    return _lookup(CARVE_DELTA_EXPECTED_C, carve_skill)
+
+
+def quest_reward_expected_c_array(line=QUEST_A):
+    """
+    Tuple of expected number of rewards for each luck skill, from
+    LUCK_SKILL_NONE to LUCK_SKILL_AMAZING.
+    """
+    return _QUEST_REWARD_EXPECTED_C_ARRAYS[line]
+
+
+def capture_reward_expected_c_array():
+    """
+    Tuple of expected number of capture rewards for each capture skill,
+    from CAP_SKILL_NONE to CAP_SKILL_GOD.
+    """
+    return _CAPTURE_REWARD_EXPECTED_C_ARRAY
+
+
+def carve_delta_expected_c_array():
+    """
+    Tuple of expected number of extra carves for each carving skill, from
+    CARVING_SKILL_NONE to CARVING_SKILL_GOD.
+    """
+    return _CARVE_DELTA_EXPECTED_C_ARRAY
+
+
+# tuples rather than numpy arrays, callers loop over the four or five
+# values per reward row in Python, which is faster on a tuple
+_QUEST_REWARD_EXPECTED_C_ARRAYS = MappingProxyType(dict(
+    (line, tuple(QUEST_REWARD_EXPECTED_C[(line, luck)]
+                 for luck in LUCK_SKILLS))
+    for line in QUEST_LINES))
+_CAPTURE_REWARD_EXPECTED_C_ARRAY = tuple(CAPTURE_REWARD_EXPECTED_C[skill]
+                                         for skill in CAP_SKILLS)
+_CARVE_DELTA_EXPECTED_C_ARRAY = tuple(CARVE_DELTA_EXPECTED_C[skill]
+                                      for skill in CARVING_SKILLS)
@@ -0,0 +1,60 @@
+"""
+Process wide registry of compiled Mako templates for the HTML generators.
+
+There is one TemplateLookup per template directory, so each template is
+compiled once per process instead of once per page. Compiled modules are
+also saved in a module directory, and reused by other processes and later
+runs until the template file is modified (mako compares the mtimes).
+
+Requires mako.
+"""
+
+import os
+
+
+_project_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+TEMPLATE_PATH = os.path.join(_project_path, "templates")
+
+# override for read only installs, e.g. when running under a web server
+MODULE_PATH = (os.environ.get("MHAPI_TEMPLATE_CACHE")
+               or os.path.join(_project_path, ".cache", "mako"))
+
+
+_lookups = {}
+
+
+def get_lookup(directory):
+    """
+    Get the lookup for a template directory, e.g. "damage" for
+    templates/damage.
+    """
+    lookup = _lookups.get(directory)
+    if lookup is None:
+        from mako.lookup import TemplateLookup
+        lookup = TemplateLookup(
+                    directories=[os.path.join(TEMPLATE_PATH, directory)],
+                    module_directory=os.path.join(MODULE_PATH, directory),
+                    input_encoding="utf-8")
+        _lookups[directory] = lookup
+    return lookup
+
+
+def get_template(directory, name):
+    return get_lookup(directory).get_template(name)
+
+
+def template_path(directory, name):
+    """
+    Path to the template source file, e.g. for build fingerprints.
+    """
+    return os.path.join(TEMPLATE_PATH, directory, name.lstrip("/"))
+
+
+def render(directory, name, **template_args):
+    """
+    Render template @name from @directory and return the output as a
+    string, so callers can write the page in one call, e.g. with
+    atomic_open.
+    """
+    return get_template(directory, name).render_unicode(**template_args)
@@ -0,0 +1,208 @@
+"""
+Simulate damage over a hunt, taking into account sharpness loss as the
+weapon is used. The damage for each sharpness level is calculated once, and
+the hunt is evaluated in closed form per sharpness segment, so it's cheap
+enough to rank all weapons of a type against every monster.
+"""
+
+from mhapi.damage import WeaponMonsterDamage, combine_motions
+from mhapi.model import SharpnessLevel
+
+
+class SharpnessSegment(object):
+    """
+    Part of the hunt spent at a single sharpness level.
+    """
+    def __init__(self, sharpness, points, hits, hit_damage):
+        self.sharpness = sharpness
+        self.points = points
+        self.hits = hits
+        self.hit_damage = hit_damage
+        self.total = hits * hit_damage
+
+    @property
+    def sharpness_name(self):
+        return SharpnessLevel.name(self.sharpness)
+
+
+class SharpnessTimeline(object):
+    """
+    Damage over a hunt for a weapon damage calculation, starting at max
+    sharpness and dropping a level each time the points at the current
+    level are used up. Once in red, the weapon stays in red.
+
+    @param weapon_damage: WeaponMonsterDamage for the motion sequence
+    @param hits_per_point: number of hits before one sharpness point is lost
+    @param part_weights: dict mapping part name to how often it is targeted,
+                         default uniform across all parts
+    @param sharpen_level: if set, assume the weapon is sharpened back to max
+                          when it would drop below this level
+    """
+    def __init__(self, weapon_damage, hits_per_point=1.0, part_weights=None,
+                 sharpen_level=None):
+        self.weapon_damage = weapon_damage
+        self.hits_per_point = hits_per_point
+        self.sharpen_level = sharpen_level
+        self.motion_hits = len(weapon_damage.motion.powers)
+        self.part_weights = self._normalize_weights(part_weights)
+
+        self.segments = []
+        self.dull_hit_damage = 0
+        self._calculate_segments()
+
+        self.cycle_hits = 0
+        self.cycle_damage = 0
+        if sharpen_level is not None:
+            for seg in self.segments:
+                if seg.sharpness >= sharpen_level:
+                    self.cycle_hits += seg.hits
+                    self.cycle_damage += seg.total
+
+    def _normalize_weights(self, part_weights):
+        parts = self.weapon_damage.parts
+        if part_weights is None:
+            part_weights = dict((part, 1.0) for part in parts)
+        total = float(sum(w for part, w in part_weights.items()
+                          if part in parts))
+        if total <= 0:
+            raise ValueError("part weights must include at least one part"
+                             " of the monster")
+        return dict((part, w / total) for part, w in part_weights.items()
+                    if part in parts)
+
+    def _hit_damage(self, sharpness):
+        damage_map = self.weapon_damage.get_sharpness_damage_map(sharpness)
+        total = 0.0
+        for part, weight in self.part_weights.items():
+            total += damage_map[part].average() * weight
+        return total / self.motion_hits
+
+    def _calculate_segments(self):
+        values = self.weapon_damage.weapon_sharpness.value_list
+        for level in range(self.weapon_damage.sharpness,
+                           SharpnessLevel.RED - 1, -1):
+            points = values[level]
+            if not points:
+                continue
+            self.segments.append(SharpnessSegment(level, points,
+                                                  points * self.hits_per_point,
+                                                  self._hit_damage(level)))
+        if self.segments and self.segments[-1].sharpness == SharpnessLevel.RED:
+            self.dull_hit_damage = self.segments[-1].hit_damage
+        else:
+            self.dull_hit_damage = self._hit_damage(SharpnessLevel.RED)
+
+    def _walk(self, hits):
+        """
+        Damage from @hits starting at max sharpness, without sharpening.
+        """
+        damage = 0.0
+        for seg in self.segments:
+            if hits <= seg.hits:
+                return damage + hits * seg.hit_damage
+            damage += seg.total
+            hits -= seg.hits
+        return damage + hits * self.dull_hit_damage
+
+    def damage(self, hits):
+        """
+        Total expected damage after @hits hits.
+        """
+        if self.cycle_hits:
+            cycles, rest = divmod(hits, self.cycle_hits)
+            return cycles * self.cycle_damage + self._walk(rest)
+        return self._walk(hits)
+
+    def average(self, hits):
+        """
+        Average damage per hit over a hunt of @hits hits.
+        """
+        if not hits:
+            return 0
+        return self.damage(hits) / float(hits)
+
+    def hits_to_deal(self, damage):
+        """
+        Number of hits needed to deal @damage, e.g. the monster HP. Raises
+        ValueError if the weapon can't deal it, e.g. no damage once dull or
+        no damage in the sharpening cycle.
+        """
+        hits = 0.0
+        if self.cycle_hits:
+            if self.cycle_damage <= 0:
+                raise ValueError("sharpening cycle does no damage")
+            cycles = int(damage // self.cycle_damage)
+            hits += cycles * self.cycle_hits
+            damage -= cycles * self.cycle_damage
+        for seg in self.segments:
+            if self.cycle_hits and seg.sharpness < self.sharpen_level:
+                break
+            if damage <= 0:
+                return hits
+            if damage <= seg.total:
+                return hits + damage / seg.hit_damage
+            damage -= seg.total
+            hits += seg.hits
+        if self.cycle_hits:
+            # rounding, the cycle covers the rest
+            return hits
+        if damage <= 0:
+            return hits
+        if self.dull_hit_damage <= 0:
+            raise ValueError("weapon does no damage once dull")
+        return hits + damage / self.dull_hit_damage
+
+    def sharpen_count(self, hits):
+        """
+        Number of times the weapon needs sharpening during @hits hits.
+        """
+        if not self.cycle_hits:
+            return 0
+        return int(hits // self.cycle_hits)
+
+
+def get_timeline(weapon_row, monster_row, monster_damage, motions,
+                 hits_per_point=1.0, part_weights=None, sharpen_level=None,
+                 **kwargs):
+    """
+    Create a timeline for the weapon using the sequence of @motions, e.g.
+    a combo from MotionValueDB. Extra @kwargs are passed to
+    WeaponMonsterDamage.
+    """
+    if isinstance(motions, (list, tuple)):
+        motion = combine_motions(motions)
+    else:
+        motion = motions
+    wd = WeaponMonsterDamage(weapon_row, monster_row, monster_damage, motion,
+                             **kwargs)
+    return SharpnessTimeline(wd, hits_per_point=hits_per_point,
+                             part_weights=part_weights,
+                             sharpen_level=sharpen_level)
+
+
+def get_handicraft_timelines(weapon_row, monster_row, monster_damage,
+                             motions, **kwargs):
+    """
+    List of timelines for each MHR Handicraft level from 0 to 5.
+    """
+    kwargs["game"] = "mhr"
+    return [get_timeline(weapon_row, monster_row, monster_damage, motions,
+                         sharp_plus=level, **kwargs)
+            for level in range(0, 6)]
+
+
+def rank_weapons(weapons, monster_row, monster_damage, motions, hits,
+                 **kwargs):
+    """
+    Rank weapons by total damage over a hunt of @hits hits. Returns a list
+    of (damage, timeline) tuples sorted from most to least damage.
+    """
+    if isinstance(motions, (list, tuple)):
+        motions = combine_motions(motions)
+    results = []
+    for w in weapons:
+        timeline = get_timeline(w, monster_row, monster_damage, motions,
+                                **kwargs)
+        results.append((timeline.damage(hits), timeline))
+    results.sort(key=lambda r: r[0], reverse=True)
+    return results
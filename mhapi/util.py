@@ -3,6 +3,10 @@ Shared utility classes and functions.
 """
 
 import codecs
+import contextlib
+import os
+import pickle
+import tempfile
 
 
 ELEMENTS = """
@@ -75,3 +79,63 @@ class EnumBase(object):
 
 def get_utf8_writer(writer):
     return codecs.getwriter("utf8")(writer)
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode="w", encoding=None):
+    """
+    Open a temporary file in the same directory as @path for writing, and
+    rename it to @path when the block completes without error. Readers
+    never see a partially written file, and concurrent writers of the
+    same path don't interleave.
+    """
+    dir_path, fname = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix="." + fname + ".",
+                                    suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            yield f
+        # mkstemp creates files readable only by the owner
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_pickle_cache(cache_path, cache_key):
+    """
+    Load data saved with save_pickle_cache, returns None if the file
+    doesn't exist, can't be loaded, or was saved with a different
+    @cache_key (e.g. the source file mtime and a format version).
+    """
+    try:
+        with open(cache_path, "rb") as f:
+            key, data = pickle.load(f)
+    except (OSError, EOFError, pickle.PickleError, AttributeError,
+            ImportError, ValueError, TypeError):
+        return None
+    if key != cache_key:
+        return None
+    return data
+
+
+def save_pickle_cache(cache_path, cache_key, data):
+    """
+    Write the cache atomically, so concurrent processes never see a
+    partial file. Failure to write (e.g. read only db dir) is not an
+    error, the cache is just not used.
+    """
+    tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump((cache_key, data), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
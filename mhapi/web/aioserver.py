@@ -0,0 +1,432 @@
+"""
+HTTP/1.1 server for WSGI applications using asyncio, for many mostly idle
+keep-alive connections, e.g. from the mobile site.
+
+Requests the application says are cached (see App.is_cached) run directly
+on the event loop. Everything else runs in a bounded thread pool, and when
+all workers are busy and the queue is full new requests get a 503 right
+away instead of piling up. Worker threads rather than processes are used
+so the application caches are shared.
+
+Only what the mhapi app needs is supported: request bodies must have a
+Content-Length, and response bodies are collected before sending.
+"""
+
+import io
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import urllib.parse
+from email.utils import formatdate
+from concurrent.futures import ThreadPoolExecutor
+
+
+log = logging.getLogger("mhapi.aioserver")
+
+# hop by hop headers set by the server, not the application
+HOP_HEADERS = frozenset(["connection", "keep-alive", "transfer-encoding"])
+
+
+class HTTPError(Exception):
+    """
+    Error in the request, answered with @status and the connection closed.
+    """
+    def __init__(self, status, message=""):
+        super(HTTPError, self).__init__(message or status)
+        self.status = status
+
+
+class _Connection(object):
+    def __init__(self, task):
+        self.task = task
+        # waiting for the next request, safe to close on shutdown
+        self.idle = True
+
+
+class AsyncWSGIServer(object):
+    """
+    @param app: WSGI application, if it has an is_cached(environ) method
+                requests it returns True for are run on the event loop
+    @param workers: threads for requests that aren't cached, default is
+                    the number of CPUs
+    @param queue_size: uncached requests that can wait for a worker before
+                       new ones get 503
+    @param max_connections: connections over this get 503 and are closed
+    @param keepalive_timeout: seconds an idle connection is kept open
+    @param request_timeout: seconds to receive the rest of a request after
+                            the first line
+    @param shutdown_timeout: seconds to wait for requests in progress on
+                             shutdown before cancelling them
+    @param max_requests: shut down gracefully after this many requests,
+                         e.g. so a prefork master can replace the process
+    """
+    def __init__(self, app, host="", port=8080, sock=None, workers=None,
+                 queue_size=64, max_connections=10000, keepalive_timeout=75,
+                 request_timeout=10, shutdown_timeout=30,
+                 max_header_size=16384, max_body_size=1 << 20,
+                 max_requests=None):
+        self.app = app
+        self.is_cached = getattr(app, "is_cached", None)
+        self.host = host
+        self.port = port
+        self.sock = sock
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self.max_requests = max_requests
+
+        self.executor = None
+        self.server = None
+        self.stopping = False
+        self._stop_event = None
+        self._connections = set()
+        # uncached requests running or waiting for a worker
+        self._pending = 0
+        self._date = (0, "")
+
+        self.requests = 0
+        self.rejected = 0
+
+    async def start(self):
+        self.executor = ThreadPoolExecutor(self.workers,
+                                           thread_name_prefix="mhapi-worker")
+        self._stop_event = asyncio.Event()
+        # the stream limit bounds the buffer for the request line and
+        # headers, so idle connections stay small
+        if self.sock is not None:
+            self.server = await asyncio.start_server(
+                self._handle_connection, sock=self.sock,
+                limit=self.max_header_size)
+        else:
+            self.server = await asyncio.start_server(
+                self._handle_connection, self.host or None, self.port,
+                limit=self.max_header_size, reuse_address=True,
+                backlog=1024)
+        log.info("listening on %s", ", ".join(
+            str(s.getsockname()) for s in self.server.sockets))
+
+    def stop(self):
+        """
+        Start a graceful shutdown, safe to call from a signal handler.
+        """
+        self.stopping = True
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+    async def serve_forever(self):
+        """
+        Serve until SIGTERM or SIGINT, then shut down gracefully.
+        """
+        await self.start()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.stop)
+        try:
+            await self._stop_event.wait()
+        finally:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(signum)
+            await self.shutdown()
+
+    async def shutdown(self):
+        """
+        Stop accepting connections, close idle ones and give requests in
+        progress shutdown_timeout seconds to finish.
+        """
+        self.stopping = True
+        log.info("shutting down, %d connections", len(self._connections))
+        self.server.close()
+        for conn in list(self._connections):
+            if conn.idle:
+                conn.task.cancel()
+        tasks = [conn.task for conn in self._connections]
+        if tasks:
+            done, pending = await asyncio.wait(tasks,
+                                               timeout=self.shutdown_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                log.warning("cancelled %d requests", len(pending))
+                await asyncio.wait(pending)
+        await self.server.wait_closed()
+        # requests that timed out may still be running in workers, they
+        # can't be interrupted and their results are dropped
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        log.info("shut down after %d requests, %d rejected",
+                 self.requests, self.rejected)
+
+    async def _handle_connection(self, reader, writer):
+        conn = _Connection(asyncio.current_task())
+        self._connections.add(conn)
+        try:
+            if len(self._connections) > self.max_connections:
+                self.rejected += 1
+                await self._write_error(writer, "503 Service Unavailable",
+                                        keep_alive=False,
+                                        headers=[("Retry-After", "1")])
+                return
+            keep_alive = True
+            while keep_alive and not self.stopping:
+                conn.idle = True
+                try:
+                    environ = await self._read_request(reader, writer)
+                except HTTPError as e:
+                    await self._write_error(writer, e.status,
+                                            keep_alive=False)
+                    return
+                if environ is None:
+                    return
+                conn.idle = False
+                keep_alive = (_wants_keep_alive(environ)
+                              and not self.stopping)
+                keep_alive = await self._respond(environ, writer,
+                                                 keep_alive)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # shutdown, nothing more to send
+            pass
+        finally:
+            self._connections.discard(conn)
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        """
+        Read a request and return the WSGI environ, or None if the client
+        closed the connection or was idle too long.
+        """
+        line = b"\r\n"
+        # skip stray blank lines between requests, allowed by RFC 7230
+        while line in (b"\r\n", b"\n"):
+            try:
+                line = await asyncio.wait_for(reader.readline(),
+                                              self.keepalive_timeout)
+            except asyncio.TimeoutError:
+                return None
+            except (asyncio.LimitOverrunError, ValueError):
+                raise HTTPError("414 URI Too Long")
+            if not line:
+                return None
+
+        try:
+            head = await asyncio.wait_for(self._read_headers(reader),
+                                          self.request_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError("408 Request Timeout")
+        except (asyncio.LimitOverrunError, ValueError):
+            raise HTTPError("431 Request Header Fields Too Large")
+        if head is None:
+            return None
+
+        environ = self._make_environ(line, head, writer)
+
+        length = environ.get("CONTENT_LENGTH")
+        if "HTTP_TRANSFER_ENCODING" in environ:
+            raise HTTPError("411 Length Required")
+        body = b""
+        if length:
+            try:
+                length = int(length)
+            except ValueError:
+                raise HTTPError("400 Bad Request")
+            if length < 0:
+                raise HTTPError("400 Bad Request")
+            if length > self.max_body_size:
+                raise HTTPError("413 Payload Too Large")
+            if environ.get("HTTP_EXPECT", "").lower() == "100-continue":
+                writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            try:
+                body = await asyncio.wait_for(reader.readexactly(length),
+                                              self.request_timeout)
+            except asyncio.TimeoutError:
+                raise HTTPError("408 Request Timeout")
+        environ["wsgi.input"] = io.BytesIO(body)
+        return environ
+
+    async def _read_headers(self, reader):
+        """
+        Read header lines up to the blank line, returns list of lines or
+        None if the connection was closed.
+        """
+        lines = []
+        size = 0
+        while True:
+            line = await reader.readline()
+            if not line.endswith(b"\n"):
+                return None
+            if line in (b"\r\n", b"\n"):
+                return lines
+            size += len(line)
+            if size > self.max_header_size:
+                raise ValueError("headers too large")
+            lines.append(line)
+
+    def _make_environ(self, line, head, writer):
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError("400 Bad Request")
+        if not version.startswith("HTTP/1."):
+            raise HTTPError("505 HTTP Version Not Supported")
+        path, _, query = target.partition("?")
+        if "://" in path:
+            # absolute form, only sent to proxies
+            path = "/" + path.split("://", 1)[1].partition("/")[2]
+
+        sockname = writer.get_extra_info("sockname") or ("", self.port)
+        peername = writer.get_extra_info("peername") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": urllib.parse.unquote(path, "latin-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": str(sockname[0]),
+            "SERVER_PORT": str(sockname[1]),
+            "SERVER_PROTOCOL": version,
+            "REMOTE_ADDR": str(peername[0]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for header in head:
+            name, sep, value = header.decode("latin-1").partition(":")
+            if not sep or not name or name != name.strip():
+                raise HTTPError("400 Bad Request")
+            name = name.upper().replace("-", "_")
+            value = value.strip()
+            if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                key = name
+            else:
+                key = "HTTP_" + name
+            if key in environ:
+                environ[key] += "," + value
+            else:
+                environ[key] = value
+        return environ
+
+    async def _respond(self, environ, writer, keep_alive):
+        """
+        Run the app for @environ and write the response. Returns False if
+        the connection must be closed.
+        """
+        self.requests += 1
+        if self.max_requests and self.requests >= self.max_requests:
+            # finish this response, then close everything
+            keep_alive = False
+            self.stop()
+        if self.is_cached is not None and self.is_cached(environ):
+            status, headers, body = self._run_app(environ)
+        elif self._pending >= self.workers + self.queue_size:
+            self.rejected += 1
+            await self._write_error(writer, "503 Service Unavailable",
+                                    keep_alive,
+                                    headers=[("Retry-After", "1")])
+            return keep_alive
+        else:
+            self._pending += 1
+            try:
+                loop = asyncio.get_running_loop()
+                status, headers, body = await loop.run_in_executor(
+                    self.executor, self._run_app, environ)
+            finally:
+                self._pending -= 1
+        if environ["REQUEST_METHOD"] == "HEAD":
+            body = b""
+        await self._write_response(writer, environ["SERVER_PROTOCOL"],
+                                   status, headers, body, keep_alive)
+        return keep_alive
+
+    def _run_app(self, environ):
+        """
+        Call the app and collect the response, returns (status, headers,
+        body). Errors in the app become a 500.
+        """
+        response = []
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and chunks:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response[:] = [status, headers]
+            return chunks.append
+
+        try:
+            result = self.app(environ, start_response)
+            try:
+                for data in result:
+                    if data:
+                        chunks.append(data)
+            finally:
+                close = getattr(result, "close", None)
+                if close is not None:
+                    close()
+        except Exception:
+            log.exception("error handling %s %s", environ["REQUEST_METHOD"],
+                          environ["PATH_INFO"])
+            body = b"Internal Server Error"
+            return ("500 Internal Server Error",
+                    [("Content-Type", "text/plain")], body)
+        status, headers = response
+        return status, headers, b"".join(chunks)
+
+    def _http_date(self):
+        now = int(time.time())
+        if self._date[0] != now:
+            self._date = (now, formatdate(now, usegmt=True))
+        return self._date[1]
+
+    async def _write_response(self, writer, protocol, status, headers, body,
+                              keep_alive):
+        lines = ["HTTP/1.1 " + status, "Date: " + self._http_date()]
+        has_length = False
+        for name, value in headers:
+            lname = name.lower()
+            if lname in HOP_HEADERS:
+                continue
+            if lname == "content-length":
+                has_length = True
+            lines.append("%s: %s" % (name, value))
+        if not has_length:
+            lines.append("Content-Length: %d" % len(body))
+        if not keep_alive:
+            lines.append("Connection: close")
+        elif protocol == "HTTP/1.0":
+            lines.append("Connection: keep-alive")
+        lines.append("\r\n")
+        writer.write("\r\n".join(lines).encode("latin-1") + body)
+        # waits only if the client isn't reading, so slow clients don't
+        # make the server buffer unbounded output
+        await writer.drain()
+
+    async def _write_error(self, writer, status, keep_alive, headers=()):
+        body = status.encode("latin-1")
+        headers = [("Content-Type", "text/plain")] + list(headers)
+        await self._write_response(writer, "HTTP/1.1", status, headers, body,
+                                   keep_alive)
+
+
+def _wants_keep_alive(environ):
+    connection = environ.get("HTTP_CONNECTION", "").lower()
+    if environ["SERVER_PROTOCOL"] == "HTTP/1.0":
+        return "keep-alive" in connection
+    return "close" not in connection
+
+
+def serve(app, **kwargs):
+    """
+    Run AsyncWSGIServer(app, **kwargs) until SIGTERM or SIGINT.
+    """
+    server = AsyncWSGIServer(app, **kwargs)
+    asyncio.run(server.serve_forever())
+    return server
@@ -0,0 +1,301 @@
+"""
+Prefork launcher for the asyncio server. The master process loads the app
+and everything it can preload (name indexes, warm response caches, motion
+values, JSON API files), then forks workers that share the loaded data
+copy on write, so adding workers adds little memory.
+
+The master doesn't serve requests. It restarts workers that exit, replaces
+workers after a number of requests or when their private memory grows
+too large, and kills workers whose event loop stops sending heartbeats.
+
+Signals to the master: SIGTERM or SIGINT to shut down gracefully, SIGHUP
+to replace all workers gracefully.
+
+Unix only, uses os.fork.
+"""
+
+import gc
+import os
+import time
+import random
+import select
+import signal
+import socket
+import asyncio
+import logging
+
+from mhapi.web.aioserver import AsyncWSGIServer
+
+
+log = logging.getLogger("mhapi.prefork")
+
+
+def private_memory(pid):
+    """
+    Bytes of memory used only by process @pid, not shared with the master
+    or other workers, or None if not available (Linux only).
+    """
+    try:
+        with open("/proc/%d/smaps_rollup" % pid) as f:
+            total = 0
+            for line in f:
+                if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                    total += int(line.split()[1]) * 1024
+            return total
+    except (OSError, ValueError):
+        return None
+
+
+class _Worker(object):
+    def __init__(self, pid, heartbeat_fd):
+        self.pid = pid
+        self.heartbeat_fd = heartbeat_fd
+        self.started = time.monotonic()
+        self.last_heartbeat = self.started
+        # pipe closed, the worker is exiting
+        self.closed = False
+        # monotonic time SIGTERM was sent, None if still serving
+        self.stopping = None
+
+
+class PreforkServer(object):
+    """
+    @param app: WSGI app, should have after_fork() to reset per process
+                state like DB connections in the workers
+    @param workers: number of worker processes, default number of CPUs
+    @param max_requests: replace a worker after about this many requests,
+                         None for no limit
+    @param max_requests_jitter: up to this many are added to max_requests
+                                for each worker, so they don't all restart
+                                at the same time
+    @param max_worker_memory: replace a worker when its private memory is
+                              over this many bytes, None for no limit
+    @param heartbeat_interval: seconds between worker heartbeats
+    @param heartbeat_timeout: kill a worker with no heartbeat for this long
+    @param server_args: keyword args for AsyncWSGIServer, e.g. workers for
+                        the threads in each process
+    """
+    SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+
+    def __init__(self, app, host="", port=8080, workers=None,
+                 max_requests=None, max_requests_jitter=0,
+                 max_worker_memory=None, heartbeat_interval=1,
+                 heartbeat_timeout=30, shutdown_timeout=30,
+                 server_args=None):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.num_workers = workers or os.cpu_count() or 1
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.max_worker_memory = max_worker_memory
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.server_args = dict(server_args or {})
+        self.server_args["shutdown_timeout"] = shutdown_timeout
+
+        self.sock = None
+        self.workers = dict()
+        self.stopping = False
+        self._reload = False
+        self._last_spawn = 0
+
+    def run(self):
+        """
+        Bind, fork the workers and supervise them until SIGTERM or SIGINT.
+        The app must be fully loaded and no other threads running.
+        """
+        self.sock = socket.create_server((self.host, self.port),
+                                         backlog=1024)
+        self.sock.setblocking(False)
+        # objects loaded so far are never freed, keep the garbage collector
+        # from writing to them, which would copy their pages in every worker
+        gc.collect()
+        gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        log.info("master %d listening on %s, %d workers", os.getpid(),
+                 self.sock.getsockname(), self.num_workers)
+        try:
+            while not self.stopping:
+                self._reap()
+                if self._reload:
+                    self._reload = False
+                    log.info("replacing all workers")
+                    for worker in self.workers.values():
+                        self._stop_worker(worker)
+                self._spawn_missing()
+                self._wait_heartbeats()
+                self._check_workers()
+        finally:
+            self._shutdown()
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+    def _on_reload(self, signum, frame):
+        self._reload = True
+
+    def _serving(self):
+        return [w for w in self.workers.values() if w.stopping is None]
+
+    def _spawn_missing(self):
+        while len(self._serving()) < self.num_workers and not self.stopping:
+            # don't spin if workers die right away, e.g. a broken deploy
+            wait = self._last_spawn + 0.1 - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_spawn = time.monotonic()
+            self._spawn()
+
+    def _spawn(self):
+        read_fd, write_fd = os.pipe()
+        # a signal between the fork and the worker setting its own handlers
+        # would run the master's handler in the worker, block them until
+        # then
+        signal.pthread_sigmask(signal.SIG_BLOCK, self.SIGNALS)
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            status = 1
+            try:
+                for signum in self.SIGNALS:
+                    signal.signal(signum, signal.SIG_DFL)
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, self.SIGNALS)
+                self._worker_main(write_fd)
+                status = 0
+            except BaseException:
+                log.exception("worker %d failed", os.getpid())
+            finally:
+                # don't run the master's cleanup in the worker
+                os._exit(status)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, self.SIGNALS)
+        os.close(write_fd)
+        os.set_blocking(read_fd, False)
+        self.workers[pid] = _Worker(pid, read_fd)
+        log.info("started worker %d", pid)
+
+    def _worker_main(self, heartbeat_fd):
+        for worker in self.workers.values():
+            os.close(worker.heartbeat_fd)
+        self.workers = dict()
+        os.set_blocking(heartbeat_fd, False)
+        random.seed()
+        after_fork = getattr(self.app, "after_fork", None)
+        if after_fork is not None:
+            after_fork()
+
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        server = AsyncWSGIServer(self.app, sock=self.sock,
+                                 max_requests=max_requests,
+                                 **self.server_args)
+        asyncio.run(self._worker_serve(server, heartbeat_fd))
+
+    async def _worker_serve(self, server, heartbeat_fd):
+        async def heartbeat():
+            # sent from the event loop, so a blocked loop stops them
+            while True:
+                try:
+                    os.write(heartbeat_fd, b".")
+                except BlockingIOError:
+                    pass
+                await asyncio.sleep(self.heartbeat_interval)
+        task = asyncio.ensure_future(heartbeat())
+        try:
+            await server.serve_forever()
+        finally:
+            task.cancel()
+
+    def _wait_heartbeats(self):
+        fds = dict((w.heartbeat_fd, w) for w in self.workers.values()
+                   if not w.closed)
+        try:
+            ready, _, _ = select.select(list(fds), [], [],
+                                        self.heartbeat_interval)
+        except InterruptedError:
+            return
+        now = time.monotonic()
+        for fd in ready:
+            try:
+                data = os.read(fd, 4096)
+            except BlockingIOError:
+                continue
+            if data:
+                fds[fd].last_heartbeat = now
+            else:
+                fds[fd].closed = True
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for worker in list(self.workers.values()):
+            if worker.stopping is not None:
+                if now - worker.stopping > self.shutdown_timeout + 5:
+                    log.warning("worker %d didn't stop, killing",
+                                worker.pid)
+                    self._kill(worker.pid, signal.SIGKILL)
+            elif now - worker.last_heartbeat > self.heartbeat_timeout:
+                log.warning("worker %d missed heartbeats, killing",
+                            worker.pid)
+                worker.stopping = now
+                self._kill(worker.pid, signal.SIGKILL)
+            elif self.max_worker_memory:
+                used = private_memory(worker.pid)
+                if used is not None and used > self.max_worker_memory:
+                    log.info("worker %d using %d MB, replacing", worker.pid,
+                             used >> 20)
+                    self._stop_worker(worker)
+
+    def _stop_worker(self, worker):
+        if worker.stopping is None:
+            worker.stopping = time.monotonic()
+            self._kill(worker.pid, signal.SIGTERM)
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            os.close(worker.heartbeat_fd)
+            code = os.waitstatus_to_exitcode(status)
+            if worker.stopping is None and code != 0:
+                log.warning("worker %d exited with %d", pid, code)
+            else:
+                log.info("worker %d exited", pid)
+
+    def _shutdown(self):
+        log.info("master shutting down")
+        for worker in self.workers.values():
+            self._stop_worker(worker)
+        self.sock.close()
+        deadline = time.monotonic() + self.shutdown_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for worker in list(self.workers.values()):
+            self._kill(worker.pid, signal.SIGKILL)
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            worker = self.workers.pop(pid, None)
+            if worker is not None:
+                os.close(worker.heartbeat_fd)
+        log.info("master stopped")
@@ -1,32 +1,408 @@
 #!/usr/bin/env python
 
+import io
 import os
+import gzip
+import json
 import logging
+import hashlib
 import threading
+from collections import OrderedDict
 
 from webob import Request, Response, exc
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 from mhapi.db import MHDB
+from mhapi import db as mhdb
+from mhapi import model
 from mhapi import rewards
+from mhapi import jsonapi
+from mhapi import damagerank
+from mhapi.damage import MotionValueDB
+from mhapi.build import file_fingerprint
+from mhapi.complete import NameIndex, db_name_entries
+from mhapi.util import load_pickle_cache, save_pickle_cache
 
 DB_VERSION = "20150313"
 PREFIX = "/mhapi/"
+JSONAPI_PREFIX = "/jsonapi/"
+
+# directory names used by the web pages, same as web/jsonapi/
+JSONAPI_GAMES = dict(mh3u="3u", mh4u="4u", mhgen="gen", mhgu="gu")
 
 # good for testing, use 1 hour = 3600 for deployment
 MAX_AGE = "60"
 
+# number of rendered reward pages to keep in memory
+REWARDS_CACHE_SIZE = int(os.environ.get("MHAPI_REWARDS_CACHE_SIZE", "512"))
+
+# optional file with item names to render at startup, one per line, most
+# requested first
+REWARDS_WARM_PATH = os.environ.get("MHAPI_REWARDS_WARM")
+
+# seconds to wait for another thread rendering the same response
+FLIGHT_TIMEOUT = float(os.environ.get("MHAPI_FLIGHT_TIMEOUT", "30"))
+
+# optional JSON file mapping names to popularity weights for completion
+COMPLETE_WEIGHTS_PATH = os.environ.get("MHAPI_COMPLETE_WEIGHTS")
+COMPLETE_DEFAULT_N = 10
+
+# number of damage rankings to keep in memory, and seconds of CPU time a
+# ranking can use before it is rejected
+DAMAGE_CACHE_SIZE = int(os.environ.get("MHAPI_DAMAGE_CACHE_SIZE", "256"))
+DAMAGE_CPU_BUDGET = float(os.environ.get("MHAPI_DAMAGE_CPU_BUDGET", "2"))
+
+# bytes of the DB file SQLite maps into memory instead of copying pages
+# into each connection's cache, so the pages are shared between all
+# threads and processes through the OS page cache
+DB_MMAP_SIZE = int(os.environ.get("MHAPI_DB_MMAP_SIZE", str(64 << 20)))
+
+# built JSON API files are cached here, keyed by the DB and code versions
+JSONAPI_CACHE_PATH = (os.environ.get("MHAPI_JSONAPI_CACHE")
+                      or os.path.join(os.path.dirname(__file__), "..", "..",
+                                      ".cache", "jsonapi"))
+
+# comma separated games to load in the background at startup, e.g. "mh4u",
+# or "all" for every game with a DB installed. Default none, games are
+# then loaded in the background on the first request for them
+JSONAPI_PRELOAD = os.environ.get("MHAPI_JSONAPI_PRELOAD", "")
+
 logging.basicConfig(filename="/tmp/reward_webapp.log", level=logging.INFO)
 
 
+class PrecompressedBody(object):
+    """
+    Response body that is compressed once with every supported encoding,
+    for static payloads that only change with the DB. Each encoding has its
+    own strong ETag, derived from the content.
+
+    Brotli is only offered if the brotli module is installed.
+
+    @param eager: compress with all encodings up front, otherwise each
+                  encoding is compressed the first time it's requested,
+                  e.g. for large sets of files where most are rarely
+                  requested
+    """
+    # encoding -> ETag suffix, in order of preference
+    ENCODINGS = ([("br", "-br")] if brotli is not None else []) + [
+        ("gzip", "-gz"),
+        ("identity", ""),
+    ]
+
+    def __init__(self, body, content_type, charset=None, eager=True):
+        self.content_type = content_type
+        self.charset = charset
+        self.body = body
+        self.digest = content_etag(body)
+        # encoding -> (body, etag)
+        self._encoded = dict(identity=(body, self.digest))
+        self._offers = [name for name, suffix in self.ENCODINGS]
+        if eager:
+            for name in self._offers:
+                self.encode(name)
+
+    def encode(self, encoding):
+        """
+        Get (body, etag) for @encoding.
+        """
+        encoded = self._encoded.get(encoding)
+        if encoded is None:
+            if encoding == "br":
+                data = brotli.compress(self.body)
+            elif encoding == "gzip":
+                # mtime=0 so the output only depends on the content
+                data = gzip.compress(self.body, 9, mtime=0)
+            else:
+                raise ValueError("Unknown encoding: %s" % encoding)
+            suffix = dict(self.ENCODINGS)[encoding]
+            # threads may compress the same body at the same time, the
+            # results are the same so it doesn't matter which is kept
+            encoded = (data, self.digest + suffix)
+            self._encoded[encoding] = encoded
+        return encoded
+
+    def choose_encoding(self, req):
+        """
+        Best encoding for the request Accept-Encoding.
+        """
+        if "Accept-Encoding" in req.headers:
+            offers = req.accept_encoding.acceptable_offers(self._offers)
+            # identity is always acceptable in practice
+            if offers:
+                return offers[0][0]
+        return "identity"
+
+    def is_encoded(self, req):
+        """
+        True if the body for the request is already compressed, so
+        response won't do any CPU heavy work.
+        """
+        return self.choose_encoding(req) in self._encoded
+
+    def choose(self, req):
+        """
+        Get (encoding, body, etag) for the request Accept-Encoding.
+        """
+        encoding = self.choose_encoding(req)
+        body, etag = self.encode(encoding)
+        return encoding, body, etag
+
+    def response(self, req, cache_control):
+        encoding, body, etag = self.choose(req)
+        if etag in req.if_none_match:
+            resp = exc.HTTPNotModified(etag=etag, cache_control=cache_control)
+            resp.vary = ("Accept-Encoding",)
+            return resp
+        resp = Response(body=body, content_type=self.content_type,
+                        charset=self.charset, cache_control=cache_control)
+        resp.etag = etag
+        resp.vary = ("Accept-Encoding",)
+        if encoding != "identity":
+            resp.content_encoding = encoding
+        return resp
+
+
+class JsonApiLoading(Exception):
+    """
+    Raised by JsonApiStore.get when the entity is not loaded yet.
+    """
+    pass
+
+
+class JsonApiStore(object):
+    """
+    Serve the files created by bin/mkjsonapi.py from memory. The files are
+    created with the same code as mkjsonapi so the bytes are the same, and
+    saved in a pickle cache so later processes can load them instead.
+
+    Games are loaded in a background thread, never in the request thread,
+    building the weapon files takes minutes without the cache. Use preload
+    at startup, requests for entities that are not loaded yet start loading
+    the game and raise JsonApiLoading.
+    """
+    CACHE_VERSION = 1
+
+    def __init__(self, cache_path=JSONAPI_CACHE_PATH):
+        self.cache_path = cache_path
+        self.log = logging.getLogger("reward_webapp")
+        # (game, entity) -> relative path -> PrecompressedBody
+        self._entities = dict()
+        # (game, entity) that failed to load, served as missing
+        self._failed = set()
+        # game -> loading thread
+        self._threads = dict()
+        self._lock = threading.Lock()
+        # the background thread and App.preload can load the same entity
+        self._flight = SingleFlight()
+
+    def get(self, game, path, load=True):
+        """
+        PrecompressedBody for @path relative to the game directory, e.g.
+        "weapon/_all.json", or None if it doesn't exist. If the entity isn't
+        loaded yet, start loading the game in the background and raise
+        JsonApiLoading, or with @load False return None.
+        """
+        path = os.path.normpath(path)
+        entity = path.split(os.sep, 1)[0]
+        if entity not in jsonapi.get_entities(game):
+            return None
+        files = self._entities.get((game, entity))
+        if files is None:
+            if not load or (game, entity) in self._failed:
+                return None
+            self.preload(game)
+            raise JsonApiLoading("%s/%s is loading" % (game, entity))
+        return files.get(path)
+
+    def load_game(self, game):
+        """
+        Load all entities for @game. Entities that fail are logged and
+        served as missing.
+        """
+        if not mhdb.db_exists(game):
+            self.log.warning("no DB for jsonapi game %s", game)
+            self._failed.update((game, entity)
+                                for entity in jsonapi.get_entities(game))
+            return
+        for entity in jsonapi.get_entities(game):
+            if (game, entity) in self._failed:
+                continue
+            try:
+                self._flight.do((game, entity), self._load, game, entity)
+            except Exception:
+                self.log.exception("loading jsonapi %s/%s failed",
+                                   game, entity)
+                self._failed.add((game, entity))
+
+    def preload(self, game):
+        """
+        Load all entities for @game in a background thread, unless one is
+        already running. Returns the thread.
+        """
+        with self._lock:
+            t = self._threads.get(game)
+            if t is None or not t.is_alive():
+                t = threading.Thread(target=self.load_game, args=(game,),
+                                     name="jsonapi-" + game)
+                t.daemon = True
+                t.start()
+                self._threads[game] = t
+        return t
+
+    def _load(self, game, entity):
+        files = self._entities.get((game, entity))
+        if files is not None:
+            return files
+        db = jsonapi.open_db(game)
+        cache_file = os.path.join(self.cache_path, game, entity + ".pickle")
+        cache_key = self._cache_key(db)
+        data = load_pickle_cache(cache_file, cache_key)
+        if data is None:
+            writer = jsonapi.MemoryWriter()
+            jsonapi.entity_json(db, entity, "", writer)
+            data = writer.files
+            try:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            except OSError:
+                # not writable, save_pickle_cache will skip it
+                pass
+            save_pickle_cache(cache_file, cache_key, data)
+        files = dict((path, PrecompressedBody(body, "application/json",
+                                              eager=False))
+                     for path, body in data.items())
+        self._entities[(game, entity)] = files
+        return files
+
+    def _cache_key(self, db):
+        st = os.stat(db.path)
+        return (self.CACHE_VERSION, db.game, st.st_mtime_ns, st.st_size,
+                file_fingerprint(jsonapi.__file__, model.__file__,
+                                 mhdb.__file__))
+
+
 class ThreadLocalDB(threading.local):
-    def __init__(self, path):
+    def __init__(self, game, path):
         threading.local.__init__(self)
-        self._db = MHDB(path)
+        self._db = MHDB(game=game, path=path)
+        if DB_MMAP_SIZE:
+            self._db.conn.execute("PRAGMA mmap_size=%d" % DB_MMAP_SIZE)
 
     def __getattr__(self, name):
         return getattr(self._db, name)
 
 
+class LRUCache(object):
+    """
+    Thread safe dict with at most @size entries, the least recently used
+    entry is removed when it's full.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Run at most one call per key at a time. Threads that ask for a key
+    that is already being computed wait for that call and share its result,
+    or get the same exception if it fails.
+
+    @param timeout: seconds a waiting thread waits before raising
+                    TimeoutError, None to wait forever. The call itself is
+                    not interrupted.
+    """
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self._flights = dict()
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                self.shared += 1
+
+        if not leader:
+            if not flight.done.wait(self.timeout):
+                raise TimeoutError("timed out waiting for %r" % (key,))
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn(*args)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+
+def normalize_item_name(item_name):
+    """
+    Key for the rewards cache, names that differ only in whitespace get
+    the same response.
+    """
+    return " ".join(item_name.split())
+
+
+def content_etag(body):
+    """
+    Strong ETag from the response content, so clients revalidate each
+    resource independently.
+    """
+    return hashlib.sha1(body).hexdigest()
+
+
 class App(object):
     def __init__(self):
         self.web_path = os.path.dirname(__file__)
@@ -34,13 +410,92 @@ class App(object):
                                                          "..", ".."))
 
         db_path = os.path.join(self.project_path, "db", "mh4u.db")
-        self.db = ThreadLocalDB(db_path)
+        self.db = ThreadLocalDB("4u", db_path)
 
         log_path = os.path.join(self.project_path, "web.log")
 
         self.log = logging.getLogger("reward_webapp")
+
+        # normalized item name -> (body, etag)
+        self.rewards_cache = LRUCache(REWARDS_CACHE_SIZE)
+        # concurrent requests for the same item share one render
+        self.rewards_flight = SingleFlight(FLIGHT_TIMEOUT)
+
+        # DamageQuery key -> PrecompressedBody, or DamageBudgetExceeded so
+        # rejected queries are not computed again
+        self.damage_cache = LRUCache(DAMAGE_CACHE_SIZE)
+        self.damage_flight = SingleFlight(FLIGHT_TIMEOUT)
+        # game -> (ThreadLocalDB, MotionValueDB)
+        self._damage_games = dict()
+        self._damage_games_lock = threading.Lock()
+
+        self.item_names_body = self._build_item_names()
+        self.name_index = self._build_name_index()
+
+        self.jsonapi = JsonApiStore()
+        self._preload_threads = []
+        preload_games = [g.strip() for g in JSONAPI_PRELOAD.split(",")
+                         if g.strip()]
+        if preload_games == ["all"]:
+            preload_games = sorted(g for g in JSONAPI_GAMES.values()
+                                   if mhdb.db_exists(g))
+        for url_game in preload_games:
+            self._preload_threads.append(self.jsonapi.preload(
+                JSONAPI_GAMES.get(url_game, url_game)))
+        if REWARDS_WARM_PATH:
+            self.warm_rewards_cache(REWARDS_WARM_PATH)
+
         self.log.info("app started")
 
+    def preload(self, jsonapi_games=(), damage_games=()):
+        """
+        Load JSON API files and damage calculation data for the games now,
+        e.g. before forking workers so they share the data, and wait for
+        any background preload to finish.
+        """
+        for url_game in jsonapi_games:
+            self.jsonapi.load_game(JSONAPI_GAMES.get(url_game, url_game))
+        for game in damage_games:
+            self._get_damage_game(game)
+        for t in self._preload_threads:
+            t.join()
+        self._preload_threads = []
+
+    def after_fork(self):
+        """
+        Call in a forked worker process, sqlite connections can't be used
+        in both processes. Everything else loaded in the parent is shared
+        copy on write.
+        """
+        self.db = ThreadLocalDB(self.db.game, self.db.path)
+        with self._damage_games_lock:
+            for game, (db, motiondb) in list(self._damage_games.items()):
+                if game == "4u":
+                    db = self.db
+                else:
+                    db = ThreadLocalDB(game, db.path)
+                self._damage_games[game] = (db, motiondb)
+
+    def warm_rewards_cache(self, path, limit=None):
+        """
+        Render rewards for the item names in @path, one per line, most
+        requested first. At most @limit items, default is the cache size.
+        """
+        if limit is None:
+            limit = self.rewards_cache.size
+        count = 0
+        with open(path, encoding="utf8") as f:
+            for line in f:
+                if count >= limit:
+                    break
+                item_name = normalize_item_name(line)
+                if not item_name or item_name in self.rewards_cache:
+                    continue
+                self.rewards_cache.put(item_name,
+                                       self._render_item_rewards(item_name))
+                count += 1
+        self.log.info("rewards cache warmed with %d items", count)
+
     def __call__(self, environ, start_response):
         req = Request(environ)
         resp = Response()
@@ -52,11 +507,67 @@ class App(object):
             resp = self.find_item_rewards(req, resp)
         elif req.path_info == PREFIX + "item_name_list":
             resp = self.get_all_names(req, resp)
+        elif req.path_info == PREFIX + "complete":
+            resp = self.complete(req, resp)
+        elif req.path_info == PREFIX + "health":
+            resp = self.health(req, resp)
+        elif req.path_info == PREFIX + "damage":
+            resp = self.get_damage(req, resp)
+        elif req.path_info.startswith(JSONAPI_PREFIX):
+            resp = self.get_jsonapi_file(req, resp)
         else:
             resp = exc.HTTPNotFound()
 
         return resp(environ, start_response)
 
+    def is_cached(self, environ):
+        """
+        True if the response for @environ can be made from memory, without
+        DB access, rendering or compression, so an async server can run it
+        on the event loop instead of a worker thread. The rewards cache may
+        evict the item before the request runs, in which case the request
+        is still answered correctly, just slower.
+        """
+        path = environ.get("PATH_INFO", "")
+        if path in (PREFIX + "item_name_list", PREFIX + "complete",
+                    PREFIX + "health"):
+            return True
+        req = Request(environ)
+        if path == PREFIX + "rewards":
+            item_name = normalize_item_name(req.params.get("item_name", ""))
+            return item_name in self.rewards_cache
+        if path == PREFIX + "damage":
+            try:
+                query = self._damage_query(req)
+            except ValueError:
+                return True
+            cached = self.damage_cache.get(query.key())
+            if isinstance(cached, PrecompressedBody):
+                return cached.is_encoded(req)
+            return cached is not None
+        if path.startswith(JSONAPI_PREFIX):
+            url_game, _, file_path = path[len(JSONAPI_PREFIX):].partition("/")
+            game = JSONAPI_GAMES.get(url_game)
+            if game is None or not file_path:
+                return True
+            # not loaded is a quick 404 or 503
+            body = self.jsonapi.get(game, file_path, load=False)
+            return body is None or body.is_encoded(req)
+        return False
+
+    def health(self, req, resp):
+        """
+        For load balancer health checks. Answered from memory, so it shows
+        the process is responding, not that the DB works.
+        """
+        resp.cache_control = "no-cache"
+        resp.content_type = "application/json"
+        resp.body = json.dumps(dict(
+            status="ok", pid=os.getpid(),
+            rewards_cache=len(self.rewards_cache),
+            damage_cache=len(self.damage_cache))).encode("utf8")
+        return resp
+
     def index(self, req, resp):
         resp.cache_control = "max-age=86400"
         html_path = os.path.join(self.web_path, "index.html")
@@ -65,52 +576,207 @@ class App(object):
         return resp
 
     def find_item_rewards(self, req, resp):
-        version = "1"
-        etag = DB_VERSION + version
+        item_name = normalize_item_name(req.params.get("item_name", ""))
+        cached = self.rewards_cache.get(item_name)
+        if cached is None:
+            try:
+                cached = self.rewards_flight.do(item_name,
+                                                self._load_item_rewards,
+                                                item_name)
+            except TimeoutError:
+                self.log.warning("timeout waiting for rewards '%s'",
+                                 item_name)
+                return exc.HTTPServiceUnavailable(retry_after=5)
+        body, etag = cached
+
         resp.cache_control = "public, max-age=" + MAX_AGE
         resp.etag = etag
-
         if etag in req.if_none_match:
-            return exc.HTTPNotModified()
+            return exc.HTTPNotModified(etag=etag,
+                                       cache_control=resp.cache_control)
 
         resp.content_type = "text/plain"
+        resp.charset = "utf8"
+        resp.body = body
+        return resp
 
-        item_name = req.params.get("item_name", "").strip()
+    def _load_item_rewards(self, item_name):
+        """
+        Render and cache the rewards for @item_name, unless another
+        request did it while this one was waiting for the flight.
+        """
+        cached = self.rewards_cache.get(item_name)
+        if cached is None:
+            cached = self._render_item_rewards(item_name)
+            self.rewards_cache.put(item_name, cached)
+        return cached
+
+    def _render_item_rewards(self, item_name):
+        """
+        Render the rewards text for @item_name, returns (body, etag).
+        """
+        out = io.StringIO()
         if not item_name:
-            resp.body = "Please enter an item name"
+            out.write("Please enter an item name")
         else:
-            item_row = rewards.find_item(self.db, item_name, resp.body_file)
+            item_row = rewards.find_item(self.db, item_name, out)
             if item_row is not None:
                 ir = rewards.ItemRewards(self.db, item_row)
-                ir.print_recommended_hunts(resp.body_file)
-                ir.print_monsters(resp.body_file)
-                ir.print_quests(resp.body_file)
-        return resp
+                ir.print_recommended_hunts(out)
+                ir.print_monsters(out)
+                ir.print_quests(out)
+        body = out.getvalue().encode("utf8")
+        return body, content_etag(body)
 
     def get_all_names(self, req, resp):
-        version = "2"
-        etag = DB_VERSION + version
-        resp.cache_control = "public, max-age=" + MAX_AGE
-        resp.etag = etag
+        return self.item_names_body.response(req,
+                                             "public, max-age=" + MAX_AGE)
 
-        if etag in req.if_none_match:
-            return exc.HTTPNotModified()
+    def _build_item_names(self):
+        """
+        JSON list of all item names, only changes with the DB so it is
+        built and compressed once.
+        """
+        names = self.db.get_item_names(rewards.ITEM_TYPES)
+        body = json.dumps(list(names), ensure_ascii=False).encode("utf8")
+        return PrecompressedBody(body, "application/json", "utf8")
 
+    def get_jsonapi_file(self, req, resp):
+        url_game, _, path = req.path_info[len(JSONAPI_PREFIX):].partition("/")
+        game = JSONAPI_GAMES.get(url_game)
+        if game is None or not path or ".." in path.split("/"):
+            return exc.HTTPNotFound()
+        try:
+            body = self.jsonapi.get(game, path)
+        except JsonApiLoading:
+            return exc.HTTPServiceUnavailable(retry_after=10)
+        if body is None:
+            return exc.HTTPNotFound()
+        return body.response(req, "public, max-age=" + MAX_AGE)
+
+    def get_damage(self, req, resp):
+        """
+        Rank weapons by damage to a monster, as JSON. Parameters:
+
+        monster: full monster name
+        weapon: weapon name, can be repeated
+        type, element: all final weapons of the type, optionally only
+                       those with the element or status (or Raw)
+        motion or match_motion: custom motion value, or average of motions
+                                with names containing the value
+        parts: comma separated parts to include
+        game: 4u (default), 3u or gu, if the DB is installed
+        skills by name, e.g. attack_up=2, see DamageQuery.SKILLS
+        """
+        try:
+            query = self._damage_query(req)
+        except ValueError as e:
+            return exc.HTTPBadRequest(str(e))
+        key = query.key()
+        cached = self.damage_cache.get(key)
+        if cached is None:
+            try:
+                cached = self.damage_flight.do(key, self._load_damage,
+                                               query)
+            except ValueError as e:
+                return exc.HTTPBadRequest(str(e))
+            except TimeoutError:
+                self.log.warning("timeout waiting for damage %r", key)
+                return exc.HTTPServiceUnavailable(retry_after=5)
+        if isinstance(cached, damagerank.DamageBudgetExceeded):
+            return exc.HTTPUnprocessableEntity(
+                str(cached) + ", use fewer weapons or motions")
+        return cached.response(req, "public, max-age=" + MAX_AGE)
+
+    def _damage_query(self, req):
+        """
+        DamageQuery from the request params, raises ValueError.
+        """
+        params = req.params
+        skills = dict((name, params[name]) for name in
+                      damagerank.DamageQuery.SKILLS if name in params)
+        motion = params.get("motion") or None
+        parts = params.get("parts")
+        return damagerank.DamageQuery(
+                    params.get("monster"),
+                    weapons=params.getall("weapon"),
+                    weapon_type=params.get("type"),
+                    element=params.get("element"),
+                    skills=skills,
+                    motion=motion,
+                    match_motion=params.get("match_motion"),
+                    parts=parts.split(",") if parts else None,
+                    game=params.get("game") or "4u")
+
+    def _load_damage(self, query):
+        key = query.key()
+        cached = self.damage_cache.get(key)
+        if cached is not None:
+            return cached
+        db, motiondb = self._get_damage_game(query.game)
+        try:
+            result = damagerank.rank_weapons(db, motiondb, query,
+                                             DAMAGE_CPU_BUDGET)
+        except damagerank.DamageBudgetExceeded as e:
+            self.log.warning("damage %r: %s", key, e)
+            cached = e
+        else:
+            result["game"] = query.game
+            body = json.dumps(result, sort_keys=True).encode("utf8")
+            cached = PrecompressedBody(body, "application/json", "utf8",
+                                       eager=False)
+        self.damage_cache.put(key, cached)
+        return cached
+
+    def _get_damage_game(self, game):
+        """
+        (db, motiondb) for @game, loaded on first use. Raises ValueError
+        if the game DB is not installed.
+        """
+        if not mhdb.db_exists(game):
+            raise ValueError("Game not available: %s" % game)
+        with self._damage_games_lock:
+            loaded = self._damage_games.get(game)
+            if loaded is None:
+                if game == "4u":
+                    db = self.db
+                else:
+                    db = ThreadLocalDB(game, mhdb._db_path(game))
+                motion_path = os.path.join(self.project_path, "db", game,
+                                           "motion_values.json")
+                if not os.path.exists(motion_path):
+                    motion_path = os.path.join(self.project_path, "db",
+                                               "motion_values.json")
+                loaded = (db, MotionValueDB(motion_path))
+                self._damage_games[game] = loaded
+        return loaded
+
+    def complete(self, req, resp):
+        try:
+            n = int(req.params.get("n", COMPLETE_DEFAULT_N))
+        except ValueError:
+            return exc.HTTPBadRequest("n must be an integer")
+        matches = self.name_index.complete(req.params.get("q", ""), n)
+        resp.cache_control = "public, max-age=" + MAX_AGE
         resp.content_type = "application/json"
-        resp.body_file.write("[")
-        items = self.db.get_item_names(rewards.ITEM_TYPES)
-        first = True
-        for item in items:
-            if first:
-                first = False
-            else:
-                resp.body_file.write(", ")
-            resp.body_file.write('"')
-            resp.body_file.write(item["name"])
-            resp.body_file.write('"')
-        resp.body_file.write("]")
+        resp.charset = "utf8"
+        resp.body = json.dumps([dict(name=name, type=name_type)
+                                for name, name_type in matches],
+                               ensure_ascii=False).encode("utf8")
         return resp
 
+    def _build_name_index(self):
+        """
+        Completion index over item, monster, weapon and skill names, so
+        requests don't need the DB.
+        """
+        weights = None
+        if COMPLETE_WEIGHTS_PATH:
+            with open(COMPLETE_WEIGHTS_PATH, encoding="utf8") as f:
+                weights = json.load(f)
+        return NameIndex(db_name_entries(self.db, rewards.ITEM_TYPES,
+                                         weights))
+
 
 application = App()
 
@@ -0,0 +1,11 @@
+"""
+Hack to get tests to run from source checkout without having to set
+PYTHONPATH.
+"""
+
+import sys
+from os.path import dirname, join, abspath
+
+tests_path = dirname(__file__)
+project_path = abspath(join(tests_path, ".."))
+sys.path.insert(0, project_path)
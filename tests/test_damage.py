@@ -0,0 +1,81 @@
+import random
+import unittest
+
+import _pathfix
+
+from mhapi.damage import BreakEvenEnvelope
+
+
+def line_damage(line, ratio):
+    key, raw, element = line
+    return raw * ratio + element
+
+
+class BreakEvenEnvelopeTest(unittest.TestCase):
+    def test_breakpoints(self):
+        envelope = BreakEvenEnvelope([
+            ("raw", 30, 0),
+            ("balanced", 20, 30),
+            ("element", 10, 50),
+            # below balanced at every ratio
+            ("dominated", 15, 30),
+        ])
+        self.assertEqual(envelope.intervals(), [
+            (0.0, 2.0, "element"),
+            (2.0, 3.0, "balanced"),
+            (3.0, float("inf"), "raw"),
+        ])
+        self.assertEqual(envelope.best(0), "element")
+        self.assertEqual(envelope.best(1.99), "element")
+        self.assertEqual(envelope.best(2.5), "balanced")
+        self.assertEqual(envelope.best(10), "raw")
+        self.assertEqual(envelope.best(None), "raw")
+
+    def test_same_slope(self):
+        envelope = BreakEvenEnvelope([
+            ("low", 20, 10),
+            ("high", 20, 30),
+            ("tie", 20, 30),
+        ])
+        self.assertEqual(envelope.intervals(),
+                         [(0.0, float("inf"), "high")])
+
+    def test_crossing_below_zero(self):
+        # better at every ratio, the break even ratio is negative
+        envelope = BreakEvenEnvelope([
+            ("weak", 10, 10),
+            ("strong", 20, 30),
+        ])
+        self.assertEqual(envelope.intervals(),
+                         [(0.0, float("inf"), "strong")])
+
+    def test_matches_brute_force(self):
+        rng = random.Random(1)
+        for i in range(50):
+            lines = [(j, rng.randint(1, 40), rng.randint(0, 60))
+                     for j in range(rng.randint(1, 12))]
+            envelope = BreakEvenEnvelope(lines)
+            starts = [start for start, end, key in envelope.intervals()]
+            self.assertEqual(starts, sorted(starts))
+            for ratio in [rng.uniform(0, 10) for k in range(20)]:
+                best = max(line_damage(line, ratio) for line in lines)
+                key = envelope.best(ratio)
+                self.assertAlmostEqual(line_damage(lines[key], ratio), best)
+
+    def test_map_parts(self):
+        envelope = BreakEvenEnvelope([
+            ("raw", 30, 0),
+            ("element", 10, 50),
+        ])
+        parts = envelope.map_parts([
+            ("Head", 60, 20, 3.0),
+            ("Tail", 20, 40, 0.5),
+            ("Shell", 30, 0, 0),
+        ])
+        self.assertEqual([(part, key) for part, h, e, r, key in parts],
+                         [("Head", "raw"), ("Tail", "element"),
+                          ("Shell", "raw")])
+
+
+if __name__ == '__main__':
+    unittest.main()
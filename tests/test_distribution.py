@@ -0,0 +1,149 @@
+import unittest
+
+import _pathfix
+
+import numpy as np
+
+from mhapi.db import MHDB, db_exists
+from mhapi.damage import WeaponMonsterDamage, MotionValue
+from mhapi import distribution
+from mhapi.distribution import DamageDistribution, KillHits
+
+
+# one hit that crits 20% of the time and negative crits 10% of the time
+CRIT_VALUES = [75, 100, 125]
+CRIT_PROBS = [0.1, 0.7, 0.2]
+
+
+def closed_form(values, probs):
+    mean = sum(v * p for v, p in zip(values, probs))
+    variance = sum((v - mean) ** 2 * p for v, p in zip(values, probs))
+    return mean, variance
+
+
+class DamageDistributionTest(unittest.TestCase):
+    def test_from_outcomes(self):
+        dist = DamageDistribution.from_outcomes(CRIT_VALUES, CRIT_PROBS)
+        mean, variance = closed_form(CRIT_VALUES, CRIT_PROBS)
+        self.assertAlmostEqual(dist.mean(), mean)
+        self.assertAlmostEqual(dist.variance(), variance)
+        self.assertEqual(dist.percentile(5), 75)
+        self.assertEqual(dist.percentile(50), 100)
+        self.assertEqual(dist.percentile(90), 125)
+
+    def test_repeat(self):
+        # 100 hits is past the direct convolution size, uses the FFT
+        dist = DamageDistribution.from_outcomes(CRIT_VALUES, CRIT_PROBS)
+        mean, variance = closed_form(CRIT_VALUES, CRIT_PROBS)
+        for n in (1, 2, 5, 100):
+            total = dist.repeat(n)
+            self.assertAlmostEqual(total.pmf.sum(), 1.0)
+            self.assertAlmostEqual(total.mean(), n * mean, places=6)
+            self.assertAlmostEqual(total.variance(), n * variance,
+                                   places=4)
+        self.assertEqual(list(dist.repeat(0).pmf), [1.0])
+
+    def test_repeat_matches_convolve(self):
+        dist = DamageDistribution.from_outcomes(CRIT_VALUES, CRIT_PROBS)
+        total = dist
+        for i in range(3):
+            total = total.convolve(dist)
+        np.testing.assert_allclose(total.pmf, dist.repeat(4).pmf,
+                                   atol=1e-12)
+
+    def test_convolve_adds_mean_and_variance(self):
+        a = DamageDistribution.from_outcomes(CRIT_VALUES, CRIT_PROBS)
+        b = DamageDistribution.from_outcomes([30, 40], [0.5, 0.5])
+        for x, y in ((a, b), (a.repeat(10), b.repeat(10))):
+            total = x.convolve(y)
+            self.assertAlmostEqual(total.mean(), x.mean() + y.mean(),
+                                   places=6)
+            self.assertAlmostEqual(total.variance(),
+                                   x.variance() + y.variance(), places=4)
+
+    def test_resolution(self):
+        dist = DamageDistribution.from_outcomes([12.5, 25.0], [0.5, 0.5],
+                                                resolution=0.5)
+        self.assertAlmostEqual(dist.mean(), 18.75)
+        self.assertAlmostEqual(dist.repeat(3).mean(), 56.25)
+
+    def test_negative_damage(self):
+        with self.assertRaises(ValueError):
+            DamageDistribution.from_outcomes([-1, 10], [0.5, 0.5])
+
+
+class KillHitsTest(unittest.TestCase):
+    def setUp(self):
+        self.dist = DamageDistribution.from_outcomes(CRIT_VALUES, CRIT_PROBS)
+
+    def test_p_kill(self):
+        hp = 1000
+        kill_hits = KillHits(self.dist, hp)
+        for n in (1, 5, 9, 10, 11, 13, 20):
+            # P(total >= hp) from the n hit distribution directly
+            cdf = self.dist.repeat(n).cdf()
+            expected = 1.0 - cdf[hp - 1] if len(cdf) >= hp else 0.0
+            self.assertAlmostEqual(kill_hits.p_kill(n), expected, places=9)
+        self.assertEqual(kill_hits.p_kill(0), 0.0)
+        self.assertAlmostEqual(kill_hits.p_kill(14), 1.0)
+
+    def test_percentiles(self):
+        kill_hits = KillHits(self.dist, 5000)
+        for q, hits in zip((10, 50, 90), kill_hits.percentiles((10, 50, 90))):
+            self.assertGreaterEqual(kill_hits.p_kill(hits), q / 100.0)
+            self.assertLess(kill_hits.p_kill(hits - 1), q / 100.0)
+
+    def test_no_damage(self):
+        with self.assertRaises(ValueError):
+            KillHits(DamageDistribution([1.0]), 100)
+
+
+@unittest.skipUnless(db_exists("4u"), "needs the 4u DB")
+class WeaponDistributionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db = MHDB(game="4u")
+        cls.monster = cls.db.get_monster_by_name("Rathalos")
+        cls.monster_damage = cls.db.get_monster_damage(cls.monster.id)
+        cls.motion = MotionValue("Test", types=[0, 0], powers=[20, 30])
+
+    def weapon_damage(self, name):
+        weapon = self.db.get_weapon_by_name(name)
+        return WeaponMonsterDamage(weapon, self.monster,
+                                   self.monster_damage, self.motion)
+
+    def test_crit_probabilities(self):
+        self.assertEqual(
+            distribution.crit_probabilities(self.weapon_damage("Aikuchi")),
+            (0.1, 0.0))
+        self.assertEqual(
+            distribution.crit_probabilities(
+                self.weapon_damage("Eager Cleaver")),
+            (0.0, 0.05))
+        # chaotic gore -45/20
+        self.assertEqual(
+            distribution.crit_probabilities(
+                self.weapon_damage("Düster/Éclat")),
+            (0.45, 0.2))
+
+    def test_mean_matches_expected_damage(self):
+        # the expected damage uses the expected affinity and rounds down
+        # once per hit, the distribution rounds down each crit outcome
+        hits = 50
+        for name in ("Aikuchi", "Eager Cleaver", "Düster/Éclat"):
+            wd = self.weapon_damage(name)
+            for part in wd.parts:
+                dist = distribution.motion_distribution(wd, part)
+                self.assertAlmostEqual(dist.pmf.sum(), 1.0)
+                self.assertLess(abs(dist.mean() - wd[part].average()),
+                                len(self.motion.powers))
+            hit_dist = distribution.hit_distribution(wd)
+            total = distribution.total_damage_distribution(wd, hits)
+            self.assertAlmostEqual(total.mean(), hits * hit_dist.mean(),
+                                   places=6)
+            self.assertAlmostEqual(total.variance(),
+                                   hits * hit_dist.variance(), places=4)
+
+
+if __name__ == '__main__':
+    unittest.main()
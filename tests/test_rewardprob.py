@@ -0,0 +1,91 @@
+import unittest
+from math import comb
+
+import _pathfix
+
+import numpy as np
+
+from mhapi.db import MHDB, db_exists
+from mhapi.distribution import DamageDistribution
+from mhapi import rewards
+from mhapi import rewardprob
+
+
+def binomial_at_least(k, n, p):
+    return sum(comb(n, j) * p ** j * (1 - p) ** (n - j)
+               for j in range(k, n + 1))
+
+
+class FarmingOddsTest(unittest.TestCase):
+    def odds(self, pmf):
+        return rewardprob.FarmingOdds(1, None, rewards.STRAT_KILL,
+                                      DamageDistribution(pmf))
+
+    def test_p_at_least_binomial(self):
+        # at most one per run, the count after n runs is binomial
+        for p in (0.05, 0.3, 0.9):
+            odds = self.odds([1 - p, p])
+            for k in (1, 2, 5):
+                for n in (1, 3, 10, 40):
+                    self.assertAlmostEqual(odds.p_at_least(k, n),
+                                           binomial_at_least(k, n, p),
+                                           places=9)
+
+    def test_p_at_least_edges(self):
+        odds = self.odds([0.5, 0.5])
+        self.assertEqual(odds.p_at_least(0, 0), 1.0)
+        self.assertEqual(odds.p_at_least(1, 0), 0.0)
+        self.assertEqual(self.odds([1.0]).p_at_least(1, 10), 0.0)
+
+    def test_runs_for(self):
+        odds = self.odds([0.75, 0.25])
+        for q, runs in zip((50, 90), odds.runs_for(3, (50, 90))):
+            self.assertGreaterEqual(odds.p_at_least(3, runs), q / 100.0)
+            self.assertLess(odds.p_at_least(3, runs - 1), q / 100.0)
+        with self.assertRaises(ValueError):
+            self.odds([1.0]).runs_for(1)
+
+    def test_expected_runs(self):
+        # negative binomial, k / p runs on average
+        p = 0.25
+        self.assertAlmostEqual(self.odds([1 - p, p]).expected_runs(3),
+                               3 / p)
+        # two per run, one run is always enough for two
+        self.assertAlmostEqual(self.odds([0.0, 0.0, 1.0]).expected_runs(2),
+                               1.0)
+        self.assertIsNone(self.odds([1.0]).expected_runs(1))
+
+    def test_draws_pmf(self):
+        # one or two draws, each a 50% chance of one item
+        pmf = rewardprob.draws_pmf([0.0, 0.5, 0.5], [0.5, 0.5])
+        np.testing.assert_allclose(pmf, [0.375, 0.5, 0.125])
+
+
+@unittest.skipUnless(db_exists("4u"), "needs the 4u DB")
+class ItemFarmingOddsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db = MHDB(game="4u")
+        cls.rewards_db = rewards.BulkRewardsDB(cls.db)
+
+    def test_mean_matches_expected_value(self):
+        # hunt-only, quest reward and capture reward items
+        skills = rewards.RankAndSkills("G")
+        for name in ("Carapaceon Brains", "Zinogre Jasper",
+                     "Rathalos Ruby"):
+            item = self.db.get_item_by_name(name)
+            ir = rewards.ItemRewards(self.rewards_db, item)
+            odds_list = rewardprob.item_farming_odds(self.rewards_db, item)
+            self.assertTrue(odds_list)
+            for odds in odds_list:
+                # gathering is not included in the odds
+                strats = skills.quest_strats(
+                            odds.quest, ir.get_quest_item(odds.quest.id),
+                            ir.get_quest_hunt_items(odds.quest), None)
+                strat = [s for s in strats if s.strat == odds.strat][0]
+                self.assertAlmostEqual(odds.mean, strat.ev / 100.0)
+                self.assertAlmostEqual(odds.run_dist.pmf.sum(), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
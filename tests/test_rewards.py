@@ -0,0 +1,79 @@
+import unittest
+
+import _pathfix
+
+from mhapi.db import MHDB, db_exists
+from mhapi import rewards
+
+
+@unittest.skipUnless(db_exists("4u"), "needs the 4u DB")
+class PlanFarmingTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db = MHDB(game="4u")
+        cls.rewards_db = rewards.BulkRewardsDB(cls.db)
+
+    def plan(self, *names_counts, **kwargs):
+        items = [(self.db.get_item_by_name(name), count)
+                 for name, count in names_counts]
+        return rewards.plan_farming(self.rewards_db, items, **kwargs)
+
+    def quest_reward_ids(self, quest):
+        return set(r["item_id"] for r in self.db.get_quest_rewards(quest.id))
+
+    def test_hunt_only_quest(self):
+        # carved from Hermitaur, never a quest reward
+        item = self.db.get_item_by_name("Carapaceon Brains")
+        plan = self.plan(("Carapaceon Brains", 2))
+        self.assertEqual(plan.unavailable, [])
+        self.assertTrue(plan.steps)
+        for step in plan.steps:
+            self.assertNotIn(item.id, self.quest_reward_ids(step.quest))
+            self.assertGreater(step.yields[0], 0)
+        self.assertGreaterEqual(plan.expected_counts()[0], 2)
+
+    def test_hunt_yield_added_to_quest_reward(self):
+        # Zinogre Jasper is a quest reward and a Zinogre G rank reward, a
+        # Zinogre quest yields both when capping
+        jasper = self.db.get_item_by_name("Zinogre Jasper")
+        ir = rewards.ItemRewards(self.rewards_db, jasper)
+        quest = [q for q in self.rewards_db.get_quests()
+                 if q.name == "Advanced: Fury on the Mount"][0]
+        skills = rewards.RankAndSkills("G")
+        kill, cap = skills.quest_strats(
+                        quest, ir.get_quest_item(quest.id),
+                        ir.get_quest_hunt_items(quest),
+                        ir.get_gather_location(quest.location_id, quest.rank))
+        self.assertGreater(cap.hunt_ev, 0)
+        self.assertAlmostEqual(cap.ev, cap.quest_ev + cap.hunt_ev)
+
+    def test_multi_monster_quest_candidates(self):
+        # multi monster quests hunting Zinogre without Jasper as a quest
+        # reward still yield it
+        plan = self.plan(("Zinogre Jasper", 1))
+        jasper = self.db.get_item_by_name("Zinogre Jasper")
+        ir = rewards.ItemRewards(self.rewards_db, jasper)
+        quests = dict((q.name, q) for q in self.rewards_db.get_quests()
+                      if q.rank == "G")
+        for name in ("Grim Quartet", "Advanced: Monster Hunter!"):
+            quest = quests[name]
+            self.assertNotIn(jasper.id, self.quest_reward_ids(quest))
+            self.assertTrue(ir.get_quest_hunt_items(quest), name)
+        self.assertEqual(plan.unavailable, [])
+
+    def test_counts_met(self):
+        plan = self.plan(("Zinogre Jasper", 3), ("Thunderbug", 5),
+                         ("Fucium Ore", 2))
+        for (item, count), total in zip(plan.items,
+                                        plan.expected_counts()):
+            self.assertGreaterEqual(total, count - 1e-9, item.name)
+
+    def test_rank_limits_quests(self):
+        plan = self.plan(("Thunderbug", 5), rank="LR")
+        self.assertTrue(plan.steps)
+        for step in plan.steps:
+            self.assertEqual(step.quest.rank, "LR")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import threading
+import time
+import unittest
+
+import _pathfix
+
+from mhapi.web.wsgi import LRUCache, SingleFlight
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        # a is now more recent than b
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_put_refreshes(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.put("a", 10)
+        cache.put("c", 3)
+        self.assertEqual(cache.get("a"), 10)
+        self.assertNotIn("b", cache)
+
+    def test_hits_and_misses(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("b", "default"), "default")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.put("a", 1)
+        self.assertNotIn("a", cache)
+        self.assertEqual(len(cache), 0)
+
+
+class SingleFlightTest(unittest.TestCase):
+    def run_waiters(self, flight, key, n):
+        """
+        Start @n threads calling flight.do for @key once the leader is
+        running. Returns (threads, results), results gets ("ok", value)
+        or ("error", exception) for each thread.
+        """
+        results = []
+
+        def wait():
+            try:
+                results.append(("ok", flight.do(key, self.fail_if_called)))
+            except Exception as e:
+                results.append(("error", e))
+
+        threads = [threading.Thread(target=wait) for i in range(n)]
+        for t in threads:
+            t.start()
+        return threads, results
+
+    def fail_if_called(self):
+        raise AssertionError("waiting thread ran the call")
+
+    def wait_for_shared(self, flight, n):
+        # waiters count as shared before they block on the leader
+        for i in range(500):
+            if flight.shared >= n:
+                return
+            time.sleep(0.01)
+        self.fail("waiting threads didn't start")
+
+    def test_result_shared(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def leader():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "value"
+
+        result = []
+        t = threading.Thread(
+                target=lambda: result.append(flight.do("key", leader)))
+        t.start()
+        started.wait(5)
+        threads, results = self.run_waiters(flight, "key", 3)
+        self.wait_for_shared(flight, 3)
+        release.set()
+        for t2 in threads + [t]:
+            t2.join(5)
+        self.assertEqual(result, ["value"])
+        self.assertEqual(results, [("ok", "value")] * 3)
+        self.assertEqual(len(calls), 1)
+
+    def test_error_propagates_to_waiters(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        error = ValueError("failed")
+
+        def leader():
+            started.set()
+            release.wait(5)
+            raise error
+
+        leader_errors = []
+
+        def run_leader():
+            try:
+                flight.do("key", leader)
+            except ValueError as e:
+                leader_errors.append(e)
+
+        t = threading.Thread(target=run_leader)
+        t.start()
+        started.wait(5)
+        threads, results = self.run_waiters(flight, "key", 3)
+        self.wait_for_shared(flight, 3)
+        release.set()
+        for t2 in threads + [t]:
+            t2.join(5)
+        self.assertEqual(leader_errors, [error])
+        self.assertEqual(results, [("error", error)] * 3)
+        # the failed call is not remembered, the next call runs again
+        self.assertEqual(flight.do("key", lambda: "retry"), "retry")
+
+    def test_timeout(self):
+        flight = SingleFlight(timeout=0.05)
+        started = threading.Event()
+        release = threading.Event()
+
+        def leader():
+            started.set()
+            release.wait(5)
+            return "value"
+
+        t = threading.Thread(target=flight.do, args=("key", leader))
+        t.start()
+        started.wait(5)
+        try:
+            with self.assertRaises(TimeoutError):
+                flight.do("key", self.fail_if_called)
+            # other keys don't wait
+            self.assertEqual(flight.do("other", lambda: "other"), "other")
+        finally:
+            release.set()
+            t.join(5)
+
+
+if __name__ == '__main__':
+    unittest.main()